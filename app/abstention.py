@@ -0,0 +1,102 @@
+"""
+Abstención temprana por score de recuperación.
+
+Si el mejor score de Qdrant (similitud coseno) para la pregunta queda bajo
+``RAG_ABSTAIN_THRESHOLD``, se responde el texto de abstención del prompt sin
+llamar al LLM. El umbral se calibra con ``scripts/calibrate_abstention.py``
+sobre los sets answerable/unanswerable; sin umbral el atajo está apagado.
+
+``AbstentionGate`` cuenta las llamadas al LLM evitadas y estima los segundos
+ahorrados con la latencia media observada de las que sí se hicieron.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Tuple
+
+from langchain_community.vectorstores import Qdrant
+from langchain_core.documents import Document
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from app.eval_store import latency_summary
+from app.rag_prompt import ABSTENTION_TEXT, RAG_PROMPT, format_docs
+from app.vectorstore import retrieve_with_scores
+
+ScoredDocs = List[Tuple[Document, float]]
+
+
+class AbstentionGate:
+    """Decide la abstención por score y lleva la cuenta de lo ahorrado."""
+
+    def __init__(self, threshold: float, window: int = 1000):
+        self.threshold = threshold
+        self._lock = threading.Lock()
+        self._questions = 0
+        self._abstained = 0
+        self._fast_latencies: deque = deque(maxlen=window)
+        self._llm_latencies: deque = deque(maxlen=window)
+
+    def should_abstain(self, scored: ScoredDocs) -> bool:
+        best = max((score for _, score in scored), default=None)
+        abstain = best is None or best < self.threshold
+        with self._lock:
+            self._questions += 1
+            self._abstained += abstain
+        return abstain
+
+    def record_fast_path(self, seconds: float) -> None:
+        with self._lock:
+            self._fast_latencies.append(seconds)
+
+    def record_llm(self, seconds: float) -> None:
+        with self._lock:
+            self._llm_latencies.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            llm = list(self._llm_latencies)
+            mean_llm = sum(llm) / len(llm) if llm else None
+            return {
+                "threshold": self.threshold,
+                "questions": self._questions,
+                "abstained": self._abstained,
+                "abstention_rate": round(self._abstained / self._questions, 4) if self._questions else None,
+                "llm_calls_saved": self._abstained,
+                "seconds_saved_estimate": round(self._abstained * mean_llm, 3) if mean_llm is not None else None,
+                "fast_path_latency_s": latency_summary(list(self._fast_latencies)),
+                "llm_latency_s": latency_summary(llm),
+            }
+
+
+def abstaining_chain(
+    vectorstore: Qdrant,
+    llm: BaseChatModel,
+    gate: AbstentionGate,
+    search_type: str,
+    search_kwargs: Callable[[], Dict[str, Any]],
+) -> Runnable:
+    """
+    Cadena RAG equivalente a la clásica (mismo prompt y mismos documentos)
+    que se abstiene sin LLM cuando el mejor score no alcanza el umbral.
+    """
+    answer_chain = RAG_PROMPT | llm | StrOutputParser()
+
+    def invoke(question: str, config: RunnableConfig) -> str:
+        t0 = time.perf_counter()
+        kwargs = (config.get("configurable") or {}).get("rag_search_kwargs") or search_kwargs()
+        scored = retrieve_with_scores(vectorstore, question, search_type, kwargs)
+        if gate.should_abstain(scored):
+            gate.record_fast_path(time.perf_counter() - t0)
+            return ABSTENTION_TEXT
+        t1 = time.perf_counter()
+        text = answer_chain.invoke({"question": question, "context": format_docs([d for d, _ in scored])})
+        gate.record_llm(time.perf_counter() - t1)
+        return text
+
+    return RunnableLambda(invoke)
+
@@ -0,0 +1,174 @@
+"""
+Backends inyectables del servidor: LLM y cliente Qdrant.
+
+Con ``RAG_BACKEND=offline`` el servidor arma exactamente la misma cadena RAG
+pero sin red: embeddings por hashing (ver ``app.embeddings``), un chat model
+falso con latencia y velocidad de tokens configurables y Qdrant local
+(``QDRANT_PATH``: directorio o ``:memory:``). Sirve para medir el overhead
+propio del framework, el escalado con concurrencia y la memoria en cualquier
+máquina.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from qdrant_client import QdrantClient
+
+from app.usage import usage_callback
+
+_clients: Dict[tuple, QdrantClient] = {}
+_lock = threading.Lock()
+
+
+def offline_mode() -> bool:
+    return (os.getenv("RAG_BACKEND") or "openai").lower() == "offline"
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)) or default)
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model determinístico que simula la latencia de un LLM remoto.
+
+    Espera ``latency_s`` antes del primer token y luego emite ``tokens``
+    palabras a ``tokens_per_s`` (0 = sin espera). La respuesta repite palabras
+    del último mensaje, así que su tamaño no depende del contexto recuperado.
+    """
+
+    latency_s: float = 0.0
+    tokens_per_s: float = 0.0
+    tokens: int = 64
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _words(self, messages: List[BaseMessage]) -> List[str]:
+        source = str(messages[-1].content).split() if messages else []
+        source = source or ["respuesta"]
+        return [source[i % len(source)] for i in range(self.tokens)]
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        words = self._words(messages)
+        time.sleep(self.latency_s + self._token_delay() * len(words))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(words)))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        words = self._words(messages)
+        await asyncio.sleep(self.latency_s + self._token_delay() * len(words))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=" ".join(words)))])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.latency_s)
+        for i, word in enumerate(self._words(messages)):
+            time.sleep(self._token_delay())
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else f" {word}"))
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.latency_s)
+        for i, word in enumerate(self._words(messages)):
+            await asyncio.sleep(self._token_delay())
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word if i == 0 else f" {word}"))
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+            yield chunk
+
+
+def get_chat_model(model: str = "gpt-4o", temperature: float = 0.2, **kwargs: Any) -> BaseChatModel:
+    """
+    ``ChatOpenAI`` o, en modo offline, ``FakeChatModel`` según ``RAG_FAKE_LLM_*``;
+    ambos registran su uso de tokens en ``app.usage``.
+    """
+    if offline_mode():
+        return FakeChatModel(
+            latency_s=_env_float("RAG_FAKE_LLM_LATENCY_MS", 0) / 1000,
+            tokens_per_s=_env_float("RAG_FAKE_LLM_TOKENS_PER_S", 0),
+            tokens=int(_env_float("RAG_FAKE_LLM_TOKENS", 64)),
+            callbacks=[usage_callback],
+        )
+    from langchain_openai import ChatOpenAI
+
+    kwargs.setdefault("callbacks", [usage_callback])
+    return ChatOpenAI(model=model, temperature=temperature, **kwargs)
+
+
+def qdrant_collection() -> Optional[str]:
+    default = "rag_offline" if offline_mode() else None
+    return os.getenv("QDRANT_COLLECTION") or default
+
+
+def qdrant_configured() -> bool:
+    """Hay colección y, o bien Qdrant local (``QDRANT_PATH``/offline), o bien URL + API key."""
+    if not qdrant_collection():
+        return False
+    if os.getenv("QDRANT_PATH") or offline_mode():
+        return True
+    return bool(os.getenv("QDRANT_URL") and os.getenv("QDRANT_API_KEY"))
+
+
+def get_qdrant_client() -> QdrantClient:
+    """
+    Cliente Qdrant compartido por proceso (reutiliza conexiones HTTP).
+
+    ``QDRANT_PATH`` selecciona Qdrant embebido (``:memory:`` o un directorio);
+    en modo offline sin ``QDRANT_PATH`` ni ``QDRANT_URL`` se usa ``:memory:``.
+    Qdrant local admite un solo cliente por directorio, de ahí la instancia única.
+    """
+    path = os.getenv("QDRANT_PATH") or (":memory:" if offline_mode() and not os.getenv("QDRANT_URL") else None)
+    if path:
+        settings: tuple = ("path", path)
+    else:
+        url, api_key = os.getenv("QDRANT_URL"), os.getenv("QDRANT_API_KEY")
+        if not (url and api_key):
+            raise RuntimeError("Faltan QDRANT_URL/QDRANT_API_KEY (o QDRANT_PATH) en el entorno")
+        settings = ("url", url, api_key)
+    with _lock:
+        if settings not in _clients:
+            if settings[0] == "url":
+                _clients[settings] = QdrantClient(url=settings[1], api_key=settings[2])
+            elif path == ":memory:":
+                _clients[settings] = QdrantClient(":memory:")
+            else:
+                _clients[settings] = QdrantClient(path=path)
+        return _clients[settings]
@@ -0,0 +1,213 @@
+"""
+Cascada de modelos para la cadena RAG.
+
+Cada pregunta empieza en el modelo más barato de ``RAG_CASCADE_MODELS``
+(por defecto ``gpt-4o-mini,gpt-4o``) salvo que la recuperación tenga poca
+confianza (mejor score bajo ``RAG_CASCADE_MIN_SCORE``) o la pregunta parezca
+difícil (larga o con verbos de análisis/comparación); en ese caso va directo
+al último. La respuesta de un nivel intermedio se acepta solo si pasa los
+chequeos (no vacía, sin abstención pese a contexto confiable, cita alguna
+fuente recuperada); si no, se escala al siguiente.
+
+Con un ``AbstentionGate`` la pregunta puede terminar antes de cualquier
+nivel (ver ``app.abstention``). Por nivel se cuentan llamadas, respuestas aceptadas, escalamientos y
+latencias, y los tokens y el costo de sus llamadas (un ``UsageTracker``
+propio por nivel, además del global de ``app.usage``).
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from langchain_community.vectorstores import Qdrant
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from app.abstention import AbstentionGate, ScoredDocs
+from app.eval_store import latency_summary
+from app.rag_prompt import ABSTENTION_TEXT, RAG_PROMPT, abstention_phrase, format_docs
+from app.usage import UsageCallback, UsageTracker, count_tokens
+from app.vectorstore import retrieve_with_scores
+
+# Palabras que suelen pedir síntesis de varias partes del contexto
+DEFAULT_HARD_PATTERN = (
+    r"\b(compar\w*|diferencia\w*|analiz\w*|por qu[eé]|explica\w*|eval[uú]a\w*|ventajas|desventajas|"
+    r"relaci[oó]n|resum\w*|estrategia\w*|compare|difference\w*|analy[sz]\w*|why|explain\w*)\b"
+)
+
+
+class RAGCascade:
+    """Responde con el modelo más barato que pase los chequeos; expone estadísticas por nivel."""
+
+    def __init__(
+        self,
+        vectorstore: Qdrant,
+        tiers: Sequence[Tuple[str, BaseChatModel]],
+        search_type: str,
+        search_kwargs: Callable[[], Dict[str, Any]],
+        min_score: float = 0.4,
+        max_question_tokens: int = 48,
+        hard_pattern: str = DEFAULT_HARD_PATTERN,
+        min_answer_chars: int = 40,
+        require_citation: bool = True,
+        window: int = 1000,
+        gate: Optional[AbstentionGate] = None,
+    ):
+        if not tiers:
+            raise ValueError("La cascada necesita al menos un modelo")
+        self.vectorstore = vectorstore
+        self.models = [name for name, _ in tiers]
+        self.chains = [RAG_PROMPT | llm | StrOutputParser() for _, llm in tiers]
+        self.search_type = search_type
+        self.search_kwargs = search_kwargs
+        self.min_score = min_score
+        self.max_question_tokens = max_question_tokens
+        self.hard_re = re.compile(hard_pattern, re.IGNORECASE) if hard_pattern else None
+        self.min_answer_chars = min_answer_chars
+        self.require_citation = require_citation
+        self.gate = gate
+        self._lock = threading.Lock()
+        self._questions = 0
+        self._start_reasons: Counter = Counter()
+        self._escalation_reasons: Counter = Counter()
+        self._tiers = [
+            {"calls": 0, "accepted": 0, "escalated": 0, "latencies": deque(maxlen=window)} for _ in tiers
+        ]
+        self._usage = [UsageTracker() for _ in tiers]
+        self._callbacks = [UsageCallback(tracker) for tracker in self._usage]
+
+    # ----- decisiones -----
+
+    def route(self, question: str, scored: ScoredDocs) -> Tuple[int, str]:
+        """Nivel inicial y motivo."""
+        last = len(self.chains) - 1
+        if last == 0:
+            return 0, "single_tier"
+        if not scored:
+            return last, "no_context"
+        best = max(score for _, score in scored)
+        if best < self.min_score:
+            return last, "low_retrieval_score"
+        if count_tokens(question) > self.max_question_tokens:
+            return last, "long_question"
+        if self.hard_re and self.hard_re.search(question):
+            return last, "complex_question"
+        return 0, "confident"
+
+    def check(self, answer: str, scored: ScoredDocs) -> Optional[str]:
+        """Motivo para escalar la respuesta de un nivel intermedio, o None si se acepta."""
+        text = (answer or "").strip()
+        if not text:
+            return "empty_answer"
+        if abstention_phrase() in text.lower():
+            # El contexto pasó el umbral de confianza: un modelo mayor puede encontrar la respuesta
+            return "abstained"
+        if len(text) < self.min_answer_chars:
+            return "short_answer"
+        if self.require_citation:
+            sources = {
+                str(doc.metadata.get("file_name") or doc.metadata.get("source") or "")
+                for doc, _ in scored
+            } - {""}
+            if sources and not any(name in text for name in sources):
+                return "missing_citation"
+        return None
+
+    # ----- ejecución -----
+
+    def answer(
+        self,
+        question: str,
+        search_kwargs: Optional[Dict[str, Any]] = None,
+        scored: Optional[ScoredDocs] = None,
+    ) -> str:
+        """Respuesta del primer nivel aceptado; ``scored`` evita la búsqueda (contexto ya recuperado)."""
+        t_start = time.perf_counter()
+        if scored is None:
+            scored = retrieve_with_scores(
+                self.vectorstore, question, self.search_type, search_kwargs or self.search_kwargs()
+            )
+        if self.gate and self.gate.should_abstain(scored):
+            # Ni el modelo más barato: el contexto no alcanza el umbral calibrado
+            self.gate.record_fast_path(time.perf_counter() - t_start)
+            return ABSTENTION_TEXT
+        t_llm = time.perf_counter()
+        inputs = {"question": question, "context": format_docs([doc for doc, _ in scored])}
+        tier, reason = self.route(question, scored)
+        with self._lock:
+            self._questions += 1
+            self._start_reasons[reason] += 1
+        last = len(self.chains) - 1
+        while True:
+            t0 = time.perf_counter()
+            text = self.chains[tier].invoke(inputs, config={"callbacks": [self._callbacks[tier]]})
+            latency = time.perf_counter() - t0
+            escalate = self.check(text, scored) if tier < last else None
+            with self._lock:
+                stats = self._tiers[tier]
+                stats["calls"] += 1
+                stats["latencies"].append(latency)
+                if escalate:
+                    stats["escalated"] += 1
+                    self._escalation_reasons[escalate] += 1
+                else:
+                    stats["accepted"] += 1
+            if not escalate:
+                if self.gate:
+                    self.gate.record_llm(time.perf_counter() - t_llm)
+                return text
+            tier += 1
+
+    def as_runnable(self) -> Runnable:
+        """
+        Runnable compatible con la cadena clásica: entrada = pregunta; los
+        filtros llegan por ``configurable.rag_search_kwargs`` (como en el retriever).
+        """
+
+        def invoke(question: str, config: RunnableConfig) -> str:
+            search_kwargs = (config.get("configurable") or {}).get("rag_search_kwargs")
+            return self.answer(question, search_kwargs)
+
+        return RunnableLambda(invoke)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            questions = self._questions
+            tiers = []
+            for model, stats, usage in zip(self.models, self._tiers, self._usage):
+                totals = usage.snapshot()["totals"]
+                tiers.append({
+                    "model": model,
+                    "calls": stats["calls"],
+                    "accepted": stats["accepted"],
+                    "escalated": stats["escalated"],
+                    "escalation_rate": round(stats["escalated"] / stats["calls"], 4) if stats["calls"] else None,
+                    "latency_s": latency_summary(list(stats["latencies"])),
+                    "prompt_tokens": totals["prompt_tokens"],
+                    "completion_tokens": totals["completion_tokens"],
+                    "cost_usd": totals["cost_usd"],
+                    "cost_usd_per_call": round(totals["cost_usd"] / stats["calls"], 6) if stats["calls"] else None,
+                })
+            # Preguntas que no resolvió el primer tier (escaladas o que arrancaron más arriba);
+            # sumar los escalados de cada tier contaría dos veces las que suben dos escalones
+            escalated = questions - tiers[0]["accepted"] if tiers else 0
+            return {
+                "models": self.models,
+                "questions": questions,
+                "answered_by": {t["model"]: t["accepted"] for t in tiers},
+                "escalation_rate": round(escalated / questions, 4) if questions else None,
+                "start_reasons": dict(self._start_reasons),
+                "escalation_reasons": dict(self._escalation_reasons),
+                "settings": {
+                    "min_score": self.min_score,
+                    "max_question_tokens": self.max_question_tokens,
+                    "min_answer_chars": self.min_answer_chars,
+                    "require_citation": self.require_citation,
+                },
+                "tiers": tiers,
+            }
@@ -0,0 +1,422 @@
+"""
+Sesiones de conversación para ``/chatgpt/chat`` y ``/rag/query``.
+
+Cada sesión guarda un historial compacto:
+
+- ventana deslizante: los últimos turnos completos que caben en
+  ``window_tokens``; los que salen de la ventana se pliegan en un resumen
+  acumulado (una llamada al modelo barato, ``summary_tokens`` como tope)
+- condensación: con historial, la pregunta de seguimiento se reescribe como
+  pregunta autónoma para la búsqueda ("¿y en el segundo caso?" -> "...")
+- reutilización de contexto: si la pregunta autónoma es casi la misma que la
+  del turno anterior (coseno de embeddings ≥ ``reuse_similarity``, mismo
+  filtro), se reusan los chunks recuperados en vez de volver a buscar
+
+Las sesiones viven en memoria (``MemorySessionStore``) o en SQLite
+(``SQLiteSessionStore``, ``RAG_SESSION_DB``) y expiran tras ``ttl_s`` sin uso.
+Los ids los genera el servidor (un id desconocido es ``UnknownSession``, no
+una sesión nueva) y ``turn`` aplica de a uno los turnos de una misma sesión.
+"""
+
+from __future__ import annotations
+
+import copy
+import json
+import weakref
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from app.abstention import ScoredDocs
+from app.usage import count_tokens
+
+Session = Dict[str, Any]
+
+MAX_SESSION_ID_LEN = 128
+
+CONDENSE_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "Rewrite the user's follow-up question as a standalone question that can be understood without the conversation. "
+     "Keep the language of the question and any names, files, figures and dates it refers to. "
+     "If it is already standalone, return it unchanged. Return only the question."),
+    ("human",
+     "Conversation summary:\n{summary}\n\n"
+     "Recent turns:\n{history}\n\n"
+     "Follow-up question: {question}\n\n"
+     "Standalone question:"),
+])
+
+SUMMARY_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "You maintain a running summary of a conversation between a user and an assistant. "
+     "Merge the new turns into the existing summary, keeping facts, decisions, names, files and open questions. "
+     "Write in the language of the conversation, in at most {max_words} words. Return only the summary."),
+    ("human", "Existing summary:\n{summary}\n\nNew turns:\n{turns}\n\nUpdated summary:"),
+])
+
+
+class UnknownSession(LookupError):
+    """El session_id no existe o expiró (los ids los genera solo el servidor)."""
+
+
+class _TurnLock:
+    """``threading.Lock`` con weakref: el candado de una sesión vive mientras alguien lo usa."""
+
+    __slots__ = ("_lock", "__weakref__")
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "_TurnLock":
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._lock.release()
+
+
+def new_session() -> Session:
+    now = time.time()
+    return {
+        "id": str(uuid.uuid4()),
+        "created_at": now,
+        "updated_at": now,
+        # Colección de la primera consulta RAG: la sesión queda atada a ella (y a sus permisos)
+        "collection": None,
+        "turns": [],
+        "summary": "",
+        "summarized_turns": 0,
+        "last_query": None,
+        "last_filter": None,
+        "last_docs": [],
+    }
+
+
+# =============================
+# Almacenes
+# =============================
+
+class MemorySessionStore:
+    """Sesiones en un LRU en memoria con expiración por inactividad."""
+
+    def __init__(self, ttl_s: float = 3600.0, max_sessions: int = 10000):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.time() - session["updated_at"] > self.ttl_s:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            # Copias: cada request trabaja sobre la suya, como con SQLite
+            return copy.deepcopy(session)
+
+    def save(self, session: Session) -> None:
+        session = copy.deepcopy(session)
+        with self._lock:
+            self._sessions[session["id"]] = session
+            self._sessions.move_to_end(session["id"])
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def purge(self) -> int:
+        cutoff = time.time() - self.ttl_s
+        with self._lock:
+            expired = [sid for sid, s in self._sessions.items() if s["updated_at"] < cutoff]
+            for sid in expired:
+                del self._sessions[sid]
+            return len(expired)
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    updated_at REAL NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_updated ON sessions(updated_at);
+"""
+
+
+class SQLiteSessionStore:
+    """Sesiones en SQLite (sobreviven reinicios y se comparten entre workers)."""
+
+    def __init__(self, path: Path, ttl_s: float = 3600.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl_s = ttl_s
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, session_id: str) -> Optional[Session]:
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute(
+                "SELECT data FROM sessions WHERE id = ? AND updated_at >= ?",
+                (session_id, time.time() - self.ttl_s),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, session: Session) -> None:
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (id, updated_at, data) VALUES (?, ?, ?)",
+                (session["id"], session["updated_at"], json.dumps(session, ensure_ascii=False)),
+            )
+
+    def delete(self, session_id: str) -> bool:
+        with closing(self._connect()) as conn, conn:
+            return conn.execute("DELETE FROM sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def purge(self) -> int:
+        with closing(self._connect()) as conn, conn:
+            return conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl_s,)).rowcount
+
+    def count(self) -> int:
+        with closing(self._connect()) as conn, conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+# =============================
+# Memoria de conversación
+# =============================
+
+class ConversationMemory:
+    """Historial acotado por tokens, condensación de preguntas y reuso de contexto."""
+
+    def __init__(
+        self,
+        store: Any,
+        llm: BaseChatModel,
+        model: str = "gpt-4o",
+        window_tokens: int = 1200,
+        summary_tokens: int = 250,
+        reuse_similarity: float = 0.9,
+        embeddings: Optional[Embeddings] = None,
+    ):
+        self.store = store
+        self.model = model
+        self.window_tokens = window_tokens
+        self.summary_tokens = summary_tokens
+        self.reuse_similarity = reuse_similarity
+        self.embeddings = embeddings
+        self.condense_chain = CONDENSE_PROMPT | llm | StrOutputParser()
+        self.summary_chain = SUMMARY_PROMPT | llm | StrOutputParser()
+        self._lock = threading.Lock()
+        self._turn_locks: "weakref.WeakValueDictionary[str, _TurnLock]" = weakref.WeakValueDictionary()
+        self._stats = {"turns": 0, "condensed": 0, "context_reused": 0, "summaries": 0, "summary_errors": 0, "expired": 0}
+        self._last_purge = time.monotonic()
+        self.purge_every_s = 60.0
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += n
+
+    # ----- sesiones -----
+
+    def open(self, session_id: Optional[str] = None) -> Session:
+        """
+        Sin id, una sesión nueva (con id generado acá). Con id, la sesión
+        guardada; ``UnknownSession`` si no existe o expiró.
+        """
+        session_id = (session_id or "").strip()
+        if not session_id:
+            return new_session()
+        session = self.store.get(session_id) if len(session_id) <= MAX_SESSION_ID_LEN else None
+        if session is None:
+            raise UnknownSession(session_id)
+        return session
+
+    @contextmanager
+    def turn(self, session_id: Optional[str] = None) -> Iterator[Session]:
+        """
+        ``open`` con el candado de la sesión tomado hasta salir del bloque: dos
+        turnos concurrentes de la misma sesión se aplican uno después del otro
+        en vez de pisarse (dentro del proceso).
+        """
+        session_id = (session_id or "").strip()
+        if not session_id:
+            # Nadie más conoce todavía el id de una sesión nueva
+            yield new_session()
+            return
+        with self._lock:
+            lock = self._turn_locks.get(session_id)
+            if lock is None:
+                lock = self._turn_locks[session_id] = _TurnLock()
+        with lock:
+            yield self.open(session_id)
+
+    def _history(self, session: Session) -> str:
+        return "\n".join(f"{t['role']}: {t['content']}" for t in session["turns"]) or "(none)"
+
+    def messages(self, session: Session, system: Optional[str] = None) -> List[BaseMessage]:
+        """Mensajes para un chat: resumen acumulado como system + turnos de la ventana."""
+        messages: List[BaseMessage] = []
+        parts = [system] if system else []
+        if session["summary"]:
+            parts.append(f"Summary of the earlier conversation:\n{session['summary']}")
+        if parts:
+            messages.append(SystemMessage(content="\n\n".join(parts)))
+        for turn in session["turns"]:
+            cls = HumanMessage if turn["role"] == "user" else AIMessage
+            messages.append(cls(content=turn["content"]))
+        return messages
+
+    # ----- RAG -----
+
+    def condense(self, session: Session, question: str) -> str:
+        """Pregunta autónoma para la búsqueda; sin historial se usa tal cual."""
+        if not session["turns"] and not session["summary"]:
+            return question
+        standalone = self.condense_chain.invoke({
+            "summary": session["summary"] or "(none)",
+            "history": self._history(session),
+            "question": question,
+        }).strip()
+        self._count("condensed")
+        return standalone or question
+
+    def reusable_context(self, session: Session, query: str, filter_key: Optional[str] = None) -> Optional[ScoredDocs]:
+        """Chunks del turno anterior si la nueva búsqueda es prácticamente la misma."""
+        if not session["last_docs"] or not session["last_query"] or self.embeddings is None:
+            return None
+        if session["last_filter"] != filter_key:
+            return None
+        if query.strip().lower() != session["last_query"].strip().lower():
+            # Las consultas ya se embeben para la búsqueda (y quedan en caché)
+            a = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+            b = np.asarray(self.embeddings.embed_query(session["last_query"]), dtype=np.float32)
+            norm = float(np.linalg.norm(a) * np.linalg.norm(b))
+            if not norm or float(a @ b) / norm < self.reuse_similarity:
+                return None
+        self._count("context_reused")
+        return [
+            (Document(page_content=d["page_content"], metadata=d["metadata"]), d["score"])
+            for d in session["last_docs"]
+        ]
+
+    def remember_context(self, session: Session, query: str, scored: ScoredDocs, filter_key: Optional[str] = None) -> None:
+        session["last_query"] = query
+        session["last_filter"] = filter_key
+        session["last_docs"] = [
+            {"page_content": doc.page_content, "metadata": doc.metadata, "score": float(score)}
+            for doc, score in scored
+        ]
+
+    # ----- turnos -----
+
+    def add_turn(self, session: Session, question: str, answer: str) -> Session:
+        """Agrega el turno, pliega en el resumen lo que no cabe en la ventana y guarda."""
+        for role, content in (("user", question), ("assistant", answer)):
+            session["turns"].append({"role": role, "content": content, "tokens": count_tokens(content, self.model)})
+        self._count("turns")
+
+        overflow = []
+        total = sum(t["tokens"] for t in session["turns"])
+        # Siempre queda al menos el último par pregunta/respuesta
+        while total > self.window_tokens and len(session["turns"]) > 2:
+            turn = session["turns"].pop(0)
+            total -= turn["tokens"]
+            overflow.append(turn)
+        if overflow:
+            self._fold(session, overflow)
+        session["updated_at"] = time.time()
+        self.store.save(session)
+        self._maybe_purge()
+        return session
+
+    def _maybe_purge(self) -> None:
+        """Barre las sesiones expiradas a lo más una vez por ``purge_every_s``."""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_purge < self.purge_every_s:
+                return
+            self._last_purge = now
+        self._count("expired", self.store.purge())
+
+    def _fold(self, session: Session, turns: List[Dict[str, Any]]) -> None:
+        text = "\n".join(f"{t['role']}: {t['content']}" for t in turns)
+        try:
+            summary = self.summary_chain.invoke({
+                "summary": session["summary"] or "(none)",
+                "turns": text,
+                "max_words": max(20, int(self.summary_tokens * 0.75)),
+            }).strip()
+            self._count("summaries")
+        except Exception as e:
+            # Sin resumen nuevo se conserva el anterior; los turnos plegados se pierden
+            print(f"No se pudo actualizar el resumen de la sesión {session['id']}: {e}")
+            self._count("summary_errors")
+            return
+        session["summary"] = summary
+        session["summarized_turns"] += len(turns)
+
+    def view(self, session: Session) -> Dict[str, Any]:
+        """Estado de una sesión para la API (sin los chunks guardados)."""
+        return {
+            "id": session["id"],
+            "collection": session.get("collection"),
+            "created_at": session["created_at"],
+            "updated_at": session["updated_at"],
+            "turns": [{k: t[k] for k in ("role", "content")} for t in session["turns"]],
+            "window_tokens": sum(t["tokens"] for t in session["turns"]),
+            "summary": session["summary"],
+            "summary_tokens": count_tokens(session["summary"], self.model) if session["summary"] else 0,
+            "summarized_turns": session["summarized_turns"],
+            "last_query": session["last_query"],
+            "last_sources": sorted({
+                str(d["metadata"].get("file_name") or d["metadata"].get("source") or "") for d in session["last_docs"]
+            } - {""}),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            **stats,
+            "sessions": self.store.count(),
+            "store": type(self.store).__name__,
+            "settings": {
+                "window_tokens": self.window_tokens,
+                "summary_tokens": self.summary_tokens,
+                "reuse_similarity": self.reuse_similarity,
+                "ttl_s": self.store.ttl_s,
+            },
+        }
+
+
+def get_session_store(path: Optional[str] = None, ttl_s: float = 3600.0, max_sessions: int = 10000) -> Any:
+    """SQLite si hay ruta (``RAG_SESSION_DB``); si no, en memoria."""
+    if path:
+        return SQLiteSessionStore(Path(path), ttl_s=ttl_s)
+    return MemorySessionStore(ttl_s=ttl_s, max_sessions=max_sessions)
@@ -0,0 +1,157 @@
+"""
+Chunker semántico para ingesta masiva.
+
+Divide el texto en oraciones, embebe cada oración con su ventana de contexto
+en lotes grandes (a través de la caché de embeddings) y calcula las
+distancias coseno entre oraciones consecutivas y los umbrales de corte con
+NumPy en una sola pasada vectorizada. Usa los mismos nombres de parámetros
+que el SemanticChunker de ``langchain_experimental``.
+"""
+
+from __future__ import annotations
+
+import copy
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+BREAKPOINT_DEFAULTS: Dict[str, float] = {
+    "percentile": 95,
+    "standard_deviation": 3,
+    "interquartile": 1.5,
+    "gradient": 95,
+}
+
+
+class SemanticChunker:
+    """Corta donde la distancia semántica entre oraciones supera el umbral."""
+
+    # Páginas que split_pages agrupa por llamada, para embeber en lotes grandes
+    page_window = 16
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        breakpoint_threshold_type: str = "percentile",
+        breakpoint_threshold_amount: Optional[float] = None,
+        buffer_size: int = 1,
+        batch_size: int = 256,
+        sentence_split_regex: str = r"(?<=[.?!])\s+",
+    ):
+        if breakpoint_threshold_type not in BREAKPOINT_DEFAULTS:
+            raise ValueError(
+                f"breakpoint_threshold_type inválido: {breakpoint_threshold_type}. "
+                f"Opciones: {', '.join(BREAKPOINT_DEFAULTS)}"
+            )
+        self.embeddings = embeddings
+        self.breakpoint_threshold_type = breakpoint_threshold_type
+        self.breakpoint_threshold_amount = (
+            breakpoint_threshold_amount
+            if breakpoint_threshold_amount is not None
+            else BREAKPOINT_DEFAULTS[breakpoint_threshold_type]
+        )
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self._sentence_re = re.compile(sentence_split_regex)
+        self.last_stats: Dict[str, Any] = {}
+        self.totals: Dict[str, float] = {"sentences": 0, "chunks": 0, "seconds": 0.0}
+
+    def _sentences(self, text: str) -> List[str]:
+        return [s for s in self._sentence_re.split(text) if s.strip()]
+
+    def _windows(self, sentences: List[str]) -> List[str]:
+        # Cada oración se embebe junto a buffer_size vecinas a cada lado
+        b = self.buffer_size
+        return [" ".join(sentences[max(0, i - b): i + b + 1]) for i in range(len(sentences))]
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self.embeddings.embed_documents(texts[start:start + self.batch_size]))
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    def _threshold(self, distances: np.ndarray) -> float:
+        # percentile / standard_deviation / interquartile ("gradient" en _breakpoints)
+        amount = self.breakpoint_threshold_amount
+        kind = self.breakpoint_threshold_type
+        if kind == "percentile":
+            return float(np.percentile(distances, amount))
+        if kind == "standard_deviation":
+            return float(distances.mean() + amount * distances.std())
+        q1, q3 = np.percentile(distances, [25, 75])
+        return float(distances.mean() + amount * (q3 - q1))
+
+    def _breakpoints(self, distances: np.ndarray) -> np.ndarray:
+        if self.breakpoint_threshold_type != "gradient":
+            return np.flatnonzero(distances > self._threshold(distances))
+        if len(distances) < 2:
+            # np.gradient necesita dos puntos; como langchain_experimental, con
+            # dos oraciones cada una queda en su propio chunk
+            return np.arange(len(distances))
+        gradient = np.gradient(distances)
+        return np.flatnonzero(gradient > np.percentile(gradient, self.breakpoint_threshold_amount))
+
+    def split_texts(self, texts: List[str]) -> List[List[str]]:
+        """Divide varios textos con un único lote de embeddings para todas sus oraciones."""
+        t0 = time.perf_counter()
+        per_text = [self._sentences(t) for t in texts]
+        windows = [w for sentences in per_text for w in self._windows(sentences)]
+        embed_s = 0.0
+        results: List[List[str]] = []
+        if windows:
+            t_embed = time.perf_counter()
+            matrix = self._embed(windows)
+            embed_s = time.perf_counter() - t_embed
+            # Distancia coseno entre oraciones consecutivas de todo el lote, en una pasada
+            distances = 1.0 - np.einsum("ij,ij->i", matrix[:-1], matrix[1:])
+        offset = 0
+        for sentences in per_text:
+            n = len(sentences)
+            if n <= 1:
+                results.append([" ".join(sentences)] if sentences else [])
+                offset += n
+                continue
+            # Solo las distancias internas del texto (sin cruzar al siguiente)
+            cuts = self._breakpoints(distances[offset:offset + n - 1]) + 1
+            bounds = [0, *cuts.tolist(), n]
+            results.append([" ".join(sentences[a:b]) for a, b in zip(bounds[:-1], bounds[1:]) if a < b])
+            offset += n
+        elapsed = time.perf_counter() - t0
+        self.last_stats = {
+            "texts": len(texts),
+            "sentences": len(windows),
+            "chunks": sum(len(r) for r in results),
+            "embed_s": round(embed_s, 4),
+            "seconds": round(elapsed, 4),
+            "sentences_per_s": round(len(windows) / elapsed, 1) if elapsed > 0 else 0.0,
+        }
+        self.totals["sentences"] += len(windows)
+        self.totals["chunks"] += self.last_stats["chunks"]
+        self.totals["seconds"] += elapsed
+        return results
+
+    def split_text(self, text: str) -> List[str]:
+        return self.split_texts([text])[0]
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        chunks: List[Document] = []
+        for doc, parts in zip(documents, self.split_texts([d.page_content for d in documents])):
+            for part in parts:
+                chunks.append(Document(page_content=part, metadata=copy.deepcopy(doc.metadata)))
+        return chunks
+
+    def throughput(self) -> Dict[str, Any]:
+        """Totales acumulados desde que se creó el chunker (oraciones/s incluidas)."""
+        seconds = self.totals["seconds"]
+        return {
+            "sentences": int(self.totals["sentences"]),
+            "chunks": int(self.totals["chunks"]),
+            "seconds": round(seconds, 3),
+            "sentences_per_s": round(self.totals["sentences"] / seconds, 1) if seconds > 0 else 0.0,
+        }
@@ -0,0 +1,97 @@
+"""
+Backend de embeddings compartido, con caché persistente.
+
+``get_embeddings`` envuelve ``OpenAIEmbeddings`` en ``CacheBackedEmbeddings``
+(un archivo por texto, clave SHA-256 y namespace por modelo), así que
+re-ingestas, chunking semántico y scoring de evaluaciones no vuelven a pagar
+por textos ya embebidos. Se crea una sola instancia por modelo y proceso.
+
+``HashingEmbeddings`` es un backend local y determinístico para benchmarks.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import threading
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import InMemoryByteStore, LocalFileStore
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from app.backends import offline_mode
+from app.usage import MeteredEmbeddings
+
+DEFAULT_EMBED_MODEL = "text-embedding-3-small"
+
+_instances: Dict[str, Embeddings] = {}
+_lock = threading.Lock()
+
+
+def _cache_enabled() -> bool:
+    return (os.getenv("RAG_EMBED_CACHE", "1") or "1").lower() not in {"0", "false", "no", "off"}
+
+
+def _build(model: str) -> Embeddings:
+    if offline_mode():
+        # Sin red ni caché: los vectores por hashing ya son baratos y determinísticos
+        return HashingEmbeddings(int(os.getenv("RAG_FAKE_EMBED_SIZE", "256") or 256))
+    # Debajo de la caché: solo se cuentan los tokens que realmente se envían
+    underlying = MeteredEmbeddings(OpenAIEmbeddings(model=model), model)
+    if not _cache_enabled():
+        return underlying
+    directory = os.getenv("RAG_EMBED_CACHE_DIR") or ".cache/embeddings"
+    store = InMemoryByteStore() if directory == ":memory:" else LocalFileStore(directory)
+    return CacheBackedEmbeddings.from_bytes_store(
+        underlying,
+        store,
+        namespace=model,
+        batch_size=int(os.getenv("RAG_EMBED_BATCH_SIZE", "256") or 256),
+        query_embedding_cache=True,
+        key_encoder="sha256",
+    )
+
+
+def get_embeddings(model: Optional[str] = None) -> Embeddings:
+    """
+    Embeddings del modelo pedido (o ``RAG_EMBED_MODEL``), con caché si está
+    activa; con ``RAG_BACKEND=offline``, ``HashingEmbeddings``.
+    """
+    model = model or os.getenv("RAG_EMBED_MODEL") or DEFAULT_EMBED_MODEL
+    with _lock:
+        if model not in _instances:
+            _instances[model] = _build(model)
+        return _instances[model]
+
+
+class HashingEmbeddings(Embeddings):
+    """
+    Embeddings determinísticos por feature hashing de palabras, sin red.
+
+    A diferencia de ``DeterministicFakeEmbedding`` (vectores aleatorios por
+    texto), textos con palabras en común quedan cerca, así que sirve para
+    benchmarks y pruebas donde importa la calidad relativa de recuperación.
+    """
+
+    _token_re = re.compile(r"\w+", re.UNICODE)
+
+    def __init__(self, size: int = 256):
+        self.size = size
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for token in self._token_re.findall(text.lower()):
+            h = zlib.crc32(token.encode("utf-8"))
+            vector[h % self.size] += 1.0 if (h >> 31) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
@@ -0,0 +1,149 @@
+"""
+Puntaje de respuestas frente a las esperadas del set de evaluación.
+
+Para toda una corrida a la vez:
+
+- similitud semántica: coseno entre embeddings de respuesta y esperada, con
+  una sola llamada ``embed_documents`` (por la caché de ``get_embeddings``)
+  para todos los textos distintos
+- token-F1: conteos de tokens codificados como claves ``fila * V + token`` e
+  intersectados con NumPy, sin ``Counter`` por pregunta
+- citas: si la respuesta cita el archivo de ``Fuente:`` (con el mismo
+  criterio por extensión que ``app.retrieval_eval``)
+
+La línea ``Fuente: ...`` se quita de la esperada antes de comparar contenido.
+"""
+
+from __future__ import annotations
+
+import re
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from app.retrieval_eval import expected_source, resolve_sources
+
+_TOKEN_RE = re.compile(r"\w+")
+_SOURCE_LINE_RE = re.compile(r"\s*Fuente:[^\n]*$")
+# "[source: archivo.pdf, page: 3]" tal como lo arma format_docs; el nombre puede tener espacios y comas
+_SOURCE_TAG_RE = re.compile(r"\[source:\s*([^\]\n]+?)\s*(?:,\s*page:[^\]\n]*)?\]", re.IGNORECASE)
+# "Fuente(s): a.pdf, b (2).docx": nombres con extensión hasta el fin de línea
+_SOURCE_LABEL_RE = re.compile(r"Fuentes?:[ \t]*([^\n]+)", re.IGNORECASE)
+_FILE_NAME_RE = re.compile(
+    r"[^\s,;:\[\]()][^,;:\[\]\n]*?\.(?:pdf|txt|md|docx?|csv|xlsx?|pptx?|html?|json)\b", re.IGNORECASE
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def reference_answer(expected: str) -> str:
+    """Texto esperado sin la línea final ``Fuente: <archivo>``."""
+    return _SOURCE_LINE_RE.sub("", expected or "").strip()
+
+
+def token_f1_batch(references: Sequence[str], candidates: Sequence[str]) -> np.ndarray:
+    """token-F1 (multiconjuntos de tokens) de cada par referencia/candidata."""
+    n = len(references)
+    vocab: Dict[str, int] = {}
+
+    def encode(texts: Sequence[str]):
+        rows, ids = [], []
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            rows.extend([i] * len(tokens))
+            ids.extend(vocab.setdefault(t, len(vocab)) for t in tokens)
+        return np.asarray(rows, dtype=np.int64), np.asarray(ids, dtype=np.int64)
+
+    ref_rows, ref_ids = encode(references)
+    cand_rows, cand_ids = encode(candidates)
+    size = max(len(vocab), 1)
+    ref_keys, ref_counts = np.unique(ref_rows * size + ref_ids, return_counts=True)
+    cand_keys, cand_counts = np.unique(cand_rows * size + cand_ids, return_counts=True)
+    _, ri, ci = np.intersect1d(ref_keys, cand_keys, assume_unique=True, return_indices=True)
+    overlap = np.bincount(
+        ref_keys[ri] // size, weights=np.minimum(ref_counts[ri], cand_counts[ci]), minlength=n
+    )
+    ref_len = np.bincount(ref_rows, minlength=n)
+    cand_len = np.bincount(cand_rows, minlength=n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = overlap / cand_len
+        recall = overlap / ref_len
+        f1 = 2 * precision * recall / (precision + recall)
+    return np.nan_to_num(f1)
+
+
+def token_f1(expected: str, answer: str) -> float:
+    return float(token_f1_batch([expected], [answer])[0])
+
+
+def cosine_batch(references: Sequence[str], candidates: Sequence[str], embeddings: Embeddings) -> np.ndarray:
+    """Coseno de cada par; los textos vacíos puntúan 0 y los repetidos se embeben una vez."""
+    texts = list(dict.fromkeys(t for t in (*references, *candidates) if t and t.strip()))
+    if not texts:
+        return np.zeros(len(references))
+    vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+    # Fila extra de ceros para los textos vacíos
+    vectors = np.vstack([vectors, np.zeros((1, vectors.shape[1]), dtype=np.float32)])
+    index = {t: i for i, t in enumerate(texts)}
+    a = vectors[[index.get(t, len(texts)) for t in references]]
+    b = vectors[[index.get(t, len(texts)) for t in candidates]]
+    return np.einsum("ij,ij->i", a, b)
+
+
+def cited_sources(text: str, known: Iterable[str] = ()) -> Set[str]:
+    """
+    Archivos citados en ``text``: los de ``[source: ...]`` y ``Fuente: ...``, y
+    cualquiera de ``known`` que aparezca literal (aunque se cite de otra forma).
+    """
+    text = text or ""
+    cited = {m.group(1) for m in _SOURCE_TAG_RE.finditer(text)}
+    for m in _SOURCE_LABEL_RE.finditer(text):
+        cited.update(f.group(0).strip() for f in _FILE_NAME_RE.finditer(m.group(1)))
+    cited.update(name for name in known if name and name in text)
+    return cited
+
+
+def score_results(
+    results: List[Dict[str, Any]],
+    embeddings: Optional[Embeddings] = None,
+) -> Dict[str, Any]:
+    """
+    Agrega ``similarity``, ``token_f1`` y ``cites_source`` a cada resultado con
+    ``expected`` y ``response`` (los que fallaron se omiten) y devuelve los
+    promedios de la corrida. Sin ``embeddings`` solo se calculan las métricas léxicas.
+    """
+    t0 = time.perf_counter()
+    scored = [r for r in results if r.get("ok") and r.get("expected")]
+    references = [reference_answer(r["expected"]) for r in scored]
+    responses = [r.get("response") or "" for r in scored]
+
+    f1 = token_f1_batch(references, responses) if scored else np.zeros(0)
+    similarity = cosine_batch(references, responses, embeddings) if embeddings is not None and scored else None
+
+    citation_hits = []
+    for i, r in enumerate(scored):
+        r["token_f1"] = round(float(f1[i]), 4)
+        if similarity is not None:
+            r["similarity"] = round(float(similarity[i]), 4)
+        source = expected_source(r) if r.get("set") != "unanswerable" else None
+        if source:
+            r["cites_source"] = bool(resolve_sources(source, cited_sources(r["response"] or "", known=[source])))
+            citation_hits.append(r["cites_source"])
+
+    def mean(values) -> Optional[float]:
+        return round(float(np.mean(values)), 4) if len(values) else None
+
+    answerable = [i for i, r in enumerate(scored) if r.get("set") != "unanswerable"]
+    return {
+        "scored_count": len(scored),
+        "token_f1": mean(f1[answerable]) if answerable else None,
+        "semantic_similarity": mean(similarity[answerable]) if similarity is not None and answerable else None,
+        "citation_hit_rate": mean(citation_hits),
+        "scoring_s": round(time.perf_counter() - t0, 3),
+    }
@@ -0,0 +1,379 @@
+"""
+Historial persistente de evaluaciones (SQLite) y carga cacheada de los sets.
+
+Cada corrida de ``scripts/evaluate_rag.py`` queda registrada con su
+configuración, resumen y resultados por pregunta, en lugar de sobrescribir
+el reporte anterior. Al registrar una corrida se compara contra la anterior
+del mismo tipo y las regresiones de latencia o calidad quedan en su resumen.
+
+Los JSONL/JSON de ``eval/`` se releen solo cuando cambia su mtime o tamaño.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.rag_prompt import abstention_phrase
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    created_at REAL NOT NULL,
+    kind TEXT NOT NULL,
+    label TEXT,
+    config TEXT NOT NULL,
+    summary TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_kind_created ON runs (kind, created_at);
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    question_set TEXT,
+    question TEXT NOT NULL,
+    ok INTEGER,
+    passed INTEGER,
+    latency_s REAL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (run_id, idx)
+);
+"""
+
+# Métricas de calidad comparadas entre corridas (mayor es mejor) -> tamaño del set
+QUALITY_METRICS = {
+    "answerable_rate": "answerable_count",
+    "unanswerable_abstention_rate": "unanswerable_count",
+    "token_f1": "scored_count",
+    "semantic_similarity": "scored_count",
+    "citation_hit_rate": "scored_count",
+}
+
+
+# =============================
+# Carga de datasets con caché por mtime
+# =============================
+
+_file_cache: Dict[str, Tuple[Tuple[int, int], Any]] = {}
+_file_lock = threading.Lock()
+
+
+def _cached(path: Path, parse) -> Any:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    stamp = (st.st_mtime_ns, st.st_size)
+    key = str(path.resolve())
+    with _file_lock:
+        hit = _file_cache.get(key)
+        if hit and hit[0] == stamp:
+            return hit[1]
+    value = parse(path)
+    with _file_lock:
+        _file_cache[key] = (stamp, value)
+    return value
+
+
+def _parse_jsonl(path: Path) -> List[Dict[str, Any]]:
+    with path.open("r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _parse_json(path: Path) -> Any:
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_jsonl_cached(path: Path) -> List[Dict[str, Any]]:
+    """Filas del JSONL (lista vacía si no existe); se relee solo si cambió en disco."""
+    return _cached(Path(path), _parse_jsonl) or []
+
+
+def load_json_cached(path: Path) -> Optional[Any]:
+    return _cached(Path(path), _parse_json)
+
+
+# =============================
+# Criterios y agregados de una corrida de respuestas
+# =============================
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """Percentil con interpolación lineal (como numpy.percentile por defecto)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * p / 100
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, Optional[float]]:
+    def r(v: Optional[float]) -> Optional[float]:
+        return round(v, 3) if v is not None else None
+
+    return {
+        "mean": r(sum(latencies) / len(latencies)) if latencies else None,
+        "p50": r(percentile(latencies, 50)),
+        "p90": r(percentile(latencies, 90)),
+        "p99": r(percentile(latencies, 99)),
+        "max": r(max(latencies)) if latencies else None,
+    }
+
+
+def answer_passed(question_set: str, output: Optional[str], phrase: Optional[str] = None) -> bool:
+    """answerable: basta con una respuesta no vacía; unanswerable: debe abstenerse."""
+    if question_set == "answerable":
+        return bool(output and output.strip())
+    return (phrase or abstention_phrase()) in (output or "").lower()
+
+
+def answers_summary(results: List[Dict[str, Any]], wall_s: Optional[float] = None) -> Dict[str, Any]:
+    """Tasas, latencias y errores de una corrida (``results``: set, ok, passed, latency_s)."""
+    ok = [r for r in results if r.get("ok")]
+    ans = [r for r in results if r["set"] == "answerable"]
+    uans = [r for r in results if r["set"] == "unanswerable"]
+    ans_ok = sum(1 for r in ans if r.get("passed"))
+    uans_ok = sum(1 for r in uans if r.get("passed"))
+    latency = latency_summary([r["latency_s"] for r in ok])
+    summary = {
+        "answerable_count": len(ans),
+        "answerable_nonempty": ans_ok,
+        "answerable_rate": round(ans_ok / max(1, len(ans)), 3),
+        "unanswerable_count": len(uans),
+        "unanswerable_abstentions": uans_ok,
+        "unanswerable_abstention_rate": round(uans_ok / max(1, len(uans)), 3),
+        "avg_latency_s": latency["mean"],
+        "latency_s": latency,
+        "errors": len(results) - len(ok),
+    }
+    if wall_s is not None:
+        summary["wall_s"] = round(wall_s, 3)
+        summary["throughput_qps"] = round(len(ok) / wall_s, 2) if wall_s > 0 else 0.0
+    return summary
+
+
+# =============================
+# Comparación de corridas
+# =============================
+
+def find_regressions(
+    current: Dict[str, Any],
+    previous: Dict[str, Any],
+    tolerance: float = 0.2,
+    min_delta_s: float = 0.05,
+    quality_drop: float = 0.05,
+) -> List[Dict[str, Any]]:
+    """
+    Regresiones de ``current`` frente a ``previous`` (resúmenes de corrida o reportes).
+
+    - latencia: percentiles globales (o ``avg_latency_s`` en reportes antiguos) y
+      por pregunta, si empeoran más de ``tolerance`` relativo y ``min_delta_s`` absoluto
+    - calidad: tasas que bajan más de ``quality_drop`` y preguntas que dejaron de pasar
+    - recuperación: recall@k/MRR por configuración de búsqueda
+    """
+    def slower(before: Optional[float], after: Optional[float]) -> bool:
+        if not before or after is None:
+            return False
+        return after > before * (1 + tolerance) and after - before >= min_delta_s
+
+    def dropped(before: Optional[float], after: Optional[float]) -> bool:
+        return before is not None and after is not None and before - after > quality_drop
+
+    regressions = []
+    pairs = [("avg_latency_s", previous.get("avg_latency_s"), current.get("avg_latency_s"))]
+    prev_lat = previous.get("latency_s") or {}
+    cur_lat = current.get("latency_s") or {}
+    for key in ("p50", "p90", "p99"):
+        pairs.append((f"latency_s.{key}", prev_lat.get(key), cur_lat.get(key)))
+    for metric, before, after in pairs:
+        if slower(before, after):
+            regressions.append({"kind": "latency", "metric": metric, "before": before, "after": after})
+
+    for metric, count in QUALITY_METRICS.items():
+        # Solo si el set estaba presente en ambas corridas
+        if not previous.get(count) or not current.get(count):
+            continue
+        if dropped(previous.get(metric), current.get(metric)):
+            regressions.append({
+                "kind": "quality", "metric": metric, "before": previous[metric], "after": current[metric],
+            })
+
+    prev_q = {(q.get("set"), q["question"]): q for q in previous.get("per_question", [])}
+    for q in current.get("per_question", []):
+        old = prev_q.get((q.get("set"), q["question"]))
+        if not old:
+            continue
+        if q.get("ok") and old.get("ok") and slower(old.get("latency_s"), q.get("latency_s")):
+            regressions.append({
+                "kind": "latency",
+                "metric": "question_latency_s",
+                "question": q["question"],
+                "before": old["latency_s"],
+                "after": q["latency_s"],
+            })
+        if old.get("passed") and not q.get("passed"):
+            regressions.append({"kind": "quality", "metric": "question_passed", "question": q["question"]})
+
+    def setting_key(s: Dict[str, Any]) -> tuple:
+        return (s.get("search_type"), s.get("top_k"), s.get("fetch_k"))
+
+    prev_settings = {setting_key(s): s for s in previous.get("settings", [])}
+    for s in current.get("settings", []):
+        old = prev_settings.get(setting_key(s))
+        if not old:
+            continue
+        label = "{}/k={}/fetch_k={}".format(*setting_key(s))
+        for metric in ("recall_at_k", "mrr"):
+            if dropped(old.get(metric), s.get(metric)):
+                regressions.append({
+                    "kind": "quality", "metric": metric, "setting": label, "before": old[metric], "after": s[metric],
+                })
+        before_p50 = (old.get("search_latency_s") or {}).get("p50")
+        after_p50 = (s.get("search_latency_s") or {}).get("p50")
+        # Búsquedas de milisegundos: el mínimo absoluto se escala
+        if before_p50 and after_p50 and after_p50 > before_p50 * (1 + tolerance) and after_p50 - before_p50 >= min_delta_s / 10:
+            regressions.append({
+                "kind": "latency", "metric": "search_latency_s.p50", "setting": label,
+                "before": before_p50, "after": after_p50,
+            })
+    return regressions
+
+
+# =============================
+# Store SQLite
+# =============================
+
+class EvalStore:
+    """Corridas de evaluación en SQLite (una conexión por operación, apta para hilos)."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn, conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # El with de sqlite3 solo confirma la transacción: se usa junto con closing()
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def record_run(
+        self,
+        kind: str,
+        config: Dict[str, Any],
+        summary: Dict[str, Any],
+        per_question: List[Dict[str, Any]],
+        label: Optional[str] = None,
+        compare: bool = True,
+        **thresholds: float,
+    ) -> Dict[str, Any]:
+        """
+        Guarda una corrida y, si hay una anterior del mismo tipo, sus regresiones
+        respecto de ella (en ``summary["regressions"]`` y ``summary["compared_to"]``).
+        ``thresholds`` se pasan a ``find_regressions``.
+        """
+        summary = dict(summary)
+        if compare:
+            previous = self.latest_run(kind)
+            if previous:
+                summary["compared_to"] = previous["id"]
+                summary["regressions"] = find_regressions(
+                    {**summary, "per_question": per_question},
+                    {**previous["summary"], "per_question": self.results(previous["id"])},
+                    **thresholds,
+                )
+        run_id = uuid.uuid4().hex[:12]
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO runs (id, created_at, kind, label, config, summary) VALUES (?, ?, ?, ?, ?, ?)",
+                (run_id, time.time(), kind, label, json.dumps(config, ensure_ascii=False),
+                 json.dumps(summary, ensure_ascii=False)),
+            )
+            conn.executemany(
+                "INSERT INTO results (run_id, idx, question_set, question, ok, passed, latency_s, data) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (run_id, i, q.get("set"), q["question"], _as_int(q.get("ok")), _as_int(q.get("passed")),
+                     q.get("latency_s"), json.dumps(q, ensure_ascii=False))
+                    for i, q in enumerate(per_question)
+                ],
+            )
+        return {"id": run_id, "kind": kind, "label": label, "config": config, "summary": summary}
+
+    def _run(self, row: sqlite3.Row) -> Dict[str, Any]:
+        return {
+            "id": row["id"],
+            "created_at": row["created_at"],
+            "kind": row["kind"],
+            "label": row["label"],
+            "config": json.loads(row["config"]),
+            "summary": json.loads(row["summary"]),
+        }
+
+    def list_runs(self, kind: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        query = "SELECT * FROM runs"
+        params: List[Any] = []
+        if kind:
+            query += " WHERE kind = ?"
+            params.append(kind)
+        query += " ORDER BY created_at DESC LIMIT ?"
+        params.append(limit)
+        with closing(self._connect()) as conn, conn:
+            return [self._run(r) for r in conn.execute(query, params)]
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with closing(self._connect()) as conn, conn:
+            row = conn.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        return self._run(row) if row else None
+
+    def latest_run(self, kind: str) -> Optional[Dict[str, Any]]:
+        runs = self.list_runs(kind, limit=1)
+        return runs[0] if runs else None
+
+    def results(self, run_id: str) -> List[Dict[str, Any]]:
+        with closing(self._connect()) as conn, conn:
+            rows = conn.execute("SELECT data FROM results WHERE run_id = ? ORDER BY idx", (run_id,))
+            return [json.loads(r["data"]) for r in rows]
+
+    def compare(self, base_id: str, head_id: str, **thresholds: float) -> Optional[Dict[str, Any]]:
+        """Regresiones de ``head`` respecto de ``base``; None si alguna corrida no existe."""
+        base, head = self.get_run(base_id), self.get_run(head_id)
+        if not base or not head:
+            return None
+        regressions = find_regressions(
+            {**head["summary"], "per_question": self.results(head_id)},
+            {**base["summary"], "per_question": self.results(base_id)},
+            **thresholds,
+        )
+        return {"base": base, "head": head, "regressions": regressions}
+
+    def delete_run(self, run_id: str) -> bool:
+        with closing(self._connect()) as conn, conn:
+            return conn.execute("DELETE FROM runs WHERE id = ?", (run_id,)).rowcount > 0
+
+
+def _as_int(value: Any) -> Optional[int]:
+    return None if value is None else int(bool(value))
+
+
+_stores: Dict[str, EvalStore] = {}
+
+
+def get_eval_store(path: Optional[str] = None) -> EvalStore:
+    """Store en ``path`` o ``RAG_EVAL_DB`` (por defecto ``eval/runs.sqlite3``), una instancia por ruta."""
+    path = path or os.getenv("RAG_EVAL_DB") or "eval/runs.sqlite3"
+    key = str(Path(path).resolve())
+    if key not in _stores:
+        _stores[key] = EvalStore(Path(path))
+    return _stores[key]
@@ -0,0 +1,133 @@
+"""
+Caché persistente de texto extraído, direccionado por contenido.
+
+La clave es el SHA-256 del archivo más el identificador y versión del
+extractor, así que re-ingestar el mismo documento con otro ``chunk_size`` o
+``chunk_overlap`` reutiliza el texto sin volver a parsear. Cada entrada es un
+JSON comprimido con zlib; cuando el directorio supera el tamaño máximo se
+eliminan las entradas usadas hace más tiempo.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+# Subir si cambia el formato de las entradas para invalidar las anteriores
+CACHE_FORMAT = "1"
+_READ_BLOCK = 1024 * 1024
+
+
+def file_sha256(path: Path) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(_READ_BLOCK), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+class ExtractionCache:
+    """Páginas extraídas (texto + metadatos) guardadas en disco con expulsión LRU por tamaño."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Tamaño total aproximado; se recalcula escaneando solo al superar el máximo
+        self._total_bytes: Optional[int] = None
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(digest: str, loader_id: str) -> str:
+        return hashlib.sha256(f"{CACHE_FORMAT}|{loader_id}|{digest}".encode()).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.json.z"
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        path = self._path(key)
+        try:
+            data = path.read_bytes()
+            pages = json.loads(zlib.decompress(data).decode("utf-8"))
+        except (OSError, ValueError, zlib.error):
+            self.misses += 1
+            return None
+        # Marca de uso para la expulsión LRU
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return pages
+
+    def put(self, key: str, pages: List[Dict[str, Any]]) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = zlib.compress(json.dumps(pages, ensure_ascii=False, default=str).encode("utf-8"), 6)
+        # Escritura atómica: otros procesos nunca leen una entrada a medio escribir
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes += len(data)
+            if self._total_bytes is None or self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        # Se llama con self._lock tomado: recalcula el total y expulsa las menos usadas
+        entries = []
+        total = 0
+        for entry in self.directory.glob("*/*.json.z"):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry))
+            total += st.st_size
+        if total > self.max_bytes:
+            for _, size, entry in sorted(entries):
+                entry.unlink(missing_ok=True)
+                total -= size
+                if total <= self.max_bytes:
+                    break
+        self._total_bytes = total
+
+    def stats(self) -> Dict[str, Any]:
+        files = list(self.directory.glob("*/*.json.z"))
+        return {
+            "directory": str(self.directory),
+            "entries": len(files),
+            "bytes": sum(f.stat().st_size for f in files),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+_caches: Dict[tuple, ExtractionCache] = {}
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """Caché según ``RAG_EXTRACTION_CACHE*``; None si está deshabilitada."""
+    if (os.getenv("RAG_EXTRACTION_CACHE", "1") or "1").lower() in {"0", "false", "no", "off"}:
+        return None
+    directory = os.getenv("RAG_EXTRACTION_CACHE_DIR") or ".cache/extraction"
+    max_bytes = int(float(os.getenv("RAG_EXTRACTION_CACHE_MAX_MB", "512") or 512) * 1024 * 1024)
+    settings = (str(Path(directory).resolve()), max_bytes)
+    if settings not in _caches:
+        _caches[settings] = ExtractionCache(Path(directory), max_bytes)
+    return _caches[settings]
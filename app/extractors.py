@@ -0,0 +1,178 @@
+"""
+Extractores de texto PDF intercambiables.
+
+Todos exponen la misma interfaz (``page_count`` y ``extract_pages``) y se
+registran por nombre en ``EXTRACTORS``; el backend por defecto se elige con
+``RAG_PDF_EXTRACTOR`` (pypdf, pdfminer, pymupdf o auto). Para PDFs grandes,
+``extract_pdf_pages`` reparte rangos de páginas entre un pool de procesos.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import logging
+import math
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Type
+
+PageText = Tuple[int, str]
+
+
+class PDFExtractor(ABC):
+    """Interfaz base: páginas indexadas desde 0, como PyPDFLoader."""
+
+    name = "base"
+    # Paquete que tiene que estar instalado (page_count por defecto usa pypdf)
+    module = "pypdf"
+
+    @property
+    def version(self) -> str:
+        return "1"
+
+    @classmethod
+    def available(cls) -> bool:
+        # Solo se busca el paquete, sin importarlo
+        return importlib.util.find_spec(cls.module) is not None
+
+    def page_count(self, path: Path) -> int:
+        from pypdf import PdfReader
+
+        return len(PdfReader(str(path)).pages)
+
+    @abstractmethod
+    def extract_pages(self, path: Path, pages: Optional[Sequence[int]] = None) -> Iterator[PageText]:
+        """``(página, texto)`` de ``pages`` (todas si es None), en orden."""
+
+
+class PypdfExtractor(PDFExtractor):
+    """Extractor puro Python (el mismo motor que usaba PyPDFLoader)."""
+
+    name = "pypdf"
+    module = "pypdf"
+
+    def extract_pages(self, path: Path, pages: Optional[Sequence[int]] = None) -> Iterator[PageText]:
+        from pypdf import PdfReader
+
+        reader = PdfReader(str(path))
+        for i in (pages if pages is not None else range(len(reader.pages))):
+            yield i, reader.pages[i].extract_text() or ""
+
+    @property
+    def version(self) -> str:
+        import pypdf
+
+        return pypdf.__version__
+
+
+class PdfminerExtractor(PDFExtractor):
+    """pdfminer.six: análisis de layout, más fiel en columnas pero más lento."""
+
+    name = "pdfminer"
+    module = "pdfminer"
+
+    def extract_pages(self, path: Path, pages: Optional[Sequence[int]] = None) -> Iterator[PageText]:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+
+        # pdfminer emite un warning por cada fuente incompleta; no aporta en ingesta
+        logging.getLogger("pdfminer").setLevel(logging.ERROR)
+        numbers = sorted(pages) if pages is not None else None
+        layouts = extract_pages(str(path), page_numbers=numbers)
+        for i, layout in enumerate(layouts):
+            text = "".join(el.get_text() for el in layout if isinstance(el, LTTextContainer))
+            yield (numbers[i] if numbers is not None else i), text
+
+    @property
+    def version(self) -> str:
+        import pdfminer
+
+        return str(pdfminer.__version__)
+
+
+class PymupdfExtractor(PDFExtractor):
+    """PyMuPDF (opcional, ``pip install pymupdf``): el más rápido, en C."""
+
+    name = "pymupdf"
+    module = "pymupdf"
+
+    def page_count(self, path: Path) -> int:
+        import pymupdf
+
+        with pymupdf.open(str(path)) as doc:
+            return doc.page_count
+
+    def extract_pages(self, path: Path, pages: Optional[Sequence[int]] = None) -> Iterator[PageText]:
+        import pymupdf
+
+        with pymupdf.open(str(path)) as doc:
+            for i in (pages if pages is not None else range(doc.page_count)):
+                yield i, doc[i].get_text()
+
+    @property
+    def version(self) -> str:
+        import pymupdf
+
+        return pymupdf.VersionBind
+
+
+EXTRACTORS: Dict[str, Type[PDFExtractor]] = {
+    PypdfExtractor.name: PypdfExtractor,
+    PdfminerExtractor.name: PdfminerExtractor,
+    PymupdfExtractor.name: PymupdfExtractor,
+}
+
+
+def available_extractors() -> List[str]:
+    return [name for name, cls in EXTRACTORS.items() if cls.available()]
+
+
+def get_extractor(name: Optional[str] = None) -> PDFExtractor:
+    """Retorna el extractor pedido (o ``RAG_PDF_EXTRACTOR``); ``auto`` prefiere pymupdf."""
+    name = (name or os.getenv("RAG_PDF_EXTRACTOR") or "pypdf").lower()
+    if name == "auto":
+        name = PymupdfExtractor.name if PymupdfExtractor.available() else PypdfExtractor.name
+    if name not in EXTRACTORS:
+        raise ValueError(f"Extractor PDF desconocido: {name}. Disponibles: {', '.join(EXTRACTORS)}")
+    cls = EXTRACTORS[name]
+    if not cls.available():
+        raise RuntimeError(f"El extractor '{name}' no está instalado")
+    return cls()
+
+
+def _extract_range(name: str, path: Path, pages: List[int]) -> List[PageText]:
+    # Función de módulo para ejecutarse en un proceso del pool
+    return list(get_extractor(name).extract_pages(path, pages))
+
+
+def extract_pdf_pages(
+    path: Path,
+    extractor: Optional[PDFExtractor] = None,
+    workers: Optional[int] = None,
+    min_pages: Optional[int] = None,
+) -> Iterator[PageText]:
+    """
+    Extrae las páginas de un PDF en orden.
+
+    Si ``workers`` > 1 (o ``RAG_PDF_WORKERS``) y el PDF tiene al menos
+    ``min_pages`` páginas (o ``RAG_PDF_PARALLEL_MIN_PAGES``), los rangos de
+    páginas se extraen en paralelo en un pool de procesos.
+    """
+    extractor = extractor or get_extractor()
+    workers = workers if workers is not None else int(os.getenv("RAG_PDF_WORKERS", "1") or 1)
+    min_pages = min_pages if min_pages is not None else int(os.getenv("RAG_PDF_PARALLEL_MIN_PAGES", "50") or 50)
+    if workers <= 1:
+        yield from extractor.extract_pages(path)
+        return
+    total = extractor.page_count(path)
+    if total < min_pages:
+        yield from extractor.extract_pages(path)
+        return
+    # Rangos contiguos (4 por worker) para balancear páginas de costo desigual
+    size = max(1, math.ceil(total / (workers * 4)))
+    ranges = [list(range(start, min(start + size, total))) for start in range(0, total, size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for part in pool.map(_extract_range, [extractor.name] * len(ranges), [path] * len(ranges), ranges):
+            yield from part
@@ -0,0 +1,360 @@
+"""
+Pipeline de ingesta en streaming: carga → split → embed → upsert.
+
+Cada etapa procesa un lote a la vez y se conecta con la siguiente mediante
+colas acotadas, de modo que la memoria pico depende de ``batch_size`` y
+``queue_size`` y no del tamaño del corpus. Los primeros chunks quedan
+buscables en Qdrant en cuanto se sube el primer lote.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import os
+import queue
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from langchain_community.document_loaders import Docx2txtLoader, TextLoader
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as rest
+
+from app.chunking import SemanticChunker
+from app.embeddings import get_embeddings
+from app.extraction_cache import file_sha256, get_extraction_cache
+from app.extractors import PDFExtractor, extract_pdf_pages, get_extractor
+from app.vectorstore import (
+    EMBEDDING_MODEL_FIELD,
+    METADATA_PAYLOAD_KEY,
+    check_embedding_model,
+    doc_type_for,
+    ensure_collection,
+)
+
+# Clave de contenido que usa el vectorstore Qdrant de LangChain
+CONTENT_PAYLOAD_KEY = "page_content"
+
+
+def _load_uncached(file_path: Path, extractor: Optional[PDFExtractor]) -> Iterator[Document]:
+    suffix = file_path.suffix.lower()
+    if suffix == ".pdf":
+        extractor = extractor or get_extractor()
+        for page, text in extract_pdf_pages(file_path, extractor):
+            yield Document(
+                page_content=text,
+                metadata={"source": str(file_path), "page": page, "extractor": extractor.name},
+            )
+        return
+    if suffix in {".doc", ".docx"}:
+        loader = Docx2txtLoader(str(file_path))
+    else:
+        # Fallback para .txt, .md, .rst
+        loader = TextLoader(str(file_path), encoding="utf-8")
+    yield from loader.lazy_load()
+
+
+def _loader_id(file_path: Path, extractor: Optional[PDFExtractor]) -> str:
+    suffix = file_path.suffix.lower()
+    if suffix == ".pdf":
+        return f"pdf:{extractor.name}:{extractor.version}" if extractor else "pdf"
+    if suffix in {".doc", ".docx"}:
+        return "docx2txt"
+    return "text:utf-8"
+
+
+def load_pages(
+    file_path: Path,
+    extractor: Optional[PDFExtractor] = None,
+    digest: Optional[str] = None,
+    use_cache: bool = True,
+) -> Iterator[Document]:
+    """
+    Carga un documento página a página según su extensión.
+
+    Los PDFs pasan por el extractor configurado (``RAG_PDF_EXTRACTOR``), con
+    paralelismo por páginas para archivos grandes; el resto usa ``lazy_load``.
+    Si la caché de extracción está activa, el texto se busca primero por
+    SHA-256 (``digest`` evita recalcularlo) y solo se parsea en un miss.
+    """
+    if file_path.suffix.lower() == ".pdf":
+        extractor = extractor or get_extractor()
+    cache = get_extraction_cache() if use_cache else None
+    if cache is None:
+        yield from _load_uncached(file_path, extractor)
+        return
+
+    key = cache.key(digest or file_sha256(file_path), _loader_id(file_path, extractor))
+    cached = cache.get(key)
+    if cached is not None:
+        for page in cached:
+            yield Document(page_content=page["text"], metadata={**page["metadata"], "source": str(file_path)})
+        return
+
+    pages: List[Dict[str, Any]] = []
+    for doc in _load_uncached(file_path, extractor):
+        # "source" depende de la ruta (p.ej. temporales de upload): se repone al leer
+        meta = {k: v for k, v in doc.metadata.items() if k != "source"}
+        pages.append({"text": doc.page_content, "metadata": meta})
+        yield doc
+    cache.put(key, pages)
+
+
+def split_pages(pages: Iterable[Document], splitter: Any) -> Iterator[Document]:
+    """
+    Divide las páginas de forma incremental, sin materializar el documento completo.
+
+    Los splitters que definen ``page_window`` (p.ej. el chunker semántico)
+    reciben grupos de páginas para embeber sus oraciones en lotes más grandes.
+    """
+    window = max(1, int(getattr(splitter, "page_window", 1) or 1))
+    for group in batched(pages, window):
+        yield from splitter.split_documents(group)
+
+
+def stable_chunk_id(source: str, page: int, chunk_index: int, content: str) -> str:
+    """Genera ID estable para Qdrant usando UUID v5."""
+    name = f"{source}|{page}|{chunk_index}|{len(content)}"
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
+
+
+def make_splitter(chunker_type: str, chunk_size: int, chunk_overlap: int) -> Any:
+    """Construye el splitter pedido ("semantic" o "recursive")."""
+    if chunker_type == "semantic":
+        # Sin RAG_SEMANTIC_THRESHOLD el umbral es el del tipo (BREAKPOINT_DEFAULTS), no 95 para todos
+        threshold = os.getenv("RAG_SEMANTIC_THRESHOLD")
+        return SemanticChunker(
+            get_embeddings(),
+            breakpoint_threshold_type=os.getenv("RAG_SEMANTIC_THRESHOLD_TYPE", "percentile") or "percentile",
+            breakpoint_threshold_amount=float(threshold) if threshold else None,
+        )
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+
+
+def iter_document_chunks(
+    file_path: Path,
+    chunker_type: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    file_name: Optional[str] = None,
+    digest: Optional[str] = None,
+) -> Iterator[Document]:
+    """
+    Genera los chunks de un documento página a página, con metadatos enriquecidos.
+
+    - file_name: nombre o ruta original (uploads/entradas de zip guardados en temporales)
+    - digest: SHA-256 del contenido; si se entrega, los IDs dependen del contenido
+      y re-subir el mismo archivo sobrescribe sus puntos en lugar de duplicarlos
+    """
+    name = Path(file_name).name if file_name else file_path.name
+    source = file_name or str(file_path)
+    ext = Path(name).suffix.lower()
+    splitter = make_splitter(chunker_type, chunk_size, chunk_overlap)
+    chunks = split_pages(load_pages(file_path, digest=digest), splitter)
+    for i, chunk in enumerate(chunks):
+        chunk.metadata.update({
+            "source": source,
+            "file_name": name,
+            "file_ext": ext,
+            "doc_type": doc_type_for(name),
+            "chunk_index": i,
+            "chunker_type": chunker_type,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap
+        })
+        if digest:
+            chunk.metadata["sha256"] = digest
+        # Generar ID estable
+        chunk.metadata["id"] = stable_chunk_id(
+            digest or source,
+            chunk.metadata.get("page", 0),
+            i,
+            chunk.page_content
+        )
+        yield chunk
+
+
+def chunk_file(
+    path: Path, file_name: str, digest: str, chunker_type: str, chunk_size: int, chunk_overlap: int
+) -> Tuple[List[Document], float, Optional[str]]:
+    """
+    Parsea y divide un archivo completo; retorna (chunks, segundos, error).
+
+    Corre en procesos ``spawn`` del pool de ``/ingest/archive``: vive en este
+    módulo (y no en ``app.server``) para que importarlo no arme el servidor.
+    """
+    t0 = time.perf_counter()
+    try:
+        chunks = list(iter_document_chunks(
+            path, chunker_type, chunk_size, chunk_overlap, file_name=file_name, digest=digest
+        ))
+        return chunks, time.perf_counter() - t0, None
+    except Exception as e:
+        return [], time.perf_counter() - t0, f"{type(e).__name__}: {e}"
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    batch: List[Any] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Failure:
+    """Excepción de una etapa, transportada por la cola hasta el hilo principal."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+_DONE = object()
+
+
+def stream_to_qdrant(
+    chunks: Iterable[Document],
+    client: QdrantClient,
+    collection: str,
+    embeddings: Embeddings,
+    batch_size: int = 64,
+    queue_size: int = 4,
+    embedding_model: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Embebe y sube chunks a Qdrant en lotes, con las etapas solapadas en hilos.
+
+    - hilo de carga: consume ``chunks`` (carga + split perezosos) y arma lotes
+    - hilo de embeddings: ``embed_documents`` por lote
+    - hilo llamador: crea la colección con el primer lote y hace upsert
+
+    El ID de cada punto es ``metadata["id"]`` si existe (IDs estables) o un
+    UUID aleatorio. Con ``embedding_model`` cada punto lo registra en sus
+    metadatos y, antes de escribir, se verifica que la colección no se haya
+    indexado con otro (``EmbeddingModelMismatch``). Retorna estadísticas de
+    tiempos por etapa y throughput.
+    """
+    if embedding_model:
+        check_embedding_model(client, collection, embedding_model)
+    split_q: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+    embed_q: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    timings = {"load_split_s": 0.0, "embed_s": 0.0, "upsert_s": 0.0}
+
+    def _put(q: "queue.Queue[Any]", item: Any) -> bool:
+        # Reintenta con timeout para no quedar bloqueado si otra etapa falló
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(q: "queue.Queue[Any]") -> Any:
+        while not stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _produce() -> None:
+        try:
+            batches = batched(chunks, batch_size)
+            while True:
+                t0 = time.perf_counter()
+                batch = next(batches, None)
+                timings["load_split_s"] += time.perf_counter() - t0
+                if batch is None:
+                    break
+                if not _put(split_q, batch):
+                    return
+            _put(split_q, _DONE)
+        except BaseException as e:
+            _put(split_q, _Failure(e))
+
+    def _embed() -> None:
+        try:
+            while True:
+                item = _get(split_q)
+                if item is _DONE or isinstance(item, _Failure):
+                    _put(embed_q, item)
+                    return
+                t0 = time.perf_counter()
+                vectors = embeddings.embed_documents([d.page_content for d in item])
+                timings["embed_s"] += time.perf_counter() - t0
+                if not _put(embed_q, (item, vectors)):
+                    return
+        except BaseException as e:
+            _put(embed_q, _Failure(e))
+
+    # Cada hilo hereda el contexto del llamador (p.ej. la atribución de uso de tokens)
+    threads = [
+        threading.Thread(target=contextvars.copy_context().run, args=(_produce,), name="ingest-load", daemon=True),
+        threading.Thread(target=contextvars.copy_context().run, args=(_embed,), name="ingest-embed", daemon=True),
+    ]
+    t_start = time.perf_counter()
+    for t in threads:
+        t.start()
+
+    total_chunks = 0
+    total_batches = 0
+    vector_size: Optional[int] = None
+    first_upsert_s: Optional[float] = None
+    try:
+        while True:
+            item = _get(embed_q)
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            docs, vectors = item
+            t0 = time.perf_counter()
+            if vector_size is None:
+                vector_size = len(vectors[0])
+                ensure_collection(client, collection, vector_size)
+            points = [
+                rest.PointStruct(
+                    id=str(d.metadata.get("id") or uuid.uuid4()),
+                    vector=v,
+                    payload={
+                        CONTENT_PAYLOAD_KEY: d.page_content,
+                        METADATA_PAYLOAD_KEY: (
+                            {**d.metadata, EMBEDDING_MODEL_FIELD: embedding_model} if embedding_model else d.metadata
+                        ),
+                    },
+                )
+                for d, v in zip(docs, vectors)
+            ]
+            client.upsert(collection_name=collection, points=points)
+            timings["upsert_s"] += time.perf_counter() - t0
+            total_chunks += len(points)
+            total_batches += 1
+            if first_upsert_s is None:
+                first_upsert_s = time.perf_counter() - t_start
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    elapsed = time.perf_counter() - t_start
+    return {
+        "chunks": total_chunks,
+        "batches": total_batches,
+        "vector_size": vector_size,
+        "elapsed_s": round(elapsed, 3),
+        "first_upsert_s": round(first_upsert_s, 3) if first_upsert_s is not None else None,
+        "chunks_per_s": round(total_chunks / elapsed, 1) if elapsed > 0 else 0.0,
+        **{k: round(v, 3) for k, v in timings.items()},
+    }
@@ -0,0 +1,67 @@
+"""
+Métricas de requests del servidor, expuestas en ``GET /metrics``.
+
+Por ruta (plantilla, p.ej. ``POST /ingest/upload/sessions/{upload_id}``)
+se acumulan conteos por status, latencia total y máxima y un histograma de
+latencias con buckets fijos, como los de Prometheus. Los contadores nunca se
+reinician: el cliente (p.ej. ``scripts/load_test.py``) toma dos snapshots
+y calcula la diferencia.
+"""
+
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from typing import Any, Dict, List
+
+# Límites superiores (s) de cada bucket; el último bucket es +Inf
+LATENCY_BUCKETS: List[float] = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+
+class RequestMetrics:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._in_flight = 0
+        self._routes: Dict[str, Dict[str, Any]] = {}
+
+    def start(self) -> None:
+        with self._lock:
+            self._in_flight += 1
+
+    def finish(self, route: str, status: int, seconds: float) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            entry = self._routes.get(route)
+            if entry is None:
+                entry = self._routes[route] = {
+                    "count": 0,
+                    "status": {},
+                    "latency_sum_s": 0.0,
+                    "latency_max_s": 0.0,
+                    "buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+                }
+            entry["count"] += 1
+            key = str(status)
+            entry["status"][key] = entry["status"].get(key, 0) + 1
+            entry["latency_sum_s"] += seconds
+            entry["latency_max_s"] = max(entry["latency_max_s"], seconds)
+            entry["buckets"][bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = {
+                name: {**entry, "status": dict(entry["status"]), "buckets": list(entry["buckets"])}
+                for name, entry in self._routes.items()
+            }
+            in_flight = self._in_flight
+        return {
+            "uptime_s": round(time.time() - self._started, 3),
+            "in_flight": in_flight,
+            "buckets_le_s": LATENCY_BUCKETS + ["+Inf"],
+            "routes": routes,
+        }
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,145 @@
+"""
+Configuración recargable de la búsqueda RAG.
+
+Los parámetros que se ajustan en caliente (``RELOADABLE``) se leen del
+entorno al arrancar y pueden cambiarse luego sin reiniciar, por el endpoint
+de administración o editando ``RAG_CONFIG_FILE`` (JSON con las mismas claves,
+p.ej. ``{"RAG_TOP_K": 6, "RAG_SEARCH_TYPE": "mmr"}``), que ``ConfigWatcher``
+vigila por mtime.
+
+Los valores se validan acá; el servidor arma con ellos una cadena nueva,
+la calienta y la intercambia de una vez (ver ``reload_rag_runtime`` en
+``app.server``). Las requests en curso terminan con la cadena con que empezaron.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+SEARCH_TYPES = {"similarity", "mmr"}
+
+# Clave -> valor por defecto (como string, igual que en el entorno)
+RELOADABLE: Dict[str, str] = {
+    "RAG_TOP_K": "4",
+    "RAG_SEARCH_TYPE": "similarity",
+    "RAG_FETCH_K": "20",
+    "RAG_MMR_LAMBDA": "0.5",
+    "RAG_EMBED_MODEL": "text-embedding-3-small",
+    "RAG_ABSTAIN_THRESHOLD": "",
+}
+
+
+def _optional_float(value: Any) -> Optional[float]:
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    return float(value)
+
+
+_PARSERS: Dict[str, Callable[[Any], Any]] = {
+    "RAG_TOP_K": int,
+    "RAG_SEARCH_TYPE": lambda v: str(v).strip().lower(),
+    "RAG_FETCH_K": int,
+    "RAG_MMR_LAMBDA": float,
+    "RAG_EMBED_MODEL": lambda v: str(v).strip(),
+    "RAG_ABSTAIN_THRESHOLD": _optional_float,
+}
+
+
+def settings_from_env() -> Dict[str, Any]:
+    return validate_settings({k: os.getenv(k, default) or default for k, default in RELOADABLE.items()})
+
+
+def load_settings_file(path: Path) -> Dict[str, Any]:
+    """Claves recargables de un JSON; las desconocidas son un error (probable typo)."""
+    data = json.loads(Path(path).read_text(encoding="utf-8") or "{}")
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: se esperaba un objeto JSON")
+    return data
+
+
+def validate_settings(values: Dict[str, Any], base: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    ``base`` (o los defaults) con ``values`` encima, parseado y validado.
+    Lanza ``ValueError`` con todos los problemas encontrados.
+    """
+    unknown = sorted(set(values) - set(RELOADABLE))
+    errors: List[str] = [f"{k}: no es recargable" for k in unknown]
+    merged: Dict[str, Any] = dict(base) if base else {k: _PARSERS[k](v) for k, v in RELOADABLE.items()}
+    for key, raw in values.items():
+        if key in unknown:
+            continue
+        try:
+            merged[key] = _PARSERS[key](raw)
+        except (TypeError, ValueError):
+            errors.append(f"{key}: valor inválido {raw!r}")
+
+    if not errors:
+        if merged["RAG_SEARCH_TYPE"] not in SEARCH_TYPES:
+            errors.append(f"RAG_SEARCH_TYPE: debe ser uno de {sorted(SEARCH_TYPES)}")
+        if not 1 <= merged["RAG_TOP_K"] <= 100:
+            errors.append("RAG_TOP_K: debe estar entre 1 y 100")
+        if merged["RAG_SEARCH_TYPE"] == "mmr" and merged["RAG_FETCH_K"] < merged["RAG_TOP_K"]:
+            errors.append("RAG_FETCH_K: debe ser >= RAG_TOP_K")
+        if not 0.0 <= merged["RAG_MMR_LAMBDA"] <= 1.0:
+            errors.append("RAG_MMR_LAMBDA: debe estar entre 0 y 1")
+        if not merged["RAG_EMBED_MODEL"]:
+            errors.append("RAG_EMBED_MODEL: no puede ser vacío")
+        threshold = merged["RAG_ABSTAIN_THRESHOLD"]
+        if threshold is not None and not -1.0 <= threshold <= 1.0:
+            errors.append("RAG_ABSTAIN_THRESHOLD: debe estar entre -1 y 1 (score coseno)")
+    if errors:
+        raise ValueError("; ".join(errors))
+    return merged
+
+
+def search_kwargs(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """Parámetros de búsqueda del retriever para una configuración."""
+    kwargs: Dict[str, Any] = {"k": settings["RAG_TOP_K"]}
+    if settings["RAG_SEARCH_TYPE"] == "mmr":
+        kwargs.update({"fetch_k": settings["RAG_FETCH_K"], "lambda_mult": settings["RAG_MMR_LAMBDA"]})
+    return kwargs
+
+
+class ConfigWatcher:
+    """Llama a ``on_change`` cuando cambia el mtime de ``path`` (sondeo cada ``interval_s``)."""
+
+    def __init__(self, path: Path, on_change: Callable[[], Any], interval_s: float = 2.0):
+        self.path = Path(path)
+        self.on_change = on_change
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._mtime = self._current_mtime()
+
+    def _current_mtime(self) -> Optional[int]:
+        try:
+            return self.path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval_s):
+            mtime = self._current_mtime()
+            if mtime is None or mtime == self._mtime:
+                continue
+            self._mtime = mtime
+            try:
+                self.on_change()
+            except Exception as e:
+                # Una config inválida no detiene el watcher: se reintenta con el próximo cambio
+                print(f"Config de {self.path} rechazada: {e}")
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rag-config-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval_s + 1)
+            self._thread = None
@@ -0,0 +1,56 @@
+"""
+Prompt de la cadena RAG y formato del contexto recuperado.
+
+Compartido por el servidor y por los scripts que arman la misma cadena
+fuera de él (p.ej. ``scripts/tune_rag.py``), para que midan exactamente el
+prompt que se usa en producción.
+"""
+
+from __future__ import annotations
+
+import os
+from typing import List
+
+from langchain_core.documents import Document
+from langchain_core.prompts import ChatPromptTemplate
+
+
+ABSTENTION_TEXT = (
+    "No tengo información suficiente para responder esta pregunta basándome en los documentos disponibles."
+)
+
+
+def abstention_phrase() -> str:
+    """Prefijo (en minúsculas) con el que se reconoce una abstención en las respuestas."""
+    return os.getenv("RAG_ABSTENTION_TEXT", "No tengo información suficiente").lower()
+
+
+def format_docs(docs: List[Document]) -> str:
+    lines = []
+    for d in docs:
+        meta = d.metadata or {}
+        src = meta.get("file_name") or meta.get("source") or "unknown"
+        page = meta.get("page")
+        prefix = f"[source: {src}, page: {page}]" if page is not None else f"[source: {src}]"
+        lines.append(f"{prefix}\n{d.page_content}")
+    return "\n\n---\n\n".join(lines)
+
+
+RAG_PROMPT = ChatPromptTemplate.from_messages([
+    ("system",
+     "You are an expert RAG (Retrieval-Augmented Generation) assistant. Your role is to answer questions based EXCLUSIVELY on the provided CONTEXT from the knowledge base. "
+     "You must follow these strict rules:\n\n"
+     "1. **ONLY use information from the CONTEXT** - Do not use external knowledge\n"
+     f"2. **If insufficient information exists**, respond exactly: '{ABSTENTION_TEXT}'\n"
+     "3. **Always cite sources** - Include file_name and page number when available\n"
+     "4. **Be accurate and precise** - Don't make assumptions or inferences beyond the context\n"
+     "5. **Structure your response** - Use clear paragraphs and bullet points when appropriate\n"
+     "6. **Maintain objectivity** - Present information factually without bias\n\n"
+     "Your expertise is in analyzing and synthesizing information from the provided documents to give accurate, well-referenced answers."),
+    ("human",
+     "Question: {question}\n\n"
+     "CONTEXT (from knowledge base):\n{context}\n\n"
+     "Instructions: Answer the question using ONLY the information in the context above. "
+     "If the context doesn't contain enough information, say so clearly. "
+     "Always cite your sources with file names and page numbers when available.")
+])
@@ -0,0 +1,285 @@
+"""
+Límite de requests por cliente para los endpoints que gastan cuota de OpenAI.
+
+Token bucket por cliente y clase de endpoint (``rag``, ``chat``,
+``summarize``, ``ingest``, ``eval``): cada bucket tiene ``capacity`` fichas (la ráfaga
+permitida) y se rellena a ``capacity / window_s`` fichas por segundo; cada
+request consume una. Sin fichas se responde 429 con ``Retry-After``.
+
+El cliente es la API key (``X-API-Key`` o ``Authorization: Bearer``) si está
+en ``api_keys``, y si no la IP. Con ``trust_proxy`` la IP es la que informa el
+proxy de fly.io en ``Fly-Client-IP`` o, si falta, el último ``X-Forwarded-For``
+(el que agrega nuestro proxy; los anteriores los escribe el cliente). Una key
+desconocida cuenta como la IP, para que inventar keys no dé buckets nuevos.
+
+Un bucket es solo ``(fichas, última actualización)``. Un bucket sin uso
+durante ``capacity / rate`` segundos ya está lleno, igual que uno inexistente,
+así que se puede descartar sin cambiar el resultado: la memoria es
+proporcional a los clientes activos. ``MemoryBucketStore`` es por proceso;
+con varios workers ``SQLiteBucketStore`` comparte los buckets en un archivo.
+
+Las respuestas llevan ``RateLimit-Limit``, ``RateLimit-Remaining``,
+``RateLimit-Reset`` y ``RateLimit-Policy`` (draft IETF de headers de rate limit).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+# (capacity, window_s): capacity requests de ráfaga, rellenadas en window_s segundos
+Rule = Tuple[int, float]
+# (permitido, fichas restantes, segundos hasta la próxima ficha, segundos hasta llenarse)
+TakeResult = Tuple[bool, float, float, float]
+
+DEFAULT_RULES: Dict[str, str] = {
+    "rag": "30/60",
+    "chat": "30/60",
+    "summarize": "10/60",
+    "ingest": "20/300",
+    "eval": "10/60",
+}
+
+# Ruta (POST; ``{param}`` = un segmento cualquiera) -> clase de endpoint
+DEFAULT_ROUTES: Dict[str, str] = {
+    "/rag/query": "rag",
+    "/chatgpt/chat": "chat",
+    "/openai/summarize": "summarize",
+    "/ingest/upload": "ingest",
+    "/ingest/upload/sessions": "ingest",
+    "/ingest/upload/sessions/{upload_id}/complete": "ingest",
+    "/ingest/archive": "ingest",
+    "/eval/run": "eval",
+    "/eval/test": "eval",
+}
+
+
+def parse_rule(spec: Optional[str]) -> Optional[Rule]:
+    """``"30/60"`` -> 30 requests cada 60 s; vacío o ``"0"`` = sin límite."""
+    spec = (spec or "").strip()
+    if not spec or spec == "0":
+        return None
+    count, _, window = spec.partition("/")
+    capacity, window_s = int(count), float(window or 60)
+    if capacity <= 0 or window_s <= 0:
+        raise ValueError(f"Regla de rate limit inválida: {spec!r} (formato N/segundos)")
+    return capacity, window_s
+
+
+def request_api_key(headers: Mapping[str, str]) -> str:
+    """API key de ``X-API-Key`` o ``Authorization: Bearer``; "" si no hay."""
+    key = headers.get("x-api-key") or ""
+    auth = headers.get("authorization") or ""
+    if not key and auth.lower().startswith("bearer "):
+        key = auth[7:].strip()
+    return key
+
+
+def _route_pattern(template: str) -> "re.Pattern[str]":
+    parts = re.split(r"\{[^/{}]+\}", template)
+    return re.compile("[^/]+".join(re.escape(p) for p in parts) + r"\Z")
+
+
+def _refill(tokens: float, updated: float, now: float, capacity: int, rate: float, cost: float) -> Tuple[float, TakeResult]:
+    tokens = min(float(capacity), tokens + max(0.0, now - updated) * rate)
+    allowed = tokens >= cost
+    if allowed:
+        tokens -= cost
+    retry_after = 0.0 if allowed else (cost - tokens) / rate
+    return tokens, (allowed, tokens, retry_after, (capacity - tokens) / rate)
+
+
+class MemoryBucketStore:
+    """Buckets en un LRU por proceso; expulsa los que ya se rellenaron solos."""
+
+    blocking = False
+
+    def __init__(self, max_clients: int = 100000):
+        self.max_clients = max(1, max_clients)
+        self._lock = threading.Lock()
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.evicted = 0
+
+    def take(self, key: str, capacity: int, rate: float, idle_s: float, cost: float = 1.0) -> TakeResult:
+        now = time.monotonic()
+        with self._lock:
+            self._evict(now - idle_s)
+            bucket = self._buckets.get(key)
+            tokens, updated = (bucket[0], bucket[1]) if bucket else (float(capacity), now)
+            tokens, result = _refill(tokens, updated, now, capacity, rate, cost)
+            self._buckets[key] = [tokens, now]
+            self._buckets.move_to_end(key)
+            # Tope duro: el expulsado vuelve con el bucket lleno, pero la memoria queda acotada
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+            return result
+
+    def _evict(self, cutoff: float) -> None:
+        # Orden LRU = orden de última actualización: los viejos están al principio
+        while self._buckets:
+            key, bucket = next(iter(self._buckets.items()))
+            if bucket[1] >= cutoff:
+                break
+            del self._buckets[key]
+            self.evicted += 1
+
+    def count(self) -> int:
+        with self._lock:
+            return len(self._buckets)
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS buckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS buckets_updated ON buckets(updated);
+"""
+
+
+class SQLiteBucketStore:
+    """Buckets compartidos entre workers en SQLite (una transacción por request)."""
+
+    blocking = True
+
+    def __init__(self, path: Path, purge_every: int = 1000):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.purge_every = max(1, purge_every)
+        self._takes = 0
+        self.evicted = 0
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def take(self, key: str, capacity: int, rate: float, idle_s: float, cost: float = 1.0) -> TakeResult:
+        now = time.time()
+        conn = self._connect()
+        try:
+            # IMMEDIATE: leer y escribir el bucket sin que otro worker se meta en el medio
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (float(capacity), now)
+            tokens, result = _refill(tokens, updated, now, capacity, rate, cost)
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now)
+            )
+            self._takes += 1
+            if self._takes % self.purge_every == 0:
+                self.evicted += conn.execute("DELETE FROM buckets WHERE updated < ?", (now - idle_s,)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return result
+
+    def count(self) -> int:
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+
+def get_bucket_store(path: Optional[str] = None, max_clients: int = 100000) -> Any:
+    """SQLite si hay ruta (``RAG_RATE_LIMIT_DB``); si no, en memoria."""
+    if path:
+        return SQLiteBucketStore(Path(path))
+    return MemoryBucketStore(max_clients=max_clients)
+
+
+class RateLimiter:
+    """Decide por request si hay fichas y arma los headers ``RateLimit-*``."""
+
+    def __init__(
+        self,
+        store: Any,
+        rules: Mapping[str, Optional[Rule]],
+        routes: Mapping[str, str] = DEFAULT_ROUTES,
+        api_keys: Iterable[str] = (),
+        trust_proxy: bool = False,
+    ):
+        self.store = store
+        self.rules = {name: rule for name, rule in rules.items() if rule is not None}
+        self.routes = dict(routes)
+        # Exactas por dict; las con parámetros, por regex
+        self._templates = [(_route_pattern(path), name) for path, name in self.routes.items() if "{" in path]
+        self._key_ids = {hashlib.sha256(k.encode("utf-8")).hexdigest()[:16] for k in api_keys if k}
+        self.trust_proxy = trust_proxy
+        # Tiempo en que cualquier bucket se llena solo: pasado eso se puede descartar
+        self.idle_s = max((window for _, window in self.rules.values()), default=60.0)
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Dict[str, int]] = {name: {"allowed": 0, "limited": 0} for name in self.rules}
+
+    @property
+    def blocking(self) -> bool:
+        return getattr(self.store, "blocking", False)
+
+    def endpoint_class(self, method: str, path: str) -> Optional[str]:
+        if method != "POST":
+            return None
+        path = path.rstrip("/") or "/"
+        name = self.routes.get(path)
+        if name is None:
+            name = next((n for pattern, n in self._templates if pattern.match(path)), None)
+        return name if name in self.rules else None
+
+    def client_id(self, headers: Mapping[str, str], client_host: Optional[str]) -> str:
+        key = request_api_key(headers)
+        if key:
+            key_id = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+            if key_id in self._key_ids:
+                return f"key:{key_id}"
+        if self.trust_proxy:
+            forwarded = headers.get("fly-client-ip") or (headers.get("x-forwarded-for") or "").split(",")[-1].strip()
+            if forwarded:
+                return f"ip:{forwarded}"
+        return f"ip:{client_host or 'unknown'}"
+
+    def check(self, endpoint_class: str, client: str) -> Tuple[bool, Dict[str, str]]:
+        """Consume una ficha; retorna si se permite y los headers para la respuesta."""
+        capacity, window_s = self.rules[endpoint_class]
+        allowed, remaining, retry_after, reset = self.store.take(
+            f"{endpoint_class}:{client}", capacity, capacity / window_s, self.idle_s
+        )
+        with self._lock:
+            self._counts[endpoint_class]["allowed" if allowed else "limited"] += 1
+        headers = {
+            "RateLimit-Limit": str(capacity),
+            "RateLimit-Remaining": str(int(math.floor(remaining))),
+            "RateLimit-Reset": str(int(math.ceil(reset))),
+            "RateLimit-Policy": f"{capacity};w={int(window_s)}",
+        }
+        if not allowed:
+            headers["Retry-After"] = str(max(1, int(math.ceil(retry_after))))
+        return allowed, headers
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = {name: dict(c) for name, c in self._counts.items()}
+        return {
+            "backend": type(self.store).__name__,
+            "active_buckets": self.store.count(),
+            "evicted": self.store.evicted,
+            "idle_s": self.idle_s,
+            "trust_proxy": self.trust_proxy,
+            "api_keys": len(self._key_ids),
+            "rules": {
+                name: {"capacity": capacity, "window_s": window_s, **counts[name]}
+                for name, (capacity, window_s) in self.rules.items()
+            },
+            "routes": {path: name for path, name in self.routes.items() if name in self.rules},
+        }
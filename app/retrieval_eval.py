@@ -0,0 +1,160 @@
+"""
+Métricas de recuperación sobre los sets de evaluación (``eval/*.jsonl``).
+
+Cada pregunta answerable termina su ``expected`` con ``Fuente: <archivo>``.
+Si ese nombre no existe en el corpus indexado (los nombres del set y de
+``data/`` no coinciden), se aceptan los archivos con la misma extensión,
+que en este corpus identifica un único documento.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.embeddings import Embeddings
+from qdrant_client import QdrantClient
+
+from app.vectorstore import METADATA_PAYLOAD_KEY
+
+_SOURCE_RE = re.compile(r"Fuente:\s*([^\n]+?)\s*$")
+
+# search(pregunta, k) -> nombres de archivo de los k resultados, en orden
+SearchFn = Callable[[str, int], List[str]]
+
+
+def load_jsonl(path: Path) -> List[Dict[str, Any]]:
+    rows = []
+    with Path(path).open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                rows.append(json.loads(line))
+    return rows
+
+
+def expected_source(row: Dict[str, Any]) -> Optional[str]:
+    match = _SOURCE_RE.search(str(row.get("expected", "")).strip())
+    return match.group(1) if match else None
+
+
+def resolve_sources(expected: str, corpus_names: Iterable[str]) -> Set[str]:
+    """Archivos del corpus que cuentan como la fuente esperada."""
+    names = set(corpus_names)
+    if expected in names:
+        return {expected}
+    suffix = Path(expected).suffix.lower()
+    return {n for n in names if Path(n).suffix.lower() == suffix}
+
+
+def _file_name(payload: Optional[Dict[str, Any]]) -> str:
+    return ((payload or {}).get(METADATA_PAYLOAD_KEY) or {}).get("file_name", "")
+
+
+def search_points(
+    client: QdrantClient,
+    collection: str,
+    vector: List[float],
+    k: int,
+    search_type: str = "similarity",
+    fetch_k: int = 20,
+    lambda_mult: float = 0.5,
+    with_payload: Any = True,
+) -> List[Any]:
+    """
+    Top-k de Qdrant con la misma selección que el retriever de LangChain
+    (``similarity`` o ``mmr`` sobre ``fetch_k`` candidatos).
+    """
+    if search_type != "mmr":
+        return client.search(collection_name=collection, query_vector=vector, limit=k, with_payload=with_payload)
+    hits = client.search(
+        collection_name=collection,
+        query_vector=vector,
+        limit=max(fetch_k, k),
+        with_payload=with_payload,
+        with_vectors=True,
+    )
+    if not hits:
+        return []
+    selected = maximal_marginal_relevance(
+        np.array(vector), [h.vector for h in hits], k=k, lambda_mult=lambda_mult
+    )
+    return [hits[i] for i in selected]
+
+
+def search_file_names(
+    client: QdrantClient,
+    collection: str,
+    vector: List[float],
+    k: int,
+    search_type: str = "similarity",
+    fetch_k: int = 20,
+    lambda_mult: float = 0.5,
+) -> List[str]:
+    """``search_points`` devolviendo solo ``metadata.file_name`` de cada resultado."""
+    hits = search_points(
+        client, collection, vector, k, search_type, fetch_k, lambda_mult,
+        with_payload=[f"{METADATA_PAYLOAD_KEY}.file_name"],
+    )
+    return [_file_name(h.payload) for h in hits]
+
+
+def qdrant_search(client: QdrantClient, collection: str, embeddings: Embeddings) -> SearchFn:
+    """Búsqueda vectorial directa en Qdrant, devolviendo ``metadata.file_name``."""
+
+    def search(question: str, k: int) -> List[str]:
+        return search_file_names(client, collection, embeddings.embed_query(question), k)
+
+    return search
+
+
+def collection_file_names(client: QdrantClient, collection: str) -> Set[str]:
+    """Nombres de archivo distintos indexados en la colección (recorre solo ese campo del payload)."""
+    names: Set[str] = set()
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection,
+            limit=1000,
+            offset=offset,
+            with_payload=[f"{METADATA_PAYLOAD_KEY}.file_name"],
+            with_vectors=False,
+        )
+        names.update(n for n in (_file_name(p.payload) for p in points) if n)
+        if offset is None:
+            return names
+
+
+def evaluate_retrieval(
+    search: SearchFn,
+    rows: List[Dict[str, Any]],
+    corpus_names: Iterable[str],
+    k: int = 4,
+) -> Dict[str, Any]:
+    """
+    recall@k (preguntas con al menos un chunk de la fuente esperada en el top-k)
+    y MRR; las preguntas sin ``Fuente:`` resoluble se omiten.
+    """
+    corpus_names = set(corpus_names)
+    per_question = []
+    for row in rows:
+        expected = expected_source(row)
+        relevant = resolve_sources(expected, corpus_names) if expected else set()
+        if not relevant:
+            continue
+        results = search(row["question"], k)
+        rank = next((i + 1 for i, name in enumerate(results) if name in relevant), None)
+        per_question.append({"question": row["question"], "expected": expected, "rank": rank})
+    n = len(per_question)
+    hits = sum(1 for q in per_question if q["rank"])
+    return {
+        "k": k,
+        "questions": n,
+        "recall_at_k": round(hits / n, 4) if n else None,
+        "mrr": round(sum(1 / q["rank"] for q in per_question if q["rank"]) / n, 4) if n else None,
+        "per_question": per_question,
+    }
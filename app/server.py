@@ -1,33 +1,81 @@
-from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Header, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv, find_dotenv
+import asyncio
 import os
 import tempfile
-import shutil
 import json
+import hashlib
+import uuid
+import time
+import zipfile
+import tarfile
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
 from datetime import datetime
+from functools import partial
+import hmac
+import multiprocessing
+import threading
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo el candado dentro del proceso
+    fcntl = None
 
 # RAG imports
-from typing import List, Dict, Any, Optional, Set
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Set, Tuple
 from pydantic import BaseModel
-from qdrant_client import QdrantClient
-from langchain_openai import OpenAIEmbeddings
 from langchain_community.vectorstores import Qdrant
 from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
 from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
+from langchain_core.runnables import ConfigurableField, RunnablePassthrough
+from qdrant_client.http import models as rest
+
+from app.backends import get_chat_model, get_qdrant_client, qdrant_collection, qdrant_configured
+from app.abstention import AbstentionGate, abstaining_chain
+from app.cascade import RAGCascade
+from app.chat_sessions import ConversationMemory, UnknownSession, get_session_store
+from app.extraction_cache import file_sha256
+from app.eval_scoring import score_results
+from app.eval_store import (
+    answer_passed,
+    answers_summary,
+    get_eval_store,
+    load_json_cached,
+    load_jsonl_cached,
+)
+from app.metrics import request_metrics
+from app.rate_limit import DEFAULT_RULES, RateLimiter, get_bucket_store, parse_rule, request_api_key
+from app.rag_config import (
+    ConfigWatcher,
+    load_settings_file,
+    search_kwargs as rag_search_kwargs,
+    settings_from_env,
+    validate_settings,
+)
+from app.summarization import Summarizer
+from app.tenants import (
+    DEFAULT_COLLECTION_PATTERN,
+    CollectionGrants,
+    TenantPool,
+    UnknownCollection,
+    validate_collection,
+)
+from app.usage import usage_scope, usage_tracker
+from app.rag_prompt import ABSTENTION_TEXT, RAG_PROMPT, abstention_phrase, format_docs
+from app.ingestion import chunk_file, iter_document_chunks, stream_to_qdrant
+from app.vectorstore import EmbeddingModelMismatch, build_metadata_filter, check_embedding_model, retrieve_with_scores
 
 # Document processing imports
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-try:
-    from langchain_experimental.text_splitters import SemanticChunker as _SemanticChunker
-except Exception:
-    _SemanticChunker = None
-from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
+from app.embeddings import get_embeddings
 
 # Cargar variables desde el .env más cercano (prioriza el de la raíz del proyecto)
 # sin sobreescribir variables ya presentes en el entorno
@@ -67,13 +115,43 @@ summarization_assistant_prompt = PromptTemplate(
     template=summarization_assistant_template,
 )
 
-llm = ChatOpenAI(model="gpt-4o", temperature=0.5)
+llm = get_chat_model("gpt-4o", temperature=0.5)
 llm_chain = summarization_assistant_prompt | llm
 
+# Resumen map-reduce: trozos por tokens en paralelo y reducción por niveles con la misma plantilla
+summarizer = Summarizer(
+    llm_chain | StrOutputParser(),
+    model="gpt-4o",
+    chunk_tokens=int(os.getenv("RAG_SUMMARY_CHUNK_TOKENS", "3000") or 3000),
+    chunk_overlap=int(os.getenv("RAG_SUMMARY_CHUNK_OVERLAP", "200") or 200),
+    reduce_tokens=int(os.getenv("RAG_SUMMARY_REDUCE_TOKENS", "6000") or 6000),
+    max_concurrency=int(os.getenv("RAG_SUMMARY_CONCURRENCY", "4") or 4),
+    cache_size=int(os.getenv("RAG_SUMMARY_CACHE_SIZE", "256") or 256),
+)
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    # RAG_CONFIG_FILE: editar el archivo recarga la configuración RAG sin reiniciar
+    watcher = None
+    config_file = _get_env("RAG_CONFIG_FILE")
+    if config_file:
+        watcher = ConfigWatcher(
+            Path(config_file), _reload_from_file, interval_s=float(_get_env("RAG_CONFIG_WATCH_S", "2") or 2)
+        )
+        watcher.start()
+    yield
+    if watcher is not None:
+        watcher.stop()
+    if _archive_executor["pool"] is not None:
+        _archive_executor["pool"].shutdown(cancel_futures=True)
+    # Totales de uso pendientes de volcar a disco
+    usage_tracker.flush()
+
 app = FastAPI(
     title="LangChain Server",
     version="1.0",
     description="Summarization App",
+    lifespan=_lifespan,
 )
 
 # Montar archivos estáticos
@@ -83,6 +161,98 @@ except Exception:
     # Si no existe el directorio, ignorar
     pass
 
+# API keys de clientes y las colecciones que puede usar cada una
+collection_grants = CollectionGrants(os.getenv("RAG_API_KEYS"))
+
+# Rate limit por cliente (API key o IP) y clase de endpoint; RAG_RATE_LIMIT=0 lo apaga
+rate_limiter = RateLimiter(
+    get_bucket_store(
+        os.getenv("RAG_RATE_LIMIT_DB") or None,
+        max_clients=int(os.getenv("RAG_RATE_LIMIT_MAX_CLIENTS", "100000") or 100000),
+    ),
+    {
+        name: parse_rule(os.getenv(f"RAG_RATE_LIMIT_{name.upper()}", default))
+        for name, default in DEFAULT_RULES.items()
+    } if (os.getenv("RAG_RATE_LIMIT", "1") or "1").lower() not in {"0", "false", "no", "off"} else {},
+    api_keys=collection_grants.keys,
+    trust_proxy=(os.getenv("RAG_TRUST_PROXY", "0") or "0").lower() in {"1", "true", "yes", "on"},
+)
+
+# Declarado antes que _record_metrics para quedar adentro: los 429 también se cuentan en /metrics
+@app.middleware("http")
+async def _rate_limit(request, call_next):
+    """Token bucket por cliente en los endpoints que llaman a OpenAI; 429 con Retry-After al agotarse."""
+    endpoint_class = rate_limiter.endpoint_class(request.method, request.url.path)
+    if endpoint_class is None:
+        return await call_next(request)
+    client = rate_limiter.client_id(request.headers, request.client.host if request.client else None)
+    if rate_limiter.blocking:
+        allowed, headers = await run_in_threadpool(rate_limiter.check, endpoint_class, client)
+    else:
+        allowed, headers = rate_limiter.check(endpoint_class, client)
+    if not allowed:
+        return JSONResponse(
+            {"detail": f"Demasiadas requests a {request.url.path}; reintentar en {headers['Retry-After']} s"},
+            status_code=429,
+            headers=headers,
+        )
+    response = await call_next(request)
+    response.headers.update(headers)
+    return response
+
+@app.get("/rate-limit")
+async def get_rate_limit():
+    """Reglas por clase de endpoint, requests permitidas/limitadas y buckets activos."""
+    return await run_in_threadpool(rate_limiter.stats)
+
+@app.middleware("http")
+async def _record_metrics(request, call_next):
+    """Cuenta requests, status y latencia por ruta (plantilla) para /metrics."""
+    if request.url.path == "/metrics" or request.url.path.startswith("/static"):
+        return await call_next(request)
+    request_metrics.start()
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        name = f"{request.method} {route.path}" if route is not None else "unmatched"
+        request_metrics.finish(name, status, time.perf_counter() - t0)
+
+@app.get("/metrics")
+async def get_metrics():
+    """Contadores acumulados por ruta: requests, status, latencias e histograma."""
+    return request_metrics.snapshot()
+
+@app.get("/rag/cascade")
+async def get_cascade_stats():
+    """Por nivel de la cascada: llamadas, aceptadas, escalamientos, latencias, tokens y costo."""
+    cascade = rag_runtime["cascade"]
+    if cascade is None:
+        return {"enabled": False}
+    return {"enabled": True, **cascade.stats()}
+
+@app.get("/rag/abstention")
+async def get_abstention_stats():
+    """Atajo de abstención: umbral, preguntas cortadas, llamadas al LLM y segundos ahorrados."""
+    gate = rag_runtime["gate"]
+    if gate is None:
+        return {"enabled": False}
+    return {"enabled": True, **gate.stats()}
+
+@app.get("/usage")
+async def get_usage(top: int = 20, x_admin_token: Optional[str] = Header(None)):
+    """
+    Tokens y costo estimado acumulados por endpoint, colección y modelo, con tasas
+    recientes; con ``X-Admin-Token`` también las preguntas más caras (por hash).
+    """
+    if x_admin_token:
+        _require_admin(x_admin_token)
+    return usage_tracker.snapshot(top=max(0, min(top, 500)), questions=bool(x_admin_token))
+
 @app.get("/")
 def root():
     """Endpoint raíz que redirige automáticamente al dashboard."""
@@ -385,17 +555,39 @@ async def ingest_playground():
 # Simple OpenAI endpoints
 @app.post("/openai/summarize")
 async def summarize_text(request: dict):
-    """Summarize text using the LLM chain."""
+    """
+    Summarize text using the LLM chain (map-reduce for long texts).
+
+    Con ``"stream": true`` responde JSON por línea: ``start``, ``map``,
+    ``reduce``, ``token`` (resumen final en partes) y ``done``.
+    """
+    text = request.get("text_for_summarization", "")
+    if not text:
+        raise HTTPException(status_code=400, detail="Text is required")
+
+    if request.get("stream"):
+        async def lines():
+            with usage_scope("openai_summarize"):
+                try:
+                    async for event in summarizer.events(text):
+                        yield json.dumps(event, ensure_ascii=False) + "\n"
+                except Exception as e:
+                    yield json.dumps({"event": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
     try:
-        text = request.get("text_for_summarization", "")
-        if not text:
-            raise HTTPException(status_code=400, detail="Text is required")
-        
-        response = llm.invoke(text)
-        return {"summary": response.content}
+        with usage_scope("openai_summarize"):
+            result = await summarizer.summarize(text)
+        return {k: v for k, v in result.items() if k != "event"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/openai/summarize/stats")
+async def summarize_stats():
+    """Llamadas, trozos y aciertos de caché del resumen map-reduce."""
+    return summarizer.stats()
+
 @app.get("/openai/playground/")
 async def openai_playground():
     """Interfaz moderna para resumen de texto con estilo chileno."""
@@ -786,11 +978,49 @@ async def openai_playground():
                     const response = await fetch('/openai/summarize', {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ text_for_summarization: text })
+                        body: JSON.stringify({ text_for_summarization: text, stream: true })
                     });
                     
-                    const data = await response.json();
-                    if (response.ok) {
+                    if (!response.ok) {
+                        const error = await response.json();
+                        summaryOutput.innerHTML = '❌ <strong>Error:</strong> ' + error.detail;
+                        return;
+                    }
+                    
+                    // JSON por línea: progreso del map-reduce y luego el resumen en partes
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+                    let streamed = '';
+                    let data = null;
+                    while (true) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, { stream: true });
+                        const lines = buffer.split('\\n');
+                        buffer = lines.pop();
+                        for (const line of lines) {
+                            if (!line.trim()) continue;
+                            const event = JSON.parse(line);
+                            if (event.event === 'start' && event.pieces > 1) {
+                                summaryOutput.innerHTML = '<div class="loading">⏳ Texto largo: resumiendo ' + event.pieces + ' partes...</div>';
+                            } else if (event.event === 'map') {
+                                summaryOutput.innerHTML = '<div class="loading">⏳ Partes resumidas: ' + event.done + '/' + event.total + '</div>';
+                            } else if (event.event === 'reduce') {
+                                summaryOutput.innerHTML = '<div class="loading">⏳ Combinando resúmenes (nivel ' + event.level + ')...</div>';
+                            } else if (event.event === 'token') {
+                                streamed += event.text;
+                                summaryOutput.textContent = streamed;
+                            } else if (event.event === 'done') {
+                                data = event;
+                            } else if (event.event === 'error') {
+                                summaryOutput.innerHTML = '❌ <strong>Error:</strong> ' + event.detail;
+                                return;
+                            }
+                        }
+                    }
+                    
+                    if (data) {
                         // Mostrar resumen
                         summaryOutput.textContent = data.summary;
                         
@@ -804,7 +1034,7 @@ async def openai_playground():
                         // Scroll suave a la sección de salida
                         outputSection.scrollIntoView({ behavior: 'smooth' });
                     } else {
-                        summaryOutput.innerHTML = '❌ <strong>Error:</strong> ' + data.detail;
+                        summaryOutput.innerHTML = '❌ <strong>Error:</strong> la respuesta terminó sin resumen';
                     }
                 } catch (error) {
                     summaryOutput.innerHTML = '❌ <strong>Error de conexión:</strong> No se pudo conectar con el servidor';
@@ -848,94 +1078,307 @@ def _get_env(name: str, default: str | None = None) -> str | None:
     val = os.getenv(name, default)
     return val
 
-def _format_docs(docs: List[Document]) -> str:
-    lines = []
-    for d in docs:
-        meta = d.metadata or {}
-        src = meta.get("file_name") or meta.get("source") or "unknown"
-        page = meta.get("page")
-        prefix = f"[source: {src}, page: {page}]" if page is not None else f"[source: {src}]"
-        lines.append(f"{prefix}\n{d.page_content}")
-    return "\n\n---\n\n".join(lines)
-
-def build_rag_chain() -> Any:  # returns Runnable
-    # Config desde entorno
-    rag_top_k = int(_get_env("RAG_TOP_K", "4") or 4)
-    rag_search_type = _get_env("RAG_SEARCH_TYPE", "similarity") or "similarity"
-    rag_fetch_k = int(_get_env("RAG_FETCH_K", "20") or 20)
-    rag_mmr_lambda = float(_get_env("RAG_MMR_LAMBDA", "0.5") or 0.5)
-    rag_embed_model = _get_env("RAG_EMBED_MODEL", "text-embedding-3-small") or "text-embedding-3-small"
-    # Qdrant
-    qdrant_url = _get_env("QDRANT_URL")
-    qdrant_api_key = _get_env("QDRANT_API_KEY")
-    qdrant_collection = _get_env("QDRANT_COLLECTION")
-    if not (qdrant_url and qdrant_api_key and qdrant_collection):
-        raise RuntimeError("Faltan QDRANT_URL/QDRANT_API_KEY/QDRANT_COLLECTION en el entorno")
+def _rag_search_kwargs(settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Parámetros de búsqueda del retriever según la configuración (por defecto, la vigente)."""
+    return rag_search_kwargs(settings or rag_runtime["settings"])
+
+def _rag_filter_config(metadata_filter: rest.Filter, settings: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Config de invocación que empuja un filtro de metadatos hasta la búsqueda en Qdrant."""
+    return {"configurable": {"rag_search_kwargs": {**_rag_search_kwargs(settings), "filter": metadata_filter}}}
 
-    embeddings = OpenAIEmbeddings(model=rag_embed_model)
-    vectorstore = Qdrant(
-        client=QdrantClient(url=qdrant_url, api_key=qdrant_api_key),
-        collection_name=qdrant_collection,
-        embeddings=embeddings,
+def _build_vectorstore(settings: Dict[str, Any], collection: Optional[str] = None) -> Qdrant:
+    # Qdrant (remoto, o local con QDRANT_PATH / RAG_BACKEND=offline)
+    if not qdrant_configured():
+        raise RuntimeError("Faltan QDRANT_URL/QDRANT_API_KEY/QDRANT_COLLECTION en el entorno")
+    return Qdrant(
+        client=get_qdrant_client(),
+        collection_name=collection or qdrant_collection(),
+        embeddings=get_embeddings(settings["RAG_EMBED_MODEL"]),
     )
 
-    search_kwargs: Dict[str, Any] = {"k": rag_top_k}
-    if rag_search_type == "mmr":
-        search_kwargs.update({"fetch_k": rag_fetch_k, "lambda_mult": rag_mmr_lambda})
-
-    retriever = vectorstore.as_retriever(search_type=rag_search_type, search_kwargs=search_kwargs)
-
-    # Prompt template
-    from langchain_core.prompts import ChatPromptTemplate
-    prompt = ChatPromptTemplate.from_messages([
-        ("system",
-         "You are an expert RAG (Retrieval-Augmented Generation) assistant. Your role is to answer questions based EXCLUSIVELY on the provided CONTEXT from the knowledge base. "
-         "You must follow these strict rules:\n\n"
-         "1. **ONLY use information from the CONTEXT** - Do not use external knowledge\n"
-         "2. **If insufficient information exists**, respond exactly: 'No tengo información suficiente para responder esta pregunta basándome en los documentos disponibles.'\n"
-         "3. **Always cite sources** - Include file_name and page number when available\n"
-         "4. **Be accurate and precise** - Don't make assumptions or inferences beyond the context\n"
-         "5. **Structure your response** - Use clear paragraphs and bullet points when appropriate\n"
-         "6. **Maintain objectivity** - Present information factually without bias\n\n"
-         "Your expertise is in analyzing and synthesizing information from the provided documents to give accurate, well-referenced answers."),
-        ("human",
-         "Question: {question}\n\n"
-         "CONTEXT (from knowledge base):\n{context}\n\n"
-         "Instructions: Answer the question using ONLY the information in the context above. "
-         "If the context doesn't contain enough information, say so clearly. "
-         "Always cite your sources with file names and page numbers when available.")
-    ])
-
-    llm_rag = ChatOpenAI(model="gpt-4o", temperature=0.2)
+_chat_models: Dict[Tuple[str, float], Any] = {}
+
+def _shared_chat_model(model: str, temperature: float) -> Any:
+    """Un chat model por modelo/temperatura para todas las colecciones (comparten conexiones HTTP)."""
+    key = (model, temperature)
+    if key not in _chat_models:
+        _chat_models[key] = get_chat_model(model, temperature=temperature)
+    return _chat_models[key]
+
+def _build_abstention_gate(
+    settings: Dict[str, Any], previous: Optional[AbstentionGate] = None
+) -> Optional[AbstentionGate]:
+    """Atajo de abstención por score (``RAG_ABSTAIN_THRESHOLD``; vacío = apagado)."""
+    threshold = settings["RAG_ABSTAIN_THRESHOLD"]
+    if threshold is None:
+        return None
+    # Mismo umbral tras una recarga: se conservan sus estadísticas
+    if previous is not None and previous.threshold == threshold:
+        return previous
+    return AbstentionGate(threshold)
+
+def build_rag_chain(
+    settings: Dict[str, Any], gate: Optional[AbstentionGate] = None, collection: Optional[str] = None
+) -> Any:  # returns Runnable
+    rag_search_type = settings["RAG_SEARCH_TYPE"]
+    vectorstore = _build_vectorstore(settings, collection)
+    llm_rag = _shared_chat_model("gpt-4o", 0.2)
+    if gate is not None:
+        # Búsqueda con scores para poder abstenerse sin llamar al LLM
+        return abstaining_chain(vectorstore, llm_rag, gate, rag_search_type, partial(rag_search_kwargs, settings))
+
+    # search_kwargs configurable por invocación para aplicar filtros de metadatos
+    retriever = vectorstore.as_retriever(
+        search_type=rag_search_type, search_kwargs=rag_search_kwargs(settings)
+    ).configurable_fields(
+        search_kwargs=ConfigurableField(
+            id="rag_search_kwargs",
+            name="Search kwargs",
+            description="Parámetros de búsqueda (k, fetch_k, filter...)",
+        )
+    )
 
     rag_chain = (
-        {"context": retriever | _format_docs, "question": RunnablePassthrough()}
-        | prompt
+        {"context": retriever | format_docs, "question": RunnablePassthrough()}
+        | RAG_PROMPT
         | llm_rag
         | StrOutputParser()
     )
     return rag_chain
 
-rag_chain = build_rag_chain()
+def build_rag_cascade(
+    settings: Dict[str, Any], gate: Optional[AbstentionGate] = None, collection: Optional[str] = None
+) -> Optional[RAGCascade]:
+    """Cascada de modelos (``RAG_CASCADE=1``): el más barato primero, escalando si hace falta."""
+    if (_get_env("RAG_CASCADE", "0") or "0").lower() not in {"1", "true", "yes", "on"}:
+        return None
+    models = [m.strip() for m in (_get_env("RAG_CASCADE_MODELS", "gpt-4o-mini,gpt-4o") or "").split(",") if m.strip()]
+    return RAGCascade(
+        _build_vectorstore(settings, collection),
+        [(model, _shared_chat_model(model, 0.2)) for model in models],
+        search_type=settings["RAG_SEARCH_TYPE"],
+        search_kwargs=partial(rag_search_kwargs, settings),
+        min_score=float(_get_env("RAG_CASCADE_MIN_SCORE", "0.4") or 0.4),
+        max_question_tokens=int(_get_env("RAG_CASCADE_MAX_QUESTION_TOKENS", "48") or 48),
+        min_answer_chars=int(_get_env("RAG_CASCADE_MIN_ANSWER_CHARS", "40") or 40),
+        require_citation=(_get_env("RAG_CASCADE_REQUIRE_CITATION", "1") or "1").lower() not in {"0", "false", "no", "off"},
+        gate=gate,
+    )
+
+def _check_collection_embeddings(settings: Dict[str, Any], collection: str) -> None:
+    """
+    La colección debe haberse indexado con ``RAG_EMBED_MODEL``. Si no tiene el
+    modelo registrado (indexada antes del registro) se compara al menos la
+    dimensión de los vectores. Lanza ``EmbeddingModelMismatch``.
+    """
+    client = get_qdrant_client()
+    model = settings["RAG_EMBED_MODEL"]
+    if not client.collection_exists(collection) or check_embedding_model(client, collection, model):
+        return
+    size = getattr(client.get_collection(collection).config.params.vectors, "size", None)
+    if size is None:
+        return
+    dim = len(get_embeddings(model).embed_query(_get_env("RAG_CONFIG_WARMUP_QUERY", "warmup") or "warmup"))
+    if dim != size:
+        raise EmbeddingModelMismatch(
+            f"RAG_EMBED_MODEL: '{model}' produce vectores de {dim} dimensiones y la colección '{collection}' es de {size}"
+        )
+
+def _build_collection_runtime(
+    settings: Dict[str, Any], gate: Optional[AbstentionGate], collection: str
+) -> Dict[str, Any]:
+    """Todo lo que una request RAG necesita de una colección, armado con una misma configuración."""
+    cascade = build_rag_cascade(settings, gate, collection)
+    return {
+        "collection": collection,
+        "settings": settings,
+        "gate": gate,
+        "cascade": cascade,
+        "chain": cascade.as_runnable() if cascade else build_rag_chain(settings, gate, collection),
+        "vectorstore": _build_vectorstore(settings, collection),
+    }
+
+def build_rag_runtime(settings: Dict[str, Any], previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Runtime de la colección por defecto; se reemplaza entero al recargar la configuración."""
+    gate = _build_abstention_gate(settings, previous["gate"] if previous else None)
+    return _build_collection_runtime(settings, gate, qdrant_collection())
+
+def _initial_settings() -> Dict[str, Any]:
+    """Entorno, con ``RAG_CONFIG_FILE`` encima si existe y es válido."""
+    settings = settings_from_env()
+    path = _get_env("RAG_CONFIG_FILE")
+    if path and Path(path).exists():
+        try:
+            return validate_settings(load_settings_file(Path(path)), settings)
+        except (OSError, ValueError) as e:
+            print(f"Config de {path} ignorada: {e}")
+    return settings
+
+# Las requests toman el runtime una vez al empezar: una recarga no las afecta
+rag_runtime = build_rag_runtime(_initial_settings())
+
+# Conversaciones con session_id: historial compacto, condensación y reuso de contexto
+conversations = ConversationMemory(
+    get_session_store(
+        _get_env("RAG_SESSION_DB") or None,
+        ttl_s=float(_get_env("RAG_SESSION_TTL_S", "3600") or 3600),
+        max_sessions=int(_get_env("RAG_SESSION_MAX", "10000") or 10000),
+    ),
+    get_chat_model(_get_env("RAG_SESSION_MODEL", "gpt-4o-mini") or "gpt-4o-mini", temperature=0),
+    window_tokens=int(_get_env("RAG_SESSION_WINDOW_TOKENS", "1200") or 1200),
+    summary_tokens=int(_get_env("RAG_SESSION_SUMMARY_TOKENS", "250") or 250),
+    reuse_similarity=float(_get_env("RAG_SESSION_REUSE_SIMILARITY", "0.9") or 0.9),
+    embeddings=get_embeddings(rag_runtime["settings"]["RAG_EMBED_MODEL"]),
+)
+# Para los turnos con sesión la búsqueda se hace aparte (para poder reusar chunks)
+rag_answer_chain = RAG_PROMPT | _shared_chat_model("gpt-4o", 0.2) | StrOutputParser()
+
+# =============================
+# Colecciones por cliente
+# =============================
+
+_COLLECTION_PATTERN = _get_env("RAG_TENANT_PATTERN", DEFAULT_COLLECTION_PATTERN) or DEFAULT_COLLECTION_PATTERN
+
+def _build_tenant_runtime(settings: Dict[str, Any], gate: Optional[AbstentionGate], collection: str) -> Dict[str, Any]:
+    """Runtime de una colección no por defecto; comparte cliente Qdrant, embeddings y chat models."""
+    if not get_qdrant_client().collection_exists(collection):
+        raise UnknownCollection(collection)
+    _check_collection_embeddings(settings, collection)
+    return _build_collection_runtime(settings, gate, collection)
+
+tenant_pool = TenantPool(
+    partial(_build_tenant_runtime, rag_runtime["settings"], rag_runtime["gate"]),
+    max_entries=int(_get_env("RAG_TENANT_POOL_SIZE", "64") or 64),
+    idle_s=float(_get_env("RAG_TENANT_IDLE_S", "1800") or 1800),
+    max_tracked=int(_get_env("RAG_TENANT_MAX_TRACKED", "1000") or 1000),
+)
+
+def _resolve_collection(request: Request, collection: Optional[str], create: bool = False) -> str:
+    """
+    Colección pedida (validada) o la de ``QDRANT_COLLECTION``. Las demás exigen
+    una API key con acceso a ella (``RAG_API_KEYS``) o ``X-Admin-Token``, y
+    crearlas (``create`` con la colección inexistente) solo el admin. Bloquea
+    con ``create`` (consulta Qdrant): llamarla en el threadpool.
+    """
+    default = qdrant_collection()
+    if not collection:
+        return default
+    try:
+        collection = validate_collection(collection, _COLLECTION_PATTERN)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if collection == default:
+        return collection
+    admin_token = request.headers.get("x-admin-token")
+    if admin_token:
+        _require_admin(admin_token)
+        return collection
+    key = request_api_key(request.headers)
+    if not key:
+        raise HTTPException(status_code=401, detail=f"La colección '{collection}' requiere X-API-Key")
+    if not collection_grants.allows(key, collection):
+        raise HTTPException(status_code=403, detail=f"La API key no tiene acceso a la colección '{collection}'")
+    if create and not get_qdrant_client().collection_exists(collection):
+        raise HTTPException(status_code=403, detail=f"Crear la colección '{collection}' requiere X-Admin-Token")
+    return collection
+
+def _tenant_runtime(collection: Optional[str]) -> Dict[str, Any]:
+    runtime = rag_runtime
+    if not collection or collection == runtime["collection"]:
+        return runtime
+    return tenant_pool.get(collection)
+
+# =============================
+# Recarga de configuración en caliente
+# =============================
+
+_reload_lock = threading.Lock()
+_config_state: Dict[str, Any] = {"version": 1, "source": "startup", "loaded_at": time.time()}
+_config_history: deque = deque(maxlen=20)
+
+def _warm_up(runtime: Dict[str, Any]) -> float:
+    """Una búsqueda real con el runtime nuevo (embeddings + Qdrant), sin LLM."""
+    t0 = time.perf_counter()
+    settings = runtime["settings"]
+    retrieve_with_scores(
+        runtime["vectorstore"],
+        _get_env("RAG_CONFIG_WARMUP_QUERY", "warmup") or "warmup",
+        settings["RAG_SEARCH_TYPE"],
+        rag_search_kwargs(settings),
+    )
+    return time.perf_counter() - t0
+
+def reload_rag_runtime(
+    overrides: Optional[Dict[str, Any]] = None,
+    base: Optional[Dict[str, Any]] = None,
+    source: str = "admin",
+    dry_run: bool = False,
+) -> Dict[str, Any]:
+    """
+    Valida ``overrides`` sobre ``base`` (por defecto la config vigente), arma
+    y calienta el runtime nuevo fuera de las requests y lo intercambia con una
+    sola asignación. Lanza ``ValueError`` si la config no es válida; en ese
+    caso (o si falla el armado) sigue sirviendo la anterior.
+    """
+    global rag_runtime
+    with _reload_lock:
+        current = rag_runtime
+        record: Dict[str, Any] = {"source": source, "at": time.time(), "dry_run": dry_run}
+        t0 = time.perf_counter()
+        try:
+            settings = validate_settings(overrides or {}, base if base is not None else current["settings"])
+            _check_collection_embeddings(settings, qdrant_collection())
+            runtime = build_rag_runtime(settings, previous=current)
+            record["build_s"] = round(time.perf_counter() - t0, 3)
+            record["warmup_s"] = round(_warm_up(runtime), 3)
+        except Exception as e:
+            record.update(ok=False, error=str(e))
+            _config_history.appendleft(record)
+            raise
+        record["ok"] = True
+        record["changes"] = {
+            key: {"before": current["settings"][key], "after": value}
+            for key, value in settings.items()
+            if current["settings"][key] != value
+        }
+        if not dry_run:
+            rag_runtime = runtime
+            tenant_pool.reset(partial(_build_tenant_runtime, settings, runtime["gate"]))
+            conversations.embeddings = get_embeddings(settings["RAG_EMBED_MODEL"])
+            _config_state.update(version=_config_state["version"] + 1, source=source, loaded_at=time.time())
+            record["version"] = _config_state["version"]
+            print(f"Config RAG v{record['version']} ({source}): {record['changes'] or 'sin cambios'}")
+        _config_history.appendleft(record)
+        return record
+
+def _reload_from_file() -> Dict[str, Any]:
+    """Entorno + ``RAG_CONFIG_FILE``: quitar una clave del archivo vuelve al valor del entorno."""
+    path = _get_env("RAG_CONFIG_FILE")
+    try:
+        overrides = load_settings_file(Path(path)) if path and Path(path).exists() else {}
+    except (OSError, ValueError) as e:
+        _config_history.appendleft({"source": "file", "at": time.time(), "ok": False, "error": f"{path}: {e}"})
+        raise
+    return reload_rag_runtime(overrides, base=settings_from_env(), source="file")
 
 # =============================
 # Lógica "humana": stats Qdrant
 # =============================
 
-def _compute_corpus_stats() -> Dict[str, Any]:
-    qdrant_url = _get_env("QDRANT_URL")
-    qdrant_api_key = _get_env("QDRANT_API_KEY")
-    qdrant_collection = _get_env("QDRANT_COLLECTION")
-    if not (qdrant_url and qdrant_api_key and qdrant_collection):
+def _compute_corpus_stats(collection: Optional[str] = None) -> Dict[str, Any]:
+    if not qdrant_configured():
         return {"error": "Faltan QDRANT_URL/QDRANT_API_KEY/QDRANT_COLLECTION"}
-    client = QdrantClient(url=qdrant_url, api_key=qdrant_api_key)
+    client = get_qdrant_client()
+    collection = collection or qdrant_collection()
+    if not client.collection_exists(collection):
+        return {"total_files": 0, "total_chunks": 0, "by_type": {}, "samples": []}
 
     unique_files: Set[str] = set()
     counts_by_type: Dict[str, int] = {}
     total_points = 0
     offset = None
     while True:
-        points, offset = client.scroll(qdrant_collection, with_payload=True, limit=1000, offset=offset)
+        points, offset = client.scroll(collection, with_payload=True, limit=1000, offset=offset)
         if not points:
             break
         for p in points:
@@ -968,7 +1411,7 @@ def _compute_corpus_stats() -> Dict[str, Any]:
     }
 
 
-def _maybe_answer_stats(question: str) -> Optional[str]:
+def _maybe_answer_stats(question: str, collection: Optional[str] = None) -> Optional[str]:
     q = question.lower().strip()
     keywords = [
         "cuantos archivos", "cuántos archivos", "cuantos documentos", "cuántos documentos",
@@ -976,7 +1419,7 @@ def _maybe_answer_stats(question: str) -> Optional[str]:
         "how many files", "how many documents", "list sources", "how many chunks",
     ]
     if any(k in q for k in keywords):
-        stats = _compute_corpus_stats()
+        stats = _compute_corpus_stats(collection)
         if "error" in stats:
             return "No puedo acceder a las estadísticas (faltan credenciales de Qdrant)."
         parts = [
@@ -994,89 +1437,280 @@ from langchain_core.runnables import RunnableLambda
 
 def _router(input_data: Dict[str, Any]) -> str:
     question = input_data.get("question") if isinstance(input_data, dict) else str(input_data)
-    direct = _maybe_answer_stats(question or "")
+    collection = input_data.get("collection") if isinstance(input_data, dict) else None
+    # Primero el runtime: una colección inexistente es UnknownCollection, no "0 archivos"
+    runtime = _tenant_runtime(collection)
+    direct = _maybe_answer_stats(question or "", runtime["collection"])
     if direct is not None:
         return direct
-    # Delegar al RAG
-    return rag_chain.invoke(question)
+    # Delegar al RAG de la colección (con filtro de metadatos si viene en la entrada)
+    metadata_filter = input_data.get("filter") if isinstance(input_data, dict) else None
+    if metadata_filter is not None:
+        return runtime["chain"].invoke(question, config=_rag_filter_config(metadata_filter, runtime["settings"]))
+    return runtime["chain"].invoke(question)
 
 class RAGInput(BaseModel):
     question: str
+    # Con session_id la pregunta se interpreta como seguimiento de la conversación ("" = sesión nueva)
+    session_id: Optional[str] = None
+    # Colección (cliente) a consultar; por defecto QDRANT_COLLECTION
+    collection: Optional[str] = None
+    # Filtros opcionales de metadatos (se aplican dentro de la búsqueda en Qdrant)
+    file_names: Optional[List[str]] = None
+    doc_types: Optional[List[str]] = None
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+
+    def metadata_filter(self) -> Optional[rest.Filter]:
+        return build_metadata_filter(
+            file_names=self.file_names,
+            doc_types=self.doc_types,
+            page_from=self.page_from,
+            page_to=self.page_to,
+        )
 
 rag_router = RunnableLambda(_router)
 
+def _answer_from_context(question: str, scored: List[Tuple[Document, float]], runtime: Dict[str, Any]) -> str:
+    """Respuesta RAG con contexto ya recuperado (cascada y atajo de abstención incluidos)."""
+    cascade, gate = runtime["cascade"], runtime["gate"]
+    if cascade is not None:
+        return cascade.answer(question, scored=scored)
+    t0 = time.perf_counter()
+    if gate is not None and gate.should_abstain(scored):
+        gate.record_fast_path(time.perf_counter() - t0)
+        return ABSTENTION_TEXT
+    text = rag_answer_chain.invoke({"question": question, "context": format_docs([d for d, _ in scored])})
+    if gate is not None:
+        gate.record_llm(time.perf_counter() - t0)
+    return text
+
+def _rag_session_turn(question: RAGInput) -> Dict[str, Any]:
+    """
+    Turno de conversación RAG: condensa la pregunta con el historial, reusa
+    los chunks del turno anterior si la búsqueda es la misma y guarda el turno.
+    """
+    with conversations.turn(question.session_id) as session:
+        runtime = _tenant_runtime(question.collection)
+        # Una sesión no cambia de colección: su historial y sus chunks son de la primera
+        if session.get("collection") not in (None, runtime["collection"]):
+            raise UnknownSession(session["id"])
+        session["collection"] = runtime["collection"]
+        reused = False
+        standalone = question.question
+        response = _maybe_answer_stats(question.question, runtime["collection"])
+        if response is None:
+            standalone = conversations.condense(session, question.question)
+            metadata_filter = question.metadata_filter()
+            # Solo se reusan chunks de la misma colección y con el mismo filtro
+            filter_key = json.dumps([
+                runtime["collection"],
+                metadata_filter.model_dump_json(exclude_none=True) if metadata_filter is not None else None,
+            ])
+            scored = conversations.reusable_context(session, standalone, filter_key)
+            reused = scored is not None
+            if scored is None:
+                search_kwargs = _rag_search_kwargs(runtime["settings"])
+                if metadata_filter is not None:
+                    search_kwargs["filter"] = metadata_filter
+                search_type = runtime["settings"]["RAG_SEARCH_TYPE"]
+                scored = retrieve_with_scores(runtime["vectorstore"], standalone, search_type, search_kwargs)
+            conversations.remember_context(session, standalone, scored, filter_key)
+            response = _answer_from_context(standalone, scored, runtime)
+        conversations.add_turn(session, question.question, response)
+    return {
+        "response": response,
+        "session_id": session["id"],
+        "standalone_question": standalone,
+        "context_reused": reused,
+    }
+
+def _chat_session_turn(session_id: Optional[str], message: str) -> Tuple[str, str]:
+    """Turno de chat libre con sesión: resumen acumulado + ventana de turnos recientes."""
+    with conversations.turn(session_id) as session:
+        # El chat libre no lleva credenciales de colección: solo sesiones de la colección por defecto
+        if session.get("collection") not in (None, qdrant_collection()):
+            raise UnknownSession(session["id"])
+        response = llm.invoke(conversations.messages(session) + [HumanMessage(content=message)])
+        conversations.add_turn(session, message, response.content)
+    return response.content, session["id"]
+
 # =============================
 # EVALUACIÓN Y TESTING DE RAG
 # =============================
 
+# Tope de preguntas en vuelo para /eval/run (cada una es una llamada al LLM)
+_EVAL_MAX_CONCURRENCY = int(os.getenv("RAG_EVAL_MAX_CONCURRENCY", "16"))
+
 def _load_eval_data():
-    """Carga los datos de evaluación desde los archivos JSONL."""
-    eval_data = {
-        "answerable": [],
-        "unanswerable": [],
-        "reports": {}
+    """Carga los sets y reportes de evaluación; solo se releen si cambiaron en disco."""
+    eval_dir = Path("eval")
+    return {
+        "answerable": load_jsonl_cached(eval_dir / "answerable.jsonl"),
+        "unanswerable": load_jsonl_cached(eval_dir / "unanswerable.jsonl"),
+        "reports": {
+            name: report
+            for name in ("answerable", "unanswerable")
+            if (report := load_json_cached(eval_dir / f"report_{name}.json")) is not None
+        },
     }
-    
-    try:
-        # Usar ruta relativa simple
-        eval_dir = Path("eval")
-        print(f"Intentando cargar desde: {eval_dir.absolute()}")
-        
-        # Cargar preguntas answerable
-        answerable_path = eval_dir / "answerable.jsonl"
-        if answerable_path.exists():
-            with open(answerable_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        eval_data["answerable"].append(json.loads(line))
-            print(f"Cargadas {len(eval_data['answerable'])} preguntas answerable")
-        else:
-            print(f"Archivo no encontrado: {answerable_path.absolute()}")
-        
-        # Cargar preguntas unanswerable
-        unanswerable_path = eval_dir / "unanswerable.jsonl"
-        if unanswerable_path.exists():
-            with open(unanswerable_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    if line.strip():
-                        eval_data["unanswerable"].append(json.loads(line))
-            print(f"Cargadas {len(eval_data['unanswerable'])} preguntas unanswerable")
-        else:
-            print(f"Archivo no encontrado: {unanswerable_path.absolute()}")
-        
-        # Cargar reportes
-        report_answerable_path = eval_dir / "report_answerable.json"
-        if report_answerable_path.exists():
-            with open(report_answerable_path, 'r', encoding='utf-8') as f:
-                eval_data["reports"]["answerable"] = json.load(f)
-            print(f"Reporte answerable cargado")
-        else:
-            print(f"Archivo no encontrado: {report_answerable_path.absolute()}")
-        
-        report_unanswerable_path = eval_dir / "report_unanswerable.json"
-        if report_unanswerable_path.exists():
-            with open(report_unanswerable_path, 'r', encoding='utf-8') as f:
-                eval_data["reports"]["unanswerable"] = json.load(f)
-            print(f"Reporte unanswerable cargado")
-        else:
-            print(f"Archivo no encontrado: {report_unanswerable_path.absolute()}")
-                
-        print(f"Datos de evaluación cargados: {len(eval_data['answerable'])} answerable, {len(eval_data['unanswerable'])} unanswerable")
-                
-    except Exception as e:
-        print(f"Error cargando datos de evaluación: {e}")
-        import traceback
-        traceback.print_exc()
-    
-    return eval_data
 
 @app.get("/eval/data")
 async def get_eval_data():
     """Retorna todos los datos de evaluación."""
-    print("Endpoint /eval/data llamado")
+    return _load_eval_data()
+
+@app.get("/eval/runs")
+async def list_eval_runs(kind: Optional[str] = None, limit: int = 50):
+    """Historial de corridas de evaluación (más recientes primero)."""
+    runs = await run_in_threadpool(get_eval_store().list_runs, kind, max(1, min(limit, 500)))
+    return {"runs": runs}
+
+@app.get("/eval/runs/compare")
+async def compare_eval_runs(
+    base: str,
+    head: str,
+    tolerance: float = 0.2,
+    min_delta_s: float = 0.05,
+    quality_drop: float = 0.05,
+):
+    """Regresiones de latencia y calidad de la corrida ``head`` frente a ``base``."""
+    result = await run_in_threadpool(
+        get_eval_store().compare, base, head,
+        tolerance=tolerance, min_delta_s=min_delta_s, quality_drop=quality_drop,
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Corrida no encontrada")
+    return result
+
+@app.get("/eval/runs/{run_id}")
+async def get_eval_run(run_id: str, results: bool = True):
+    """Una corrida con su configuración, resumen y (opcionalmente) resultados por pregunta."""
+    store = get_eval_store()
+    run = await run_in_threadpool(store.get_run, run_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Corrida no encontrada")
+    if results:
+        run["results"] = await run_in_threadpool(store.results, run_id)
+    return run
+
+def _score_eval_results(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Similitud semántica, token-F1 y citas; si no hay embeddings, solo las léxicas."""
+    try:
+        embeddings = get_embeddings()
+    except Exception as e:
+        print(f"Scoring sin embeddings: {e}")
+        embeddings = None
+    return score_results(results, embeddings)
+
+def _eval_items(sets: str) -> List[Dict[str, Any]]:
     data = _load_eval_data()
-    print(f"Retornando datos: {len(data['answerable'])} answerable, {len(data['unanswerable'])} unanswerable")
-    return data
+    wanted = {x.strip() for x in sets.split(",") if x.strip()}
+    return [
+        {"set": name, **row}
+        for name in ("answerable", "unanswerable")
+        if name in wanted
+        for row in data[name]
+    ]
+
+async def _eval_suite_events(
+    items: List[Dict[str, Any]],
+    concurrency: int,
+    record: bool,
+    label: Optional[str],
+):
+    """
+    Ejecuta la suite con ``concurrency`` preguntas en vuelo y emite una línea
+    JSON por evento: ``start``, un ``result`` por pregunta (en orden de
+    término, con agregados parciales) y ``done`` con el resumen final.
+    """
+    phrase = abstention_phrase()
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(index: int, item: Dict[str, Any]) -> Dict[str, Any]:
+        result = {"index": index, "set": item["set"], "question": item["question"], "expected": item.get("expected", "")}
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                with usage_scope("eval_run", question=item["question"], collection=qdrant_collection()):
+                    response = await run_in_threadpool(rag_router.invoke, {"question": item["question"]})
+            except Exception as e:
+                return {**result, "ok": False, "status": 500, "error": f"{type(e).__name__}: {e}"[:200]}
+            latency = time.perf_counter() - t0
+        return {
+            **result,
+            "ok": True,
+            "status": 200,
+            "latency_s": round(latency, 3),
+            "response": response,
+            "response_chars": len(response or ""),
+            "passed": answer_passed(item["set"], response, phrase),
+        }
+
+    yield {"event": "start", "total": len(items), "concurrency": concurrency}
+    t0 = time.perf_counter()
+    tasks = [asyncio.create_task(one(i, item)) for i, item in enumerate(items)]
+    results: List[Dict[str, Any]] = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            results.append(result)
+            yield {
+                "event": "result",
+                "result": result,
+                "progress": {"done": len(results), "total": len(items), **answers_summary(results)},
+            }
+    finally:
+        # Cliente desconectado: no seguir gastando llamadas al LLM
+        for task in tasks:
+            task.cancel()
+
+    results.sort(key=lambda r: r["index"])
+    wall = time.perf_counter() - t0
+    scores = await run_in_threadpool(_score_eval_results, results)
+    summary = {**answers_summary(results, wall), **scores, "concurrency": concurrency, "endpoint": "/eval/run"}
+    done = {"event": "done", "summary": summary}
+    if record and results:
+        per_question = [{k: v for k, v in r.items() if k != "index"} for r in results]
+        run = await run_in_threadpool(
+            get_eval_store().record_run,
+            "answers",
+            {"endpoint": "/eval/run", "concurrency": concurrency, "sets": sorted({r["set"] for r in results})},
+            summary,
+            per_question,
+            label,
+        )
+        done.update(run_id=run["id"], compared_to=run["summary"].get("compared_to"),
+                    regressions=run["summary"].get("regressions", []))
+    yield done
+
+@app.post("/eval/run")
+async def run_eval_suite(
+    concurrency: int = int(os.getenv("RAG_EVAL_CONCURRENCY", "4")),
+    sets: str = "answerable,unanswerable",
+    limit: Optional[int] = None,
+    record: bool = True,
+    label: Optional[str] = None,
+    x_admin_token: Optional[str] = Header(None),
+):
+    """
+    Evalúa la suite completa en el servidor y transmite el progreso como JSON
+    por línea (``application/x-ndjson``); la corrida queda en el historial.
+    Gasta una llamada al LLM por pregunta: requiere ``X-Admin-Token``.
+    """
+    _require_admin(x_admin_token)
+    items = _eval_items(sets)
+    if limit is not None:
+        items = items[:max(0, limit)]
+    if not items:
+        raise HTTPException(status_code=400, detail="No hay preguntas para los sets indicados")
+    concurrency = max(1, min(concurrency, _EVAL_MAX_CONCURRENCY))
+
+    async def lines():
+        async for event in _eval_suite_events(items, concurrency, record, label):
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
 
 @app.post("/eval/test")
 async def test_eval_question(request: dict):
@@ -1089,11 +1723,14 @@ async def test_eval_question(request: dict):
             raise HTTPException(status_code=400, detail="Pregunta requerida")
         
         # Obtener respuesta del RAG
-        rag_response = rag_router.invoke({"question": question})
+        with usage_scope("eval_test", question=question, collection=qdrant_collection()):
+            rag_response = await run_in_threadpool(rag_router.invoke, {"question": question})
         
         # Calcular métricas básicas
         response_length = len(rag_response)
         expected_length = len(expected) if expected else 0
+        scored = {"set": request.get("set", "answerable"), "ok": True, "expected": expected, "response": rag_response}
+        await run_in_threadpool(_score_eval_results, [scored])
         
         return {
             "question": question,
@@ -1102,7 +1739,10 @@ async def test_eval_question(request: dict):
             "metrics": {
                 "response_length": response_length,
                 "expected_length": expected_length,
-                "length_ratio": round(response_length / expected_length, 2) if expected_length > 0 else 0
+                "length_ratio": round(response_length / expected_length, 2) if expected_length > 0 else 0,
+                "similarity": scored.get("similarity"),
+                "token_f1": scored.get("token_f1"),
+                "cites_source": scored.get("cites_source"),
             }
         }
         
@@ -1395,6 +2035,56 @@ async def eval_playground():
                 to { transform: rotate(360deg); }
             }
             
+            .suite-controls {
+                display: flex;
+                gap: 15px;
+                align-items: center;
+                flex-wrap: wrap;
+                margin-bottom: 20px;
+            }
+            
+            .suite-controls input {
+                width: 80px;
+                padding: 10px;
+                border: 2px solid #e9ecef;
+                border-radius: 10px;
+            }
+            
+            .suite-controls input[type="password"] {
+                width: 160px;
+            }
+            
+            .progress-bar {
+                height: 12px;
+                background: #e9ecef;
+                border-radius: 6px;
+                overflow: hidden;
+                margin-bottom: 20px;
+            }
+            
+            .progress-fill {
+                height: 100%;
+                width: 0%;
+                background: linear-gradient(135deg, #667eea 0%, #2a5298 100%);
+                transition: width 0.2s ease;
+            }
+            
+            .suite-table {
+                width: 100%;
+                border-collapse: collapse;
+                margin-top: 20px;
+                font-size: 0.9rem;
+            }
+            
+            .suite-table th, .suite-table td {
+                padding: 8px 10px;
+                border-bottom: 1px solid #dee2e6;
+                text-align: left;
+            }
+            
+            .suite-pass { color: #28a745; font-weight: 700; }
+            .suite-fail { color: #dc3545; font-weight: 700; }
+            
             @media (max-width: 768px) {
                 .header h1 { font-size: 2rem; }
                 .stats-grid { grid-template-columns: 1fr; }
@@ -1481,10 +2171,72 @@ async def eval_playground():
                                 <div class="metric-value" id="lengthRatio">0</div>
                                 <div class="metric-label">Ratio Longitud</div>
                             </div>
+                            <div class="metric-item">
+                                <div class="metric-value" id="similarity">-</div>
+                                <div class="metric-label">Similitud Semántica</div>
+                            </div>
+                            <div class="metric-item">
+                                <div class="metric-value" id="tokenF1">-</div>
+                                <div class="metric-label">Token F1</div>
+                            </div>
                         </div>
                     </div>
                 </div>
             </div>
+            
+            <!-- Suite completa -->
+            <div class="testing-section">
+                <div class="section-header">
+                    <h2>📋 Suite Completa</h2>
+                    <p>Ejecuta todas las preguntas en el servidor y sigue el progreso en vivo</p>
+                </div>
+                
+                <div class="content-section">
+                    <div class="suite-controls">
+                        <label for="suiteConcurrency">Concurrencia</label>
+                        <input type="number" id="suiteConcurrency" min="1" max="16" value="4">
+                        <label for="suiteAdminToken">Token admin</label>
+                        <input type="password" id="suiteAdminToken" autocomplete="off">
+                        <button onclick="runSuite()" class="test-button" id="suiteButton">
+                            ▶️ Ejecutar Suite
+                        </button>
+                    </div>
+                    
+                    <div class="progress-bar"><div class="progress-fill" id="suiteProgress"></div></div>
+                    
+                    <div class="metrics-grid">
+                        <div class="metric-item">
+                            <div class="metric-value" id="suiteDone">0 / 0</div>
+                            <div class="metric-label">Completadas</div>
+                        </div>
+                        <div class="metric-item">
+                            <div class="metric-value" id="suiteAnswerRate">-</div>
+                            <div class="metric-label">Tasa de Respuesta</div>
+                        </div>
+                        <div class="metric-item">
+                            <div class="metric-value" id="suiteAbstentionRate">-</div>
+                            <div class="metric-label">Tasa de Abstención</div>
+                        </div>
+                        <div class="metric-item">
+                            <div class="metric-value" id="suiteP50">-</div>
+                            <div class="metric-label">Latencia p50</div>
+                        </div>
+                        <div class="metric-item">
+                            <div class="metric-value" id="suiteErrors">0</div>
+                            <div class="metric-label">Errores</div>
+                        </div>
+                    </div>
+                    
+                    <p id="suiteStatus"></p>
+                    
+                    <table class="suite-table">
+                        <thead>
+                            <tr><th>#</th><th>Set</th><th>Pregunta</th><th>Resultado</th><th>Latencia</th></tr>
+                        </thead>
+                        <tbody id="suiteRows"></tbody>
+                    </table>
+                </div>
+            </div>
         </div>
         
         <div class="back-link">
@@ -1631,7 +2383,8 @@ async def eval_playground():
                         headers: { 'Content-Type': 'application/json' },
                         body: JSON.stringify({
                             question: currentQuestion.question,
-                            expected: currentQuestion.expected
+                            expected: currentQuestion.expected,
+                            set: currentQuestion.type
                         })
                     });
                     
@@ -1644,6 +2397,8 @@ async def eval_playground():
                         document.getElementById('responseLength').textContent = data.metrics.response_length;
                         document.getElementById('expectedLength').textContent = data.metrics.expected_length;
                         document.getElementById('lengthRatio').textContent = data.metrics.length_ratio;
+                        document.getElementById('similarity').textContent = data.metrics.similarity ?? '-';
+                        document.getElementById('tokenF1').textContent = data.metrics.token_f1 ?? '-';
                         
                         // Scroll suave a resultados
                         resultsSection.scrollIntoView({ behavior: 'smooth' });
@@ -1663,6 +2418,101 @@ async def eval_playground():
                 }
             }
             
+            // Ejecutar la suite completa (respuesta NDJSON: un evento por línea)
+            function percent(value) {
+                return value === null || value === undefined ? '-' : (value * 100).toFixed(1) + '%';
+            }
+            
+            function renderSuiteEvent(event) {
+                if (event.event === 'start') {
+                    document.getElementById('suiteDone').textContent = '0 / ' + event.total;
+                    return;
+                }
+                if (event.event === 'result') {
+                    const p = event.progress;
+                    const r = event.result;
+                    document.getElementById('suiteProgress').style.width = (100 * p.done / p.total) + '%';
+                    document.getElementById('suiteDone').textContent = p.done + ' / ' + p.total;
+                    document.getElementById('suiteAnswerRate').textContent = p.answerable_count ? percent(p.answerable_rate) : '-';
+                    document.getElementById('suiteAbstentionRate').textContent = p.unanswerable_count ? percent(p.unanswerable_abstention_rate) : '-';
+                    document.getElementById('suiteP50').textContent = p.latency_s.p50 === null ? '-' : p.latency_s.p50.toFixed(2) + 's';
+                    document.getElementById('suiteErrors').textContent = p.errors;
+                    
+                    const row = document.createElement('tr');
+                    const verdict = r.ok ? (r.passed ? '<span class="suite-pass">✔</span>' : '<span class="suite-fail">✘</span>')
+                                         : '<span class="suite-fail">error</span>';
+                    row.innerHTML = '<td>' + (r.index + 1) + '</td><td>' + r.set + '</td><td></td><td>' + verdict +
+                                    '</td><td>' + (r.ok ? r.latency_s.toFixed(2) + 's' : '-') + '</td>';
+                    row.children[2].textContent = r.question;
+                    row.title = r.ok ? r.response : r.error;
+                    document.getElementById('suiteRows').appendChild(row);
+                    return;
+                }
+                if (event.event === 'done') {
+                    const s = event.summary;
+                    let text = '✅ Suite terminada en ' + s.wall_s + 's (' + s.throughput_qps + ' preguntas/s)';
+                    if (s.token_f1 !== null) {
+                        text += ' · F1 ' + s.token_f1;
+                    }
+                    if (s.semantic_similarity !== null) {
+                        text += ' · similitud ' + s.semantic_similarity;
+                    }
+                    if (s.citation_hit_rate !== null) {
+                        text += ' · citas ' + percent(s.citation_hit_rate);
+                    }
+                    if (event.run_id) {
+                        text += ' · corrida ' + event.run_id;
+                    }
+                    if (event.compared_to) {
+                        const n = (event.regressions || []).length;
+                        text += n ? ' · ⚠️ ' + n + ' regresiones frente a ' + event.compared_to
+                                  : ' · sin regresiones frente a ' + event.compared_to;
+                    }
+                    document.getElementById('suiteStatus').textContent = text;
+                }
+            }
+            
+            async function runSuite() {
+                const button = document.getElementById('suiteButton');
+                const concurrency = document.getElementById('suiteConcurrency').value || 4;
+                button.disabled = true;
+                button.textContent = '⏳ Ejecutando...';
+                document.getElementById('suiteRows').innerHTML = '';
+                document.getElementById('suiteProgress').style.width = '0%';
+                document.getElementById('suiteStatus').textContent = '';
+                
+                try {
+                    const response = await fetch('/eval/run?concurrency=' + encodeURIComponent(concurrency), {
+                        method: 'POST',
+                        headers: { 'X-Admin-Token': document.getElementById('suiteAdminToken').value }
+                    });
+                    if (!response.ok) {
+                        const data = await response.json();
+                        document.getElementById('suiteStatus').textContent = '❌ Error: ' + data.detail;
+                        return;
+                    }
+                    const reader = response.body.getReader();
+                    const decoder = new TextDecoder();
+                    let buffer = '';
+                    while (true) {
+                        const { value, done } = await reader.read();
+                        if (done) break;
+                        buffer += decoder.decode(value, { stream: true });
+                        const lines = buffer.split('\\n');
+                        buffer = lines.pop();
+                        lines.filter(line => line.trim()).forEach(line => renderSuiteEvent(JSON.parse(line)));
+                    }
+                    if (buffer.trim()) {
+                        renderSuiteEvent(JSON.parse(buffer));
+                    }
+                } catch (error) {
+                    document.getElementById('suiteStatus').textContent = '❌ Error de conexión: ' + error;
+                } finally {
+                    button.disabled = false;
+                    button.textContent = '▶️ Ejecutar Suite';
+                }
+            }
+            
             // Cargar datos al iniciar
             loadEvalData();
         </script>
@@ -1672,13 +2522,113 @@ async def eval_playground():
 
 # Simple RAG endpoints
 @app.post("/rag/query")
-async def rag_query(question: RAGInput):
+async def rag_query(question: RAGInput, request: Request):
     """Query the RAG system with a question."""
+    collection = _resolve_collection(request, question.collection)
+    question.collection = collection
+    t0 = time.perf_counter()
+    ok = False
     try:
-        response = rag_router.invoke(question.question)
-        return {"response": response}
+        # La cadena es síncrona: en el threadpool no bloquea el event loop
+        with usage_scope("rag_query", question=question.question, collection=collection):
+            if question.session_id is not None:
+                result = await run_in_threadpool(_rag_session_turn, question)
+            else:
+                result = {"response": await run_in_threadpool(rag_router.invoke, {
+                    "question": question.question,
+                    "filter": question.metadata_filter(),
+                    "collection": collection,
+                })}
+        ok = True
+        return result
+    except UnknownCollection:
+        raise HTTPException(status_code=404, detail=f"La colección '{collection}' no existe")
+    except UnknownSession:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
+    except EmbeddingModelMismatch as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        tenant_pool.record(collection, time.perf_counter() - t0, ok)
+
+@app.get("/rag/tenants")
+async def rag_tenants():
+    """Colecciones en el pool y métricas por colección (requests, latencia, tokens y costo)."""
+    usage = usage_tracker.snapshot()["by"].get("collection", {})
+    return tenant_pool.stats(usage)
+
+def _require_admin(token: Optional[str]) -> None:
+    """Los endpoints de administración exigen ``X-Admin-Token`` igual a ``RAG_ADMIN_TOKEN``."""
+    expected = _get_env("RAG_ADMIN_TOKEN") or ""
+    if not expected:
+        raise HTTPException(status_code=403, detail="Administración deshabilitada: falta RAG_ADMIN_TOKEN")
+    if not token or not hmac.compare_digest(token.encode("utf-8"), expected.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="X-Admin-Token inválido")
+
+@app.get("/admin/rag/config")
+async def get_rag_config(x_admin_token: Optional[str] = Header(None)):
+    """Configuración RAG vigente, su versión y el historial de recargas (incluidas las rechazadas)."""
+    _require_admin(x_admin_token)
+    return {
+        **_config_state,
+        "settings": rag_runtime["settings"],
+        "config_file": _get_env("RAG_CONFIG_FILE"),
+        "history": list(_config_history),
+    }
+
+@app.post("/admin/rag/config")
+async def update_rag_config(
+    overrides: Dict[str, Any], dry_run: bool = False, x_admin_token: Optional[str] = Header(None)
+):
+    """
+    Cambia claves recargables (p.ej. ``{"RAG_TOP_K": 6}``) sobre la config vigente.
+    La cadena nueva se arma y calienta en un thread; con ``dry_run`` solo se valida y calienta.
+    """
+    _require_admin(x_admin_token)
+    try:
+        return await run_in_threadpool(reload_rag_runtime, overrides, None, "admin", dry_run)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"No se pudo armar la cadena nueva: {e}")
+
+@app.post("/admin/rag/reload")
+async def reload_rag_config(x_admin_token: Optional[str] = Header(None)):
+    """Vuelve a leer el entorno y ``RAG_CONFIG_FILE`` (lo mismo que hace el watcher al ver un cambio)."""
+    _require_admin(x_admin_token)
+    try:
+        return await run_in_threadpool(_reload_from_file)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"No se pudo armar la cadena nueva: {e}")
+
+@app.get("/chat/sessions")
+async def chat_sessions_stats():
+    """Sesiones activas, turnos, condensaciones, reusos de contexto y resúmenes."""
+    return await run_in_threadpool(conversations.stats)
+
+def _authorized_session(request: Request, session_id: str) -> Dict[str, Any]:
+    """Sesión guardada, si el que pregunta tiene acceso a su colección (como en /rag/query)."""
+    session = conversations.store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
+    _resolve_collection(request, session.get("collection"))
+    return session
+
+@app.get("/chat/sessions/{session_id}")
+async def get_chat_session(session_id: str, request: Request):
+    """Historial compacto de una sesión: ventana de turnos y resumen acumulado."""
+    session = await run_in_threadpool(_authorized_session, request, session_id)
+    return conversations.view(session)
+
+@app.delete("/chat/sessions/{session_id}")
+async def delete_chat_session(session_id: str, request: Request):
+    await run_in_threadpool(_authorized_session, request, session_id)
+    if not await run_in_threadpool(conversations.store.delete, session_id):
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
+    return {"deleted": session_id}
 
 @app.get("/rag/playground/")
 async def rag_playground():
@@ -2192,111 +3142,52 @@ async def rag_playground():
 # Endpoint de ingesta de documentos
 # =============================
 
-def _stable_id(source: str, page: int, chunk_index: int, content: str) -> str:
-    """Genera ID estable para Qdrant usando UUID v5."""
-    import uuid
-    name = f"{source}|{page}|{chunk_index}|{len(content)}"
-    return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
-
 def _process_document(file_path: Path, chunker_type: str, chunk_size: int, chunk_overlap: int) -> List[Document]:
     """Procesa un documento y retorna chunks con metadatos enriquecidos."""
-    docs = []
-    
     try:
-        # Cargar documento según tipo
-        if file_path.suffix.lower() == ".pdf":
-            loader = PyPDFLoader(str(file_path))
-            docs = loader.load()
-        elif file_path.suffix.lower() in [".doc", ".docx"]:
-            loader = Docx2txtLoader(str(file_path))
-            docs = loader.load()
-        else:
-            # Fallback para .txt, .md, .rst
-            loader = TextLoader(str(file_path), encoding="utf-8")
-            docs = loader.load()
-        
-        # Aplicar chunking
-        if chunker_type == "semantic" and _SemanticChunker:
-            try:
-                chunker = _SemanticChunker(
-                    embeddings=OpenAIEmbeddings(model=_get_env("RAG_EMBED_MODEL", "text-embedding-3-small")),
-                    threshold_type="percentile",
-                    threshold=95
-                )
-                chunks = chunker.split_documents(docs)
-            except Exception as e:
-                print(f"SemanticChunker falló, usando RecursiveCharacterTextSplitter: {e}")
-                chunker = RecursiveCharacterTextSplitter(
-                    chunk_size=chunk_size,
-                    chunk_overlap=chunk_overlap
-                )
-                chunks = chunker.split_documents(docs)
-        else:
-            chunker = RecursiveCharacterTextSplitter(
-                chunk_size=chunk_size,
-                chunk_overlap=chunk_overlap
-            )
-            chunks = chunker.split_documents(docs)
-        
-        # Enriquecer metadatos
-        for i, chunk in enumerate(chunks):
-            chunk.metadata.update({
-                "source": str(file_path),
-                "file_name": file_path.name,
-                "file_ext": file_path.suffix.lower(),
-                "doc_type": file_path.suffix.lower().lstrip("."),
-                "chunk_index": i,
-                "chunker_type": chunker_type,
-                "chunk_size": chunk_size,
-                "chunk_overlap": chunk_overlap
-            })
-            # Generar ID estable
-            chunk.metadata["id"] = _stable_id(
-                str(file_path), 
-                chunk.metadata.get("page", 0), 
-                i, 
-                chunk.page_content
-            )
-        
-        return chunks
-        
+        return list(iter_document_chunks(file_path, chunker_type, chunk_size, chunk_overlap))
     except Exception as e:
         print(f"Error procesando {file_path}: {e}")
         return []
 
-def _ingest_to_qdrant(docs: List[Document]) -> Dict[str, Any]:
-    """Ingesta documentos a Qdrant y retorna estadísticas."""
+def _ingest_to_qdrant(
+    docs: Iterable[Document], batch_size: Optional[int] = None, collection: Optional[str] = None
+) -> Dict[str, Any]:
+    """Ingesta documentos (lista o generador) a Qdrant en streaming y retorna estadísticas."""
     try:
         # Obtener configuración Qdrant
-        qdrant_url = _get_env("QDRANT_URL")
-        qdrant_api_key = _get_env("QDRANT_API_KEY")
-        qdrant_collection = _get_env("QDRANT_COLLECTION")
-        
-        if not (qdrant_url and qdrant_api_key and qdrant_collection):
+        if not qdrant_configured():
             raise RuntimeError("Faltan QDRANT_URL/QDRANT_API_KEY/QDRANT_COLLECTION")
+        collection = collection or qdrant_collection()
         
-        # Configurar embeddings y vectorstore
-        embed_model = _get_env("RAG_EMBED_MODEL", "text-embedding-3-small")
-        embeddings = OpenAIEmbeddings(model=embed_model)
-        
-        client = QdrantClient(url=qdrant_url, api_key=qdrant_api_key)
-        vectorstore = Qdrant(
-            client=client,
-            collection_name=qdrant_collection,
-            embeddings=embeddings,
-        )
+        # Configurar embeddings y cliente (compartido por proceso)
+        embed_model = rag_runtime["settings"]["RAG_EMBED_MODEL"]
+        embeddings = get_embeddings(embed_model)
+        client = get_qdrant_client()
         
-        # Ingestar documentos
-        vectorstore.add_documents(docs)
+        # Carga → split → embed → upsert por lotes (crea colección e índices si faltan)
+        with usage_scope("ingest", collection=collection):
+            pipeline = stream_to_qdrant(
+                docs,
+                client,
+                collection,
+                embeddings,
+                batch_size=batch_size or int(_get_env("INGEST_BATCH_SIZE", "64") or 64),
+                queue_size=int(_get_env("INGEST_QUEUE_SIZE", "4") or 4),
+                embedding_model=embed_model,
+            )
         
         # Estadísticas de ingesta
         stats = {
-            "success": True,
-            "documents_processed": len(docs),
-            "chunks_created": len(docs),
+            "success": pipeline["chunks"] > 0,
+            "documents_processed": pipeline["chunks"],
+            "chunks_created": pipeline["chunks"],
             "embedding_model": embed_model,
-            "collection": qdrant_collection
+            "collection": collection,
+            "pipeline": pipeline
         }
+        if not stats["success"]:
+            stats["error"] = "No se pudieron procesar chunks del documento"
         
         return stats
         
@@ -2307,93 +3198,626 @@ def _ingest_to_qdrant(docs: List[Document]) -> Dict[str, Any]:
             "documents_processed": 0
         }
 
+# =============================
+# Uploads: streaming, multi-archivo y reanudables
+# =============================
+
+ALLOWED_EXTENSIONS = {".pdf", ".docx", ".doc", ".txt", ".md", ".rst"}
+_UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+def _mb_env(name: str, default: str) -> int:
+    return int(float(_get_env(name, default) or default) * 1024 * 1024)
+
+def _max_file_bytes() -> int:
+    return _mb_env("INGEST_MAX_FILE_MB", "50")
+
+def _max_request_bytes() -> int:
+    return _mb_env("INGEST_MAX_REQUEST_MB", "200")
+
+def _upload_dir() -> Path:
+    path = Path(_get_env("INGEST_UPLOAD_DIR") or Path(tempfile.gettempdir()) / "rag_uploads")
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+def _validate_extension(filename: str) -> str:
+    file_ext = Path(filename or "").suffix.lower()
+    if file_ext not in ALLOWED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Tipo de archivo no soportado. Permitidos: {', '.join(sorted(ALLOWED_EXTENSIONS))}"
+        )
+    return file_ext
+
+def _validate_chunking(chunker_type: str, chunk_size: int, chunk_overlap: int) -> None:
+    if chunker_type not in ["recursive", "semantic"]:
+        raise HTTPException(status_code=400, detail="chunker_type debe ser 'recursive' o 'semantic'")
+    
+    if chunk_size < 100 or chunk_size > 5000:
+        raise HTTPException(status_code=400, detail="chunk_size debe estar entre 100 y 5000")
+    
+    if chunk_overlap < 0 or chunk_overlap >= chunk_size:
+        raise HTTPException(status_code=400, detail="chunk_overlap debe ser >= 0 y < chunk_size")
+
+def _as_mb(num_bytes: int) -> str:
+    return f"{round(num_bytes / (1024 * 1024), 1):g} MB"
+
+def _too_large(limit: int) -> HTTPException:
+    return HTTPException(status_code=413, detail=f"Archivo demasiado grande (máximo {_as_mb(limit)})")
+
+@app.middleware("http")
+async def _reject_oversized_uploads(request, call_next):
+    """
+    Rechaza con 413 antes de leer el cuerpo si Content-Length supera el límite.
+
+    Los POST de /ingest/* son formularios que Starlette guarda enteros en disco
+    antes de llegar al handler, así que sin Content-Length (cuerpo chunked) no
+    hay forma de cortar a tiempo: se responde 411. Los PUT de las sesiones
+    reanudables leen el stream con su propio tope y pueden venir chunked.
+    """
+    if request.method in ("POST", "PUT") and request.url.path.startswith("/ingest/"):
+        length = request.headers.get("content-length")
+        if length is None and request.method == "POST" and request.headers.get("transfer-encoding"):
+            return JSONResponse({"detail": "Se requiere Content-Length"}, status_code=411)
+        if length and length.isdigit() and int(length) > _max_request_bytes():
+            return JSONResponse(
+                {"detail": f"Request demasiado grande (máximo {_as_mb(_max_request_bytes())})"},
+                status_code=413,
+            )
+    return await call_next(request)
+
+async def _save_upload(upload: UploadFile) -> Tuple[Path, str, int]:
+    """Copia un UploadFile a disco por bloques sin bloquear el event loop.
+
+    Calcula el SHA-256 mientras escribe y corta apenas se supera el límite.
+    Retorna (ruta temporal, sha256, bytes).
+    """
+    file_ext = _validate_extension(upload.filename)
+    limit = _max_file_bytes()
+    hasher = hashlib.sha256()
+    size = 0
+    fd, name = tempfile.mkstemp(suffix=file_ext, dir=_upload_dir())
+    temp_path = Path(name)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = await upload.read(_UPLOAD_CHUNK_BYTES)
+                if not block:
+                    break
+                size += len(block)
+                if size > limit:
+                    raise _too_large(limit)
+                hasher.update(block)
+                await run_in_threadpool(out.write, block)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return temp_path, hasher.hexdigest(), size
+
+def _iter_uploads_chunks(
+    saved: List[Dict[str, Any]], chunker_type: str, chunk_size: int, chunk_overlap: int
+) -> Iterator[Document]:
+    """Encadena los chunks de varios archivos; un archivo que falla no corta a los demás."""
+    for item in saved:
+        count = 0
+        try:
+            for chunk in iter_document_chunks(
+                item["path"], chunker_type, chunk_size, chunk_overlap,
+                file_name=item["filename"], digest=item["sha256"],
+            ):
+                count += 1
+                yield chunk
+        except Exception as e:
+            print(f"Error procesando {item['filename']}: {e}")
+            item["error"] = str(e)
+        item["chunks"] = count
+
+async def _ingest_saved_files(
+    saved: List[Dict[str, Any]],
+    chunker_type: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    collection: Optional[str] = None,
+    keep_files: bool = False,
+) -> Dict[str, Any]:
+    """Ingesta archivos ya guardados en un solo pipeline (fuera del event loop).
+
+    Los archivos se borran al terminar salvo con ``keep_files`` (el llamador decide).
+    """
+    try:
+        return await run_in_threadpool(
+            _ingest_to_qdrant,
+            _iter_uploads_chunks(saved, chunker_type, chunk_size, chunk_overlap),
+            None,
+            collection,
+        )
+    finally:
+        for item in saved:
+            path = item.pop("path")
+            if not keep_files:
+                path.unlink(missing_ok=True)
+
 @app.post("/ingest/upload")
 async def upload_and_ingest_document(
-    file: UploadFile = File(...),
+    request: Request,
+    file: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
     chunker_type: str = Form("recursive"),
     chunk_size: int = Form(1000),
-    chunk_overlap: int = Form(150)
+    chunk_overlap: int = Form(150),
+    collection: Optional[str] = Form(None)
 ):
     """
-    Sube y ingesta un documento a Qdrant.
+    Sube e ingesta uno o varios documentos a Qdrant.
     
+    - file / files: uno o más archivos (campo repetible ``files``)
     - chunker_type: "recursive" o "semantic"
     - chunk_size: tamaño del chunk (800-1200 recomendado)
     - chunk_overlap: solapamiento entre chunks (120-200 recomendado)
-    """
-    
-    # Validar tipo de archivo
-    allowed_extensions = {".pdf", ".docx", ".doc", ".txt", ".md", ".rst"}
-    file_ext = Path(file.filename).suffix.lower()
+    - collection: colección (cliente) destino; requiere una API key con acceso
+      a ella, y crearla si no existe, X-Admin-Token
     
-    if file_ext not in allowed_extensions:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Tipo de archivo no soportado. Permitidos: {', '.join(allowed_extensions)}"
-        )
+    Para PDFs grandes usar las sesiones reanudables de /ingest/upload/sessions.
+    """
+    uploads = ([file] if file else []) + list(files or [])
+    if not uploads:
+        raise HTTPException(status_code=400, detail="Se requiere al menos un archivo (file o files)")
+    max_files = int(_get_env("INGEST_MAX_FILES", "20") or 20)
+    if len(uploads) > max_files:
+        raise HTTPException(status_code=400, detail=f"Máximo {max_files} archivos por request")
     
-    # Validar parámetros
-    if chunker_type not in ["recursive", "semantic"]:
-        raise HTTPException(status_code=400, detail="chunker_type debe ser 'recursive' o 'semantic'")
+    # Validar tipos y parámetros antes de leer el contenido
+    for upload in uploads:
+        _validate_extension(upload.filename)
+    _validate_chunking(chunker_type, chunk_size, chunk_overlap)
+    collection = await run_in_threadpool(_resolve_collection, request, collection, True)
     
-    if chunk_size < 100 or chunk_size > 5000:
-        raise HTTPException(status_code=400, detail="chunk_size debe estar entre 100 y 5000")
+    saved: List[Dict[str, Any]] = []
+    try:
+        # Guardar archivos por bloques (hash + límite de tamaño)
+        for upload in uploads:
+            temp_path, digest, size = await _save_upload(upload)
+            saved.append({"filename": upload.filename, "path": temp_path, "sha256": digest, "bytes": size})
+    except BaseException:
+        for item in saved:
+            item["path"].unlink(missing_ok=True)
+        raise
     
-    if chunk_overlap < 0 or chunk_overlap >= chunk_size:
-        raise HTTPException(status_code=400, detail="chunk_overlap debe ser >= 0 y < chunk_size")
+    try:
+        # Procesar e ingestar en streaming (los chunks se suben a medida que se generan)
+        result = await _ingest_saved_files(saved, chunker_type, chunk_size, chunk_overlap, collection)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error procesando archivo: {str(e)}")
     
+    if result["success"]:
+        return JSONResponse({
+            "message": "Documento ingerido exitosamente" if len(saved) == 1 else f"{len(saved)} documentos ingeridos",
+            "filename": saved[0]["filename"],
+            "files": saved,
+            "stats": result
+        })
+    raise HTTPException(status_code=500, detail=f"Error en ingesta: {result['error']}")
+
+class UploadSessionInput(BaseModel):
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+    collection: Optional[str] = None
+
+def _session_paths(upload_id: str) -> Tuple[Path, Path]:
     try:
-        # Guardar archivo temporalmente
-        with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
-            shutil.copyfileobj(file.file, temp_file)
-            temp_path = Path(temp_file.name)
-        
-        # Procesar documento
-        docs = _process_document(temp_path, chunker_type, chunk_size, chunk_overlap)
-        
-        if not docs:
-            raise HTTPException(status_code=500, detail="No se pudieron procesar chunks del documento")
+        upload_id = str(uuid.UUID(upload_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Sesión de upload no encontrada")
+    base = _upload_dir()
+    return base / f"{upload_id}.json", base / f"{upload_id}.part"
+
+def _load_session(upload_id: str) -> Tuple[Dict[str, Any], Path, Path]:
+    meta_path, part_path = _session_paths(upload_id)
+    if not meta_path.exists():
+        raise HTTPException(status_code=404, detail="Sesión de upload no encontrada")
+    meta = json.loads(meta_path.read_text(encoding="utf-8"))
+    return meta, meta_path, part_path
+
+_active_upload_sessions: Set[str] = set()
+_active_upload_lock = threading.Lock()
+
+@contextmanager
+def _upload_session_lock(upload_id: str, meta_path: Path) -> Iterator[None]:
+    """Una operación a la vez por sesión, entre requests y entre workers; 409 si ya hay otra."""
+    busy = HTTPException(status_code=409, detail="Hay otra operación en curso sobre esta sesión de upload")
+    # La purga y el DELETE la toman desde el threadpool: revisar y marcar de una vez
+    with _active_upload_lock:
+        if upload_id in _active_upload_sessions:
+            raise busy
+        _active_upload_sessions.add(upload_id)
+    try:
+        try:
+            handle = open(meta_path, "rb")
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Sesión de upload no encontrada")
+        with handle:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    raise busy
+            yield
+    finally:
+        _active_upload_sessions.discard(upload_id)
+
+def _session_state(meta: Dict[str, Any], part_path: Path) -> Dict[str, Any]:
+    offset = part_path.stat().st_size if part_path.exists() else 0
+    return {
+        "upload_id": meta["upload_id"],
+        "filename": meta["filename"],
+        "size": meta["size"],
+        "offset": offset,
+        "complete": offset == meta["size"],
+        "chunk_bytes": _UPLOAD_CHUNK_BYTES * 8,
+    }
+
+def _delete_session_files(upload_id: str, meta_path: Path, part_path: Path) -> None:
+    """Borra una sesión con su candado tomado (409 si hay un PUT o /complete en curso)."""
+    with _upload_session_lock(upload_id, meta_path):
+        part_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+
+def _purge_stale_sessions() -> None:
+    ttl = float(_get_env("INGEST_UPLOAD_TTL_HOURS", "24") or 24) * 3600
+    now = datetime.now().timestamp()
+    for meta_path in _upload_dir().glob("*.json"):
+        try:
+            if now - meta_path.stat().st_mtime <= ttl:
+                continue
+            _delete_session_files(meta_path.stem, meta_path, meta_path.with_suffix(".part"))
+        except (OSError, HTTPException):
+            # En uso (o ya borrada por otra request): se intenta en la próxima purga
+            continue
+
+@app.post("/ingest/upload/sessions")
+async def create_upload_session(body: UploadSessionInput, request: Request):
+    """Crea una sesión de upload reanudable; el archivo se envía luego por partes con PUT."""
+    _validate_extension(body.filename)
+    if body.size <= 0:
+        raise HTTPException(status_code=400, detail="size debe ser > 0")
+    if body.size > _max_file_bytes():
+        raise _too_large(_max_file_bytes())
+    collection = await run_in_threadpool(_resolve_collection, request, body.collection, True)
+    await run_in_threadpool(_purge_stale_sessions)
+    upload_id = str(uuid.uuid4())
+    meta = {
+        "upload_id": upload_id,
+        "filename": Path(body.filename).name,
+        "size": body.size,
+        "sha256": (body.sha256 or "").lower() or None,
+        "collection": collection,
+        "created_at": str(datetime.now()),
+    }
+    meta_path, part_path = _session_paths(upload_id)
+    meta_path.write_text(json.dumps(meta), encoding="utf-8")
+    part_path.touch()
+    return _session_state(meta, part_path)
+
+@app.get("/ingest/upload/sessions/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """Estado de una sesión: ``offset`` indica desde dónde reanudar."""
+    meta, _, part_path = _load_session(upload_id)
+    return _session_state(meta, part_path)
+
+@app.put("/ingest/upload/sessions/{upload_id}")
+async def append_upload_chunk(upload_id: str, request: Request):
+    """
+    Agrega una parte al archivo de la sesión.
+
+    El cuerpo es binario crudo y el header ``Upload-Offset`` debe coincidir con
+    los bytes ya recibidos (si no, 409 con el offset actual para reanudar).
+    """
+    meta, meta_path, part_path = _load_session(upload_id)
+    with _upload_session_lock(upload_id, meta_path):
+        state = _session_state(meta, part_path)
+        offset = request.headers.get("upload-offset")
+        if offset is None or not offset.isdigit() or int(offset) != state["offset"]:
+            return JSONResponse({"detail": "Upload-Offset no coincide", **state}, status_code=409)
+        start = state["offset"]
+        length = request.headers.get("content-length")
+        if length and length.isdigit() and start + int(length) > meta["size"]:
+            raise HTTPException(status_code=413, detail="La parte excede el tamaño declarado")
         
-        # Ingestar a Qdrant
-        result = _ingest_to_qdrant(docs)
+        # Ante cualquier error (parte excedida, conexión cortada) se vuelve al offset
+        # inicial: el .part nunca queda con una parte a medias y el cliente la reenvía
+        written = start
+        try:
+            with open(part_path, "ab") as out:
+                async for block in request.stream():
+                    if not block:
+                        continue
+                    if written + len(block) > meta["size"]:
+                        raise HTTPException(status_code=413, detail="La parte excede el tamaño declarado")
+                    await run_in_threadpool(out.write, block)
+                    written += len(block)
+        except BaseException:
+            os.truncate(part_path, start)
+            raise
+        os.utime(meta_path)
+        return _session_state(meta, part_path)
+
+@app.post("/ingest/upload/sessions/{upload_id}/complete")
+async def complete_upload_session(
+    upload_id: str,
+    chunker_type: str = Form("recursive"),
+    chunk_size: int = Form(1000),
+    chunk_overlap: int = Form(150)
+):
+    """Cierra la sesión: verifica tamaño y hash e ingesta el archivo."""
+    _validate_chunking(chunker_type, chunk_size, chunk_overlap)
+    meta, meta_path, part_path = _load_session(upload_id)
+    with _upload_session_lock(upload_id, meta_path):
+        state = _session_state(meta, part_path)
+        if not state["complete"]:
+            return JSONResponse({"detail": "Upload incompleto", **state}, status_code=409)
         
-        # Limpiar archivo temporal
-        temp_path.unlink()
+        digest = await run_in_threadpool(file_sha256, part_path)
+        if meta.get("sha256") and meta["sha256"] != digest:
+            return JSONResponse({"detail": "SHA-256 no coincide", "sha256": digest, **state}, status_code=422)
         
-        if result["success"]:
-            return JSONResponse({
-                "message": "Documento ingerido exitosamente",
-                "filename": file.filename,
-                "stats": result
-            })
-        else:
+        # El .part pasa a ser el archivo a ingestar (con su extensión para el loader);
+        # si la ingesta falla vuelve a ser el .part y la sesión sigue para reintentar /complete
+        doc_path = part_path.with_suffix(Path(meta["filename"]).suffix.lower())
+        part_path.rename(doc_path)
+        saved = [{"filename": meta["filename"], "path": doc_path, "sha256": digest, "bytes": meta["size"]}]
+        try:
+            result = await _ingest_saved_files(
+                saved, chunker_type, chunk_size, chunk_overlap, meta.get("collection"), keep_files=True
+            )
+        except Exception as e:
+            doc_path.rename(part_path)
+            raise HTTPException(status_code=500, detail=f"Error procesando archivo: {str(e)}")
+        if not result["success"]:
+            doc_path.rename(part_path)
             raise HTTPException(status_code=500, detail=f"Error en ingesta: {result['error']}")
-            
+        doc_path.unlink(missing_ok=True)
+        meta_path.unlink(missing_ok=True)
+    return JSONResponse({
+        "message": "Documento ingerido exitosamente",
+        "filename": meta["filename"],
+        "files": saved,
+        "stats": result
+    })
+
+@app.delete("/ingest/upload/sessions/{upload_id}")
+async def abort_upload_session(upload_id: str):
+    """Descarta una sesión de upload y sus datos parciales."""
+    meta_path, part_path = _session_paths(upload_id)
+    if not meta_path.exists():
+        part_path.unlink(missing_ok=True)
+        return {"upload_id": upload_id, "deleted": False}
+    await run_in_threadpool(_delete_session_files, upload_id, meta_path, part_path)
+    return {"upload_id": upload_id, "deleted": True}
+
+# =============================
+# Ingesta masiva desde archivos zip/tar
+# =============================
+
+_archive_executor: Dict[str, Any] = {"pool": None, "workers": 0}
+_archive_executor_lock = threading.Lock()
+
+def _archive_pool() -> Tuple[ProcessPoolExecutor, int]:
+    """
+    Pool de parseo único para todas las ingestas de archivos comprimidos, con
+    ``INGEST_ARCHIVE_WORKERS`` procesos (0 = núcleos, hasta 4). Usa ``spawn``:
+    un fork desde este proceso con threads puede heredar locks tomados (cliente
+    Qdrant/HTTP) y colgarse.
+    """
+    with _archive_executor_lock:
+        if _archive_executor["pool"] is None:
+            workers = int(_get_env("INGEST_ARCHIVE_WORKERS", "0") or 0) or min(os.cpu_count() or 1, 4)
+            _archive_executor["pool"] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _archive_executor["workers"] = workers
+        return _archive_executor["pool"], _archive_executor["workers"]
+
+def _discard_archive_pool(pool: ProcessPoolExecutor) -> None:
+    with _archive_executor_lock:
+        if _archive_executor["pool"] is pool:
+            _archive_executor["pool"] = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def _iter_archive_entries(fileobj: Any) -> Iterator[Tuple[str, int, Any]]:
+    """
+    Recorre las entradas de un zip o tar (también .tar.gz/.bz2/.xz) sin extraerlas.
+
+    Retorna (nombre, tamaño, stream); el stream debe consumirse antes de pedir
+    la siguiente entrada (los tar se leen en modo streaming).
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                with zf.open(info) as stream:
+                    yield info.filename, info.file_size, stream
+        return
+    fileobj.seek(0)
+    try:
+        tf = tarfile.open(fileobj=fileobj, mode="r|*")
+    except tarfile.TarError:
+        raise HTTPException(status_code=400, detail="El archivo no es un zip ni un tar válido")
+    with tf:
+        for member in tf:
+            if not member.isfile():
+                continue
+            stream = tf.extractfile(member)
+            if stream is not None:
+                yield member.name, member.size, stream
+
+def _spool_entry(stream: Any, file_ext: str, limit: int) -> Tuple[Path, str, int]:
+    """Escribe una entrada a un archivo temporal por bloques, con hash y límite de tamaño."""
+    hasher = hashlib.sha256()
+    size = 0
+    fd, name = tempfile.mkstemp(suffix=file_ext, dir=_upload_dir())
+    temp_path = Path(name)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            for block in iter(lambda: stream.read(_UPLOAD_CHUNK_BYTES), b""):
+                size += len(block)
+                if size > limit:
+                    raise _too_large(limit)
+                hasher.update(block)
+                out.write(block)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+    return temp_path, hasher.hexdigest(), size
+
+def _ingest_archive(
+    fileobj: Any, chunker_type: str, chunk_size: int, chunk_overlap: int, collection: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Ingesta todas las entradas soportadas de un archivo comprimido.
+
+    Las entradas se parsean en paralelo en el pool de procesos compartido
+    (a lo sumo 2*workers en vuelo por request) y todos sus chunks alimentan un único pipeline de
+    embeddings/upsert con lotes grandes compartidos entre archivos.
+    """
+    max_entries = int(_get_env("INGEST_ARCHIVE_MAX_FILES", "5000") or 5000)
+    max_total = _mb_env("INGEST_ARCHIVE_MAX_UNCOMPRESSED_MB", "2000")
+    max_file = _max_file_bytes()
+    summary: Dict[str, Any] = {
+        "files_total": 0,
+        "files_ingested": 0,
+        "bytes": 0,
+        "skipped": [],
+        "failed": [],
+        "files": [],
+    }
+    pool, workers = _archive_pool()
+    t0 = time.perf_counter()
+
+    def _collect(entry: Dict[str, Any], future: Any) -> Iterator[Document]:
+        try:
+            chunks, secs, error = future.result()
+        finally:
+            entry.pop("path").unlink(missing_ok=True)
+        entry["parse_s"] = round(secs, 3)
+        if error or not chunks:
+            summary["failed"].append({"filename": entry["filename"], "error": error or "sin chunks"})
+            return
+        entry["chunks"] = len(chunks)
+        summary["files_ingested"] += 1
+        summary["files"].append(entry)
+        yield from chunks
+
+    def _chunks() -> Iterator[Document]:
+        pending: deque = deque()
+        try:
+            for name, size, stream in _iter_archive_entries(fileobj):
+                file_name = Path(name).name
+                file_ext = Path(file_name).suffix.lower()
+                if file_name.startswith(".") or "__MACOSX" in name or file_ext not in ALLOWED_EXTENSIONS:
+                    summary["skipped"].append({"filename": name, "reason": "extensión no soportada"})
+                    continue
+                if summary["files_total"] >= max_entries:
+                    summary["skipped"].append({"filename": name, "reason": f"máximo {max_entries} archivos"})
+                    continue
+                if size > max_file or summary["bytes"] + size > max_total:
+                    summary["skipped"].append({"filename": name, "reason": "tamaño excede el límite"})
+                    continue
+                try:
+                    temp_path, digest, real_size = _spool_entry(stream, file_ext, max_file)
+                except HTTPException as e:
+                    summary["skipped"].append({"filename": name, "reason": e.detail})
+                    continue
+                summary["files_total"] += 1
+                summary["bytes"] += real_size
+                entry = {"filename": name, "path": temp_path, "sha256": digest, "bytes": real_size}
+                future = pool.submit(
+                    chunk_file, temp_path, name, digest, chunker_type, chunk_size, chunk_overlap
+                )
+                pending.append((entry, future))
+                # Orden determinístico y memoria acotada: consumir el más antiguo
+                while len(pending) >= 2 * workers:
+                    yield from _collect(*pending.popleft())
+            while pending:
+                yield from _collect(*pending.popleft())
+        except BrokenProcessPool:
+            # Murió un proceso (p.ej. sin memoria): el próximo request arma un pool nuevo
+            _discard_archive_pool(pool)
+            raise
+        finally:
+            for entry, future in pending:
+                future.cancel()
+                if "path" in entry:
+                    entry["path"].unlink(missing_ok=True)
+
+    result = _ingest_to_qdrant(
+        _chunks(), batch_size=int(_get_env("INGEST_ARCHIVE_BATCH_SIZE", "256") or 256), collection=collection
+    )
+    elapsed = time.perf_counter() - t0
+    summary.update({
+        "success": result["success"],
+        "error": result.get("error"),
+        "chunks": result.get("chunks_created", 0),
+        "elapsed_s": round(elapsed, 3),
+        "files_per_s": round(summary["files_ingested"] / elapsed, 2) if elapsed > 0 else 0.0,
+        "chunks_per_s": round(result.get("chunks_created", 0) / elapsed, 1) if elapsed > 0 else 0.0,
+        "mb_per_s": round(summary["bytes"] / (1024 * 1024) / elapsed, 2) if elapsed > 0 else 0.0,
+        "workers": workers,
+        "stats": result,
+    })
+    return summary
+
+@app.post("/ingest/archive")
+async def ingest_archive(
+    request: Request,
+    archive: UploadFile = File(...),
+    chunker_type: str = Form("recursive"),
+    chunk_size: int = Form(1000),
+    chunk_overlap: int = Form(150),
+    collection: Optional[str] = Form(None)
+):
+    """
+    Ingesta una base de conocimiento completa desde un zip o tar.
+
+    Aplica las mismas extensiones permitidas que /ingest/upload; las entradas
+    no soportadas o demasiado grandes se reportan como omitidas y un archivo
+    que falla no interrumpe al resto. Retorna un único resumen con throughput.
+    """
+    _validate_chunking(chunker_type, chunk_size, chunk_overlap)
+    collection = await run_in_threadpool(_resolve_collection, request, collection, True)
+    try:
+        # El upload ya está en un archivo temporal (spooled); se lee entrada por entrada
+        summary = await run_in_threadpool(
+            _ingest_archive, archive.file, chunker_type, chunk_size, chunk_overlap, collection
+        )
+    except HTTPException:
+        raise
     except Exception as e:
-        # Limpiar en caso de error
-        if 'temp_path' in locals():
-            try:
-                temp_path.unlink()
-            except:
-                pass
-        raise HTTPException(status_code=500, detail=f"Error procesando archivo: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error procesando archivo comprimido: {str(e)}")
+    if summary["files_total"] == 0:
+        raise HTTPException(status_code=400, detail="El archivo no contiene documentos soportados")
+    summary["archive"] = archive.filename
+    return JSONResponse(summary, status_code=200 if summary["success"] else 500)
 
 @app.get("/ingest/status")
-async def get_ingest_status_json():
+async def get_ingest_status_json(request: Request, collection: Optional[str] = None):
     """Retorna el estado actual de la colección Qdrant como JSON (para frontend)."""
+    collection = _resolve_collection(request, collection)
     try:
-        stats = _compute_corpus_stats()
+        stats = await run_in_threadpool(_compute_corpus_stats, collection)
         if "error" in stats:
             return JSONResponse({"status": "error", "detail": stats["error"], "collection_stats": {"total_files": 0, "total_chunks": 0, "by_type": {}, "samples": []}}, status_code=200)
-        return JSONResponse({"status": "ok", "collection_stats": stats})
+        return JSONResponse({"status": "ok", "collection": collection, "collection_stats": stats})
     except Exception as e:
         return JSONResponse({"status": "error", "detail": str(e)}, status_code=500)
 
 @app.get("/ingest/status/html", response_class=HTMLResponse)
-async def get_ingest_status_html():
+async def get_ingest_status_html(request: Request, collection: Optional[str] = None):
     """Retorna el estado actual de la colección Qdrant con formato HTML bonito."""
+    collection = _resolve_collection(request, collection)
     try:
-        stats = _compute_corpus_stats()
+        stats = await run_in_threadpool(_compute_corpus_stats, collection)
         if "error" in stats:
             return HTMLResponse(content=f"""
             <!DOCTYPE html>
@@ -2580,16 +4004,30 @@ async def chat_with_gpt(request: dict):
         if not message:
             raise HTTPException(status_code=400, detail="Mensaje requerido")
         
-        # Usar el LLM existente para chat libre
-        response = llm.invoke(message)
+        session_id = request.get("session_id")
+        if session_id is None:
+            # Usar el LLM existente para chat libre
+            with usage_scope("chatgpt_chat"):
+                response = llm.invoke(message)
+            return JSONResponse({
+                "status": "success",
+                "response": response.content,
+                "model": "gpt-4o",
+                "timestamp": str(datetime.now())
+            })
         
+        with usage_scope("chatgpt_chat"):
+            text, session_id = await run_in_threadpool(_chat_session_turn, session_id, message)
         return JSONResponse({
             "status": "success",
-            "response": response.content,
+            "response": text,
             "model": "gpt-4o",
+            "session_id": session_id,
             "timestamp": str(datetime.now())
         })
         
+    except UnknownSession:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en chat: {str(e)}")
 
@@ -2643,6 +4081,8 @@ async def chatgpt_ui():
         </div>
         
         <script>
+            let sessionId = '';
+            
             async function sendMessage() {
                 const input = document.getElementById('messageInput');
                 const message = input.value.trim();
@@ -2656,12 +4096,17 @@ async def chatgpt_ui():
                     const response = await fetch('/chatgpt/chat', {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ message: message })
+                        // '' abre una sesión nueva; luego se reusa la que devuelve el servidor
+                        body: JSON.stringify({ message: message, session_id: sessionId })
                     });
                     
                     const data = await response.json();
                     if (data.status === 'success') {
+                        sessionId = data.session_id || sessionId;
                         addMessage(data.response, 'bot');
+                    } else if (response.status === 404 && sessionId) {
+                        sessionId = '';
+                        addMessage('La sesión expiró; el próximo mensaje inicia una conversación nueva.', 'bot');
                     } else {
                         addMessage('Error: ' + data.detail, 'bot');
                     }
@@ -2698,16 +4143,30 @@ async def chat_with_gpt(request: dict):
         if not message:
             raise HTTPException(status_code=400, detail="Mensaje requerido")
         
-        # Usar el LLM existente para chat libre
-        response = llm.invoke(message)
+        session_id = request.get("session_id")
+        if session_id is None:
+            # Usar el LLM existente para chat libre
+            with usage_scope("chatgpt_chat"):
+                response = llm.invoke(message)
+            return JSONResponse({
+                "status": "success",
+                "response": response.content,
+                "model": "gpt-4o",
+                "timestamp": str(datetime.now())
+            })
         
+        with usage_scope("chatgpt_chat"):
+            text, session_id = await run_in_threadpool(_chat_session_turn, session_id, message)
         return JSONResponse({
             "status": "success",
-            "response": response.content,
+            "response": text,
             "model": "gpt-4o",
+            "session_id": session_id,
             "timestamp": str(datetime.now())
         })
         
+    except UnknownSession:
+        raise HTTPException(status_code=404, detail="Sesión no encontrada o expirada")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error en chat: {str(e)}")
 
@@ -2760,6 +4219,8 @@ async def chatgpt_ui():
         </div>
         
         <script>
+            let sessionId = '';
+            
             async function sendMessage() {
                 const input = document.getElementById('messageInput');
                 const message = input.value.trim();
@@ -2773,12 +4234,17 @@ async def chatgpt_ui():
                     const response = await fetch('/chatgpt/chat', {
                         method: 'POST',
                         headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify({ message: message })
+                        // '' abre una sesión nueva; luego se reusa la que devuelve el servidor
+                        body: JSON.stringify({ message: message, session_id: sessionId })
                     });
                     
                     const data = await response.json();
                     if (data.status === 'success') {
+                        sessionId = data.session_id || sessionId;
                         addMessage(data.response, 'bot');
+                    } else if (response.status === 404 && sessionId) {
+                        sessionId = '';
+                        addMessage('La sesión expiró; el próximo mensaje inicia una conversación nueva.', 'bot');
                     } else {
                         addMessage('Error: ' + data.detail, 'bot');
                     }
@@ -2818,6 +4284,18 @@ async def stats_page():
             print(f"Error obteniendo estadísticas: {e}")
             stats = {"total_files": 0, "total_chunks": 0, "by_type": {}, "samples": [], "error": str(e)}
         
+        usage = usage_tracker.snapshot()
+        totals = usage["totals"]
+        usage_tokens = totals["prompt_tokens"] + totals["completion_tokens"] + totals["embedding_tokens"]
+        usage_rows = "".join(
+            f"""
+                        <div class="file-item">
+                            <div class="file-name">{name}</div>
+                            <div class="file-type">{row['calls']} llamadas · {row['prompt_tokens']:,} prompt ({row['cached_prompt_tokens']:,} en caché) · {row['completion_tokens']:,} completion · {row['embedding_tokens']:,} embeddings · ${row['cost_usd']:.4f}</div>
+                        </div>"""
+            for name, row in sorted(usage["by"]["endpoint"].items(), key=lambda kv: -kv[1]["cost_usd"])
+        ) or '<div class="file-item">Sin uso registrado</div>'
+        
         stats_html = f"""
         <!DOCTYPE html>
         <html>
@@ -2882,6 +4360,26 @@ async def stats_page():
                 </div>
                 ''' if stats.get('error') else ''}
                 
+                <div class="stats-grid">
+                    <div class="stat-card">
+                        <div class="stat-label">Tokens Consumidos</div>
+                        <div class="stat-number">{usage_tokens:,}</div>
+                        <div class="stat-description">{totals['calls']} llamadas · {usage['rates']['last_5_min']['tokens_per_min']} tokens/min (5 min)</div>
+                    </div>
+                    <div class="stat-card">
+                        <div class="stat-label">Costo Estimado</div>
+                        <div class="stat-number">${totals['cost_usd']:.2f}</div>
+                        <div class="stat-description">${usage['rates']['last_60_min']['cost_usd_per_hour']}/hora (última hora)</div>
+                    </div>
+                </div>
+                
+                <div class="files-section">
+                    <h3>💰 Uso por Endpoint</h3>
+                    <div class="file-list">
+                        {usage_rows}
+                    </div>
+                </div>
+                
                 <div class="files-section">
                     <h3>📁 Archivos en el Sistema</h3>
                     <div class="file-list">
@@ -0,0 +1,224 @@
+"""
+Resumen map-reduce para textos largos.
+
+Un texto que entra en ``chunk_tokens`` se resume con una sola llamada. Si no,
+se corta por tokens (``RecursiveCharacterTextSplitter`` con el contador de
+``app.usage``), cada trozo se resume en paralelo con a lo más
+``max_concurrency`` llamadas en vuelo (entre todas las requests que comparten
+el ``Summarizer``, no por request) y los resúmenes parciales se combinan
+por niveles: se agrupan hasta ``reduce_tokens`` y se vuelven a resumir hasta
+que caben en una sola llamada final, que se emite en streaming.
+
+Todas las llamadas usan la misma cadena (la plantilla de resumen del
+servidor). Los resúmenes, parciales y finales, se guardan en un LRU en memoria
+por hash del texto: repetir el mismo texto no llama al LLM y editar un texto
+largo solo vuelve a resumir los trozos que cambiaron.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from langchain_core.runnables import Runnable
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.usage import token_counter
+
+PIECE_SEPARATOR = "\n\n---\n\n"
+
+
+class Summarizer:
+    """Resume textos de cualquier largo con una cadena ``{text_for_summarization} -> str``."""
+
+    def __init__(
+        self,
+        chain: Runnable,
+        model: str = "gpt-4o",
+        chunk_tokens: int = 3000,
+        chunk_overlap: int = 200,
+        reduce_tokens: int = 6000,
+        max_concurrency: int = 4,
+        cache_size: int = 256,
+        input_key: str = "text_for_summarization",
+    ):
+        self.chain = chain
+        self.model = model
+        self.count, self.tokenizer = token_counter(model)
+        self.chunk_tokens = chunk_tokens
+        self.reduce_tokens = max(reduce_tokens, chunk_tokens)
+        self.max_concurrency = max(1, max_concurrency)
+        self.input_key = input_key
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_tokens,
+            chunk_overlap=chunk_overlap,
+            length_function=self.count,
+        )
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+        # Un semáforo por event loop (uno solo en el servidor): un asyncio.Semaphore no se comparte entre loops
+        self._semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._stats = {"requests": 0, "cached_requests": 0, "llm_calls": 0, "cache_hits": 0, "pieces": 0}
+
+    # ----- caché -----
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{text}".encode("utf-8")).hexdigest()
+
+    def _cached(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._cache.get(key)
+            if summary is not None:
+                self._cache.move_to_end(key)
+                self._stats["cache_hits"] += 1
+            return summary
+
+    def _store(self, key: str, summary: str) -> None:
+        if self._cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[key] = summary
+            self._cache.move_to_end(key)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+    # ----- llamadas -----
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            semaphore = self._semaphores.get(loop)
+            if semaphore is None:
+                semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+            return semaphore
+
+    async def _summarize(self, text: str) -> str:
+        key = self._key(text)
+        cached = self._cached(key)
+        if cached is not None:
+            return cached
+        async with self._semaphore():
+            summary = await self.chain.ainvoke({self.input_key: text})
+        with self._lock:
+            self._stats["llm_calls"] += 1
+        self._store(key, summary)
+        return summary
+
+    def _groups(self, summaries: List[str]) -> List[str]:
+        """Junta resúmenes consecutivos en textos de hasta ``reduce_tokens``."""
+        groups: List[List[str]] = [[]]
+        size = 0
+        for summary in summaries:
+            tokens = self.count(summary)
+            if groups[-1] and size + tokens > self.reduce_tokens:
+                groups.append([])
+                size = 0
+            groups[-1].append(summary)
+            size += tokens
+        return [PIECE_SEPARATOR.join(g) for g in groups]
+
+    # ----- API -----
+
+    async def events(self, text: str) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Eventos del resumen: ``start``, ``map`` (uno por trozo), ``reduce`` (uno
+        por nivel), ``token`` (resumen final en partes) y ``done``.
+        """
+        t0 = time.perf_counter()
+        key = self._key(text)
+        tokens = self.count(text)
+        with self._lock:
+            self._stats["requests"] += 1
+
+        cached = self._cached(key)
+        if cached is not None:
+            with self._lock:
+                self._stats["cached_requests"] += 1
+            yield {"event": "start", "tokens": tokens, "pieces": 0, "cached": True}
+            yield {"event": "token", "text": cached}
+            yield {"event": "done", "summary": cached, "cached": True, "tokens": tokens,
+                   "pieces": 0, "levels": 0, "seconds": round(time.perf_counter() - t0, 3)}
+            return
+
+        pieces = self.splitter.split_text(text) if tokens > self.chunk_tokens else [text]
+        with self._lock:
+            self._stats["pieces"] += len(pieces)
+        yield {"event": "start", "tokens": tokens, "pieces": len(pieces), "cached": False,
+               "tokenizer": self.tokenizer, "max_concurrency": self.max_concurrency}
+
+        levels = 0
+        if len(pieces) > 1:
+            tasks = [asyncio.ensure_future(self._summarize(p)) for p in pieces]
+            try:
+                done = 0
+                for next_done in asyncio.as_completed(tasks):
+                    await next_done
+                    done += 1
+                    yield {"event": "map", "done": done, "total": len(pieces)}
+                summaries = [task.result() for task in tasks]
+            finally:
+                # Si el cliente se desconecta no seguir gastando llamadas
+                for task in tasks:
+                    task.cancel()
+            groups = self._groups(summaries)
+            while len(groups) > 1:
+                levels += 1
+                yield {"event": "reduce", "level": levels, "pieces": len(groups)}
+                summaries = await asyncio.gather(*(self._summarize(g) for g in groups))
+                reduced = self._groups(list(summaries))
+                # Resúmenes que no achican: juntar todo en la llamada final antes que no terminar
+                groups = reduced if len(reduced) < len(groups) else [PIECE_SEPARATOR.join(summaries)]
+            final_input = groups[0]
+        else:
+            final_input = pieces[0]
+
+        # Llamada final en streaming (o desde la caché si ya se resumió este mismo texto)
+        summary = self._cached(self._key(final_input))
+        if summary is not None:
+            yield {"event": "token", "text": summary}
+        else:
+            parts: List[str] = []
+            # También cuenta para max_concurrency: el tope es de llamadas al LLM del proceso
+            async with self._semaphore():
+                async for chunk in self.chain.astream({self.input_key: final_input}):
+                    if chunk:
+                        parts.append(chunk)
+                        yield {"event": "token", "text": chunk}
+            summary = "".join(parts)
+            with self._lock:
+                self._stats["llm_calls"] += 1
+            self._store(self._key(final_input), summary)
+        self._store(key, summary)
+        yield {"event": "done", "summary": summary, "cached": False, "tokens": tokens,
+               "pieces": len(pieces), "levels": levels, "seconds": round(time.perf_counter() - t0, 3)}
+
+    async def summarize(self, text: str) -> Dict[str, Any]:
+        """Resultado final (el evento ``done``) sin streaming."""
+        result: Dict[str, Any] = {}
+        async for event in self.events(text):
+            if event["event"] == "done":
+                result = event
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                **self._stats,
+                "cache_entries": len(self._cache),
+                "cache_size": self._cache_size,
+                "settings": {
+                    "model": self.model,
+                    "tokenizer": self.tokenizer,
+                    "chunk_tokens": self.chunk_tokens,
+                    "reduce_tokens": self.reduce_tokens,
+                    "max_concurrency": self.max_concurrency,
+                },
+            }
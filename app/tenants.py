@@ -0,0 +1,214 @@
+"""
+Varias colecciones (una por cliente) en un mismo proceso.
+
+``TenantPool`` guarda en un LRU el runtime RAG de cada colección (vectorstore
+y cadena, más la cascada si está activa), construido la primera vez que se
+consulta. Todos comparten el cliente Qdrant, los embeddings y los chat models
+del proceso, así que un runtime es solo un puñado de objetos livianos; aun
+así el pool se acota por cantidad (``max_entries``) y expulsa los que llevan
+``idle_s`` sin uso.
+
+Las métricas por colección (requests, errores, latencias) viven aparte del
+runtime, en otro LRU acotado (``max_tracked``), para no perderlas cuando el
+runtime se expulsa; tokens y costo vienen de la dimensión ``collection`` de
+``app.usage``.
+
+``CollectionGrants`` decide qué API key puede usar qué colección
+(``RAG_API_KEYS``); la colección por defecto no requiere key.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, FrozenSet, List, Optional
+
+from app.eval_store import latency_summary
+
+DEFAULT_COLLECTION_PATTERN = r"^[A-Za-z0-9][A-Za-z0-9_\-]{0,63}$"
+
+
+class UnknownCollection(LookupError):
+    """La colección pedida no existe en Qdrant."""
+
+
+def validate_collection(name: str, pattern: str = DEFAULT_COLLECTION_PATTERN) -> str:
+    name = (name or "").strip()
+    if not re.fullmatch(pattern, name):
+        raise ValueError(f"Nombre de colección inválido: {name!r}")
+    return name
+
+
+def _key_id(key: str) -> str:
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class CollectionGrants:
+    """
+    Colecciones permitidas por API key, desde ``"key1=col_a|col_b,key2=*,key3"``:
+    ``*`` da todas y una key sin ``=`` solo la identifica (rate limit), sin colecciones.
+    Las keys se guardan hasheadas para no compararlas en claro.
+    """
+
+    def __init__(self, spec: Optional[str] = None):
+        self.keys: List[str] = []
+        self._grants: Dict[str, FrozenSet[str]] = {}
+        for item in (spec or "").split(","):
+            key, _, collections = item.strip().partition("=")
+            key = key.strip()
+            if not key:
+                continue
+            self.keys.append(key)
+            self._grants[_key_id(key)] = frozenset(c.strip() for c in collections.split("|") if c.strip())
+
+    def allows(self, key: Optional[str], collection: str) -> bool:
+        allowed = self._grants.get(_key_id(key)) if key else None
+        return bool(allowed) and ("*" in allowed or collection in allowed)
+
+
+class TenantPool:
+    """LRU de runtimes RAG por colección, con expulsión por inactividad y métricas por colección."""
+
+    def __init__(
+        self,
+        factory: Callable[[str], Dict[str, Any]],
+        max_entries: int = 64,
+        idle_s: float = 1800.0,
+        max_tracked: int = 1000,
+        window: int = 200,
+    ):
+        self.factory = factory
+        self.max_entries = max(1, max_entries)
+        self.idle_s = idle_s
+        self.max_tracked = max(1, max_tracked)
+        self.window = window
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._building: Dict[str, threading.Lock] = {}
+        # Sube con cada reset: un runtime armado con la fábrica anterior no entra al pool
+        self._generation = 0
+        self._metrics: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._counters = {"hits": 0, "builds": 0, "build_errors": 0, "evicted_lru": 0, "evicted_idle": 0}
+
+    # ----- runtimes -----
+
+    def _hit(self, collection: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(collection)
+        if entry is None:
+            return None
+        entry["last_used"] = time.monotonic()
+        entry["uses"] += 1
+        self._entries.move_to_end(collection)
+        self._counters["hits"] += 1
+        return entry["runtime"]
+
+    def get(self, collection: str) -> Dict[str, Any]:
+        """Runtime de la colección; se construye una sola vez aunque lleguen varias requests a la vez."""
+        with self._lock:
+            self._evict_idle()
+            runtime = self._hit(collection)
+            if runtime is not None:
+                return runtime
+            build_lock = self._building.setdefault(collection, threading.Lock())
+        with build_lock:
+            with self._lock:
+                runtime = self._hit(collection)
+                if runtime is not None:
+                    return runtime
+                factory, generation = self.factory, self._generation
+            t0 = time.perf_counter()
+            try:
+                runtime = factory(collection)
+            except Exception:
+                with self._lock:
+                    self._counters["build_errors"] += 1
+                    self._building.pop(collection, None)
+                raise
+            now = time.monotonic()
+            with self._lock:
+                self._building.pop(collection, None)
+                if generation != self._generation:
+                    return runtime
+                self._entries[collection] = {
+                    "runtime": runtime,
+                    "built_at": now,
+                    "last_used": now,
+                    "uses": 1,
+                    "build_s": round(time.perf_counter() - t0, 4),
+                }
+                self._counters["builds"] += 1
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._counters["evicted_lru"] += 1
+            return runtime
+
+    def _evict_idle(self) -> None:
+        # Orden LRU: los más viejos están al principio
+        cutoff = time.monotonic() - self.idle_s
+        while self._entries:
+            collection, entry = next(iter(self._entries.items()))
+            if entry["last_used"] >= cutoff:
+                break
+            del self._entries[collection]
+            self._counters["evicted_idle"] += 1
+
+    def reset(self, factory: Optional[Callable[[str], Dict[str, Any]]] = None) -> int:
+        """
+        Descarta todos los runtimes (se reconstruyen a demanda) y, si se pasa,
+        cambia la fábrica; las métricas se conservan. Retorna cuántos había.
+        """
+        with self._lock:
+            if factory is not None:
+                self.factory = factory
+            self._generation += 1
+            count = len(self._entries)
+            self._entries.clear()
+            return count
+
+    # ----- métricas -----
+
+    def record(self, collection: str, seconds: float, ok: bool = True) -> None:
+        with self._lock:
+            metrics = self._metrics.get(collection)
+            if metrics is None:
+                metrics = {"requests": 0, "errors": 0, "latencies": deque(maxlen=self.window)}
+                self._metrics[collection] = metrics
+                while len(self._metrics) > self.max_tracked:
+                    self._metrics.popitem(last=False)
+            self._metrics.move_to_end(collection)
+            metrics["requests"] += 1
+            metrics["errors"] += 0 if ok else 1
+            metrics["latencies"].append(seconds)
+            metrics["last_request"] = time.time()
+
+    def stats(self, usage_by_collection: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        usage_by_collection = usage_by_collection or {}
+        with self._lock:
+            now = time.monotonic()
+            pooled = {
+                name: {"uses": e["uses"], "build_s": e["build_s"], "idle_s": round(now - e["last_used"], 1)}
+                for name, e in self._entries.items()
+            }
+            tenants = {}
+            for name, m in self._metrics.items():
+                usage = usage_by_collection.get(name) or {}
+                tenants[name] = {
+                    "requests": m["requests"],
+                    "errors": m["errors"],
+                    "latency_s": latency_summary(list(m["latencies"])),
+                    "last_request": m.get("last_request"),
+                    "pooled": name in pooled,
+                    "tokens": sum(usage.get(k, 0) for k in ("prompt_tokens", "completion_tokens", "embedding_tokens")),
+                    "cost_usd": usage.get("cost_usd", 0.0),
+                }
+            return {
+                **self._counters,
+                "pooled": len(self._entries),
+                "tracked": len(self._metrics),
+                "settings": {"max_entries": self.max_entries, "idle_s": self.idle_s, "max_tracked": self.max_tracked},
+                "pool": pooled,
+                "tenants": tenants,
+            }
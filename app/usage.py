@@ -0,0 +1,382 @@
+"""
+Contabilidad de tokens y costo por endpoint, colección, modelo y pregunta.
+
+- ``usage_callback``: callback de LangChain que ``get_chat_model`` agrega a
+  todos los modelos de chat; toma ``token_usage``/``usage_metadata`` de la
+  respuesta (prompt, prompt cacheado y completion) o, si no vienen, estima
+  con tiktoken (o ~4 caracteres por token)
+- ``MeteredEmbeddings``: cuenta los tokens de lo que realmente se envía al
+  modelo de embeddings (debajo de la caché, así que los aciertos no cuentan)
+- ``usage_scope``: atribuye las llamadas a un endpoint/colección/pregunta
+  (``ContextVar``; se propaga a ``run_in_threadpool``)
+
+El acumulador es un diccionario en memoria con un lock; cada
+``RAG_USAGE_FLUSH_S`` segundos se vuelca a ``RAG_USAGE_FILE`` (JSON) y se
+recarga al iniciar, así que los totales sobreviven a reinicios.
+
+Las preguntas se cuentan por hash (``question_key``): el texto no se guarda
+en memoria ni en el archivo.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import LLMResult
+
+# USD por millón de tokens; RAG_PRICES_JSON (mismo formato) reemplaza o agrega modelos
+DEFAULT_PRICES: Dict[str, Dict[str, float]] = {
+    "gpt-4o": {"prompt": 2.50, "cached_prompt": 1.25, "completion": 10.00},
+    "gpt-4o-mini": {"prompt": 0.15, "cached_prompt": 0.075, "completion": 0.60},
+    "text-embedding-3-small": {"embedding": 0.02},
+    "text-embedding-3-large": {"embedding": 0.13},
+    "text-embedding-ada-002": {"embedding": 0.10},
+}
+
+COUNTERS = ("calls", "estimated_calls", "prompt_tokens", "cached_prompt_tokens", "completion_tokens", "embedding_tokens")
+
+# =============================
+# Conteo de tokens
+# =============================
+
+_encoders: Dict[str, Any] = {}
+_encoders_lock = threading.Lock()
+
+
+def _encoder(model: str) -> Any:
+    with _encoders_lock:
+        if model not in _encoders:
+            try:
+                import tiktoken
+
+                try:
+                    _encoders[model] = tiktoken.encoding_for_model(model)
+                except KeyError:
+                    _encoders[model] = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                # Sin tiktoken o sin poder descargar el vocabulario: no reintentar
+                _encoders[model] = None
+        return _encoders[model]
+
+
+def token_counter(model: str) -> Tuple[Callable[[str], int], str]:
+    """Conteo con tiktoken si está disponible; si no, estimación de ~4 caracteres por token."""
+    enc = _encoder(model)
+    if enc is not None:
+        return (lambda text: len(enc.encode(text or "", disallowed_special=()))), f"tiktoken:{enc.name}"
+    return (lambda text: max(1, len(text or "") // 4)), "chars/4"
+
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    return token_counter(model)[0](text)
+
+
+def _message_tokens(messages: List[BaseMessage], model: str) -> int:
+    # ~4 tokens de formato por mensaje (rol y separadores), como en la guía de OpenAI
+    count = token_counter(model)[0]
+    return sum(count(m.content if isinstance(m.content, str) else json.dumps(m.content)) + 4 for m in messages)
+
+
+# =============================
+# Atribución
+# =============================
+
+_scope: ContextVar[Dict[str, Optional[str]]] = ContextVar("rag_usage_scope", default={})
+
+
+@contextlib.contextmanager
+def usage_scope(endpoint: Optional[str] = None, **labels: Optional[str]) -> Iterator[None]:
+    """Atribuye el uso dentro del bloque (``endpoint``, ``collection``, ``question``); se anida."""
+    current = _scope.get()
+    token = _scope.set({**current, **({"endpoint": endpoint} if endpoint else {}), **labels})
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+# =============================
+# Acumulador
+# =============================
+
+def _load_prices() -> Dict[str, Dict[str, float]]:
+    prices = {k: dict(v) for k, v in DEFAULT_PRICES.items()}
+    raw = os.getenv("RAG_PRICES_JSON")
+    if raw:
+        try:
+            for model, values in json.loads(raw).items():
+                prices.setdefault(model, {}).update(values)
+        except (ValueError, AttributeError) as e:
+            print(f"RAG_PRICES_JSON inválido, se usan los precios por defecto: {e}")
+    return prices
+
+
+def question_key(question: str) -> str:
+    """Clave de la dimensión ``question``: hash de la pregunta normalizada, sin el texto."""
+    return hashlib.sha256(" ".join(question.lower().split()).encode("utf-8")).hexdigest()[:16]
+
+
+def _empty() -> Dict[str, float]:
+    return {**{c: 0 for c in COUNTERS}, "cost_usd": 0.0}
+
+
+class UsageTracker:
+    """Totales acumulados por dimensión y ventana por minuto para las tasas recientes."""
+
+    def __init__(self, path: Optional[str] = None, flush_s: float = 30.0, max_questions: int = 500):
+        self.path = Path(path) if path else None
+        self.flush_s = flush_s
+        self.max_questions = max_questions
+        self.prices = _load_prices()
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._last_flush = time.monotonic()
+        self._dirty = False
+        self.totals = _empty()
+        self.by: Dict[str, Dict[str, Dict[str, float]]] = {
+            "endpoint": {}, "collection": {}, "model": {}, "question": OrderedDict(),
+        }
+        # (minuto, tokens, costo) de la última hora
+        self._minutes: Deque[List[float]] = deque(maxlen=60)
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path or not self.path.exists():
+            return
+        try:
+            saved = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"No se pudo leer {self.path}: {e}")
+            return
+        self.totals.update(saved.get("totals", {}))
+        for dim, rows in (saved.get("by") or {}).items():
+            if dim == "question":
+                # Archivos anteriores guardaban el texto: se re-clavean por hash y se reescriben
+                for key, row in rows.items():
+                    if len(key) != 16 or any(c not in "0123456789abcdef" for c in key):
+                        key, self._dirty = question_key(key), True
+                    self.by[dim][key] = row
+            elif dim in self.by:
+                self.by[dim].update(rows)
+        if self._dirty:
+            self.flush()
+
+    def cost(self, model: str, prompt: int = 0, cached_prompt: int = 0, completion: int = 0, embedding: int = 0) -> float:
+        price = self.prices.get(model)
+        if price is None:
+            # "gpt-4o-2024-08-06" -> "gpt-4o": el prefijo más largo conocido
+            base = max((m for m in self.prices if model.startswith(m)), key=len, default=None)
+            price = self.prices.get(base, {}) if base else {}
+        uncached = max(prompt - cached_prompt, 0)
+        return (
+            uncached * price.get("prompt", 0)
+            + cached_prompt * price.get("cached_prompt", price.get("prompt", 0))
+            + completion * price.get("completion", 0)
+            + embedding * price.get("embedding", 0)
+        ) / 1_000_000
+
+    def record(
+        self,
+        model: str,
+        prompt: int = 0,
+        cached_prompt: int = 0,
+        completion: int = 0,
+        embedding: int = 0,
+        estimated: bool = False,
+    ) -> None:
+        scope = _scope.get()
+        cost = self.cost(model, prompt, cached_prompt, completion, embedding)
+        delta = {
+            "calls": 1,
+            "estimated_calls": int(estimated),
+            "prompt_tokens": prompt,
+            "cached_prompt_tokens": cached_prompt,
+            "completion_tokens": completion,
+            "embedding_tokens": embedding,
+            "cost_usd": cost,
+        }
+        keys = {
+            "endpoint": scope.get("endpoint") or "other",
+            "collection": scope.get("collection"),
+            "model": model,
+            "question": scope.get("question"),
+        }
+        minute = int(time.time() // 60)
+        with self._lock:
+            for row in [self.totals] + [self._row(dim, key) for dim, key in keys.items() if key]:
+                for name, value in delta.items():
+                    row[name] += value
+            if self._minutes and self._minutes[-1][0] == minute:
+                self._minutes[-1][1] += prompt + completion + embedding
+                self._minutes[-1][2] += cost
+            else:
+                self._minutes.append([minute, prompt + completion + embedding, cost])
+            self._dirty = True
+            due = self.path is not None and time.monotonic() - self._last_flush >= self.flush_s
+        if due:
+            self.flush()
+
+    def _row(self, dim: str, key: str) -> Dict[str, float]:
+        rows = self.by[dim]
+        if dim == "question":
+            key = question_key(key)
+            if key in rows:
+                rows.move_to_end(key)
+            elif len(rows) >= self.max_questions:
+                rows.popitem(last=False)
+        return rows.setdefault(key, _empty())
+
+    def _rates(self, minutes: int) -> Dict[str, float]:
+        now = int(time.time() // 60)
+        recent = [m for m in self._minutes if m[0] > now - minutes]
+        span = min(minutes, max(1.0, (time.time() - self._started) / 60))
+        return {
+            "tokens_per_min": round(sum(m[1] for m in recent) / span, 1),
+            "cost_usd_per_hour": round(sum(m[2] for m in recent) / span * 60, 4),
+        }
+
+    def snapshot(self, top: int = 20, questions: bool = False) -> Dict[str, Any]:
+        """Totales, tasas y dimensiones; ``top_questions`` (por hash) solo con ``questions``."""
+        def rounded(row: Dict[str, float]) -> Dict[str, float]:
+            return {**row, "cost_usd": round(row["cost_usd"], 6)}
+
+        with self._lock:
+            by = {
+                dim: {k: rounded(v) for k, v in rows.items()}
+                for dim, rows in self.by.items()
+                if dim != "question"
+            }
+            if questions:
+                top_rows = sorted(self.by["question"].items(), key=lambda kv: kv[1]["cost_usd"], reverse=True)[:top]
+                by["top_questions"] = {k: rounded(v) for k, v in top_rows}
+            return {
+                "totals": rounded(self.totals),
+                "uptime_s": round(time.time() - self._started, 1),
+                "rates": {"last_5_min": self._rates(5), "last_60_min": self._rates(60)},
+                "by": by,
+                "prices_per_1m": self.prices,
+            }
+
+    def flush(self) -> None:
+        """Vuelca los totales a ``path`` (escritura atómica); no hace nada si no hubo cambios."""
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps({"totals": self.totals, "by": self.by, "saved_at": time.time()}, ensure_ascii=False)
+            self._dirty = False
+            self._last_flush = time.monotonic()
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_suffix(".tmp")
+            tmp.write_text(data, encoding="utf-8")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"No se pudo guardar el uso en {self.path}: {e}")
+
+
+usage_tracker = UsageTracker(
+    path=os.getenv("RAG_USAGE_FILE", ".cache/usage.json") or None,
+    flush_s=float(os.getenv("RAG_USAGE_FLUSH_S", "30") or 30),
+    max_questions=int(os.getenv("RAG_USAGE_MAX_QUESTIONS", "500") or 500),
+)
+
+
+# =============================
+# Captura
+# =============================
+
+def _usage_from_result(response: LLMResult) -> Optional[Tuple[int, int, int]]:
+    """(prompt, prompt cacheado, completion) informados por el proveedor, si vienen."""
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    if usage.get("prompt_tokens") is not None:
+        cached = (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        return usage["prompt_tokens"], cached, usage.get("completion_tokens") or 0
+    for generations in response.generations:
+        for gen in generations:
+            meta = getattr(getattr(gen, "message", None), "usage_metadata", None)
+            if meta:
+                cached = (meta.get("input_token_details") or {}).get("cache_read") or 0
+                return meta.get("input_tokens", 0), cached, meta.get("output_tokens", 0)
+    return None
+
+
+class UsageCallback(BaseCallbackHandler):
+    """Registra en ``usage_tracker`` el uso de cada llamada a un modelo de chat."""
+
+    def __init__(self, tracker: UsageTracker):
+        self.tracker = tracker
+        # run_id -> (modelo, estimación diferida de los tokens de prompt): solo se
+        # tokeniza en on_llm_end si el proveedor no informó el uso
+        self._pending: Dict[UUID, Tuple[str, Callable[[], int]]] = {}
+
+    @staticmethod
+    def _model(serialized: Optional[Dict[str, Any]], kwargs: Dict[str, Any]) -> str:
+        params = kwargs.get("invocation_params") or {}
+        return (
+            params.get("model_name")
+            or params.get("model")
+            or ((serialized or {}).get("kwargs") or {}).get("model_name")
+            or params.get("_type")
+            or "unknown"
+        )
+
+    def on_chat_model_start(
+        self, serialized: Dict[str, Any], messages: List[List[BaseMessage]], *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        model = self._model(serialized, kwargs)
+        self._pending[run_id] = (model, lambda: sum(_message_tokens(m, model) for m in messages))
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID, **kwargs: Any) -> None:
+        model = self._model(serialized, kwargs)
+        self._pending[run_id] = (model, lambda: sum(count_tokens(p, model) for p in prompts))
+
+    def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs: Any) -> None:
+        model, prompt_estimate = self._pending.pop(run_id, ("unknown", lambda: 0))
+        model = (response.llm_output or {}).get("model_name") or model
+        usage = _usage_from_result(response)
+        if usage is not None:
+            self.tracker.record(model, *usage)
+            return
+        completion = sum(count_tokens(g.text, model) for gens in response.generations for g in gens)
+        self.tracker.record(model, prompt_estimate(), 0, completion, estimated=True)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._pending.pop(run_id, None)
+
+
+usage_callback = UsageCallback(usage_tracker)
+
+
+class MeteredEmbeddings(Embeddings):
+    """Envuelve un backend de embeddings y registra los tokens (estimados) de cada llamada."""
+
+    def __init__(self, inner: Embeddings, model: str, tracker: UsageTracker = usage_tracker):
+        self.inner = inner
+        self.model = model
+        self.tracker = tracker
+        self._count = token_counter(model)[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = self.inner.embed_documents(texts)
+        self.tracker.record(self.model, embedding=sum(self._count(t) for t in texts), estimated=True)
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.inner.embed_query(text)
+        self.tracker.record(self.model, embedding=self._count(text), estimated=True)
+        return vector
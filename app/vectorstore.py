@@ -0,0 +1,200 @@
+"""
+Utilidades compartidas de Qdrant para el servidor y los scripts de ingesta:
+aprovisionamiento de índices de payload, filtros por metadatos y búsqueda
+con scores.
+
+El vectorstore de LangChain guarda los metadatos de cada chunk anidados bajo
+la clave ``metadata`` del payload, por eso los índices y filtros usan rutas
+del tipo ``metadata.file_name``.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from langchain_community.vectorstores import Qdrant
+from langchain_core.documents import Document
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as rest
+from qdrant_client.local.qdrant_local import QdrantLocal
+
+METADATA_PAYLOAD_KEY = "metadata"
+
+# Modelo de embeddings con que se escribió cada punto (qdrant-client 1.12 no
+# tiene metadatos de colección, así que queda en el payload de los puntos)
+EMBEDDING_MODEL_FIELD = "embedding_model"
+
+# Campos de metadatos escritos por la ingesta que se pueden usar como filtro
+PAYLOAD_INDEXES: Dict[str, rest.PayloadSchemaType] = {
+    "file_name": rest.PayloadSchemaType.KEYWORD,
+    "doc_type": rest.PayloadSchemaType.KEYWORD,
+    "file_ext": rest.PayloadSchemaType.KEYWORD,
+    "page": rest.PayloadSchemaType.INTEGER,
+    EMBEDDING_MODEL_FIELD: rest.PayloadSchemaType.KEYWORD,
+}
+
+# ``doc_type`` por extensión: el mismo vocabulario en el script y en el servidor
+DOC_TYPES: Dict[str, str] = {
+    ".pdf": "pdf",
+    ".doc": "word",
+    ".docx": "word",
+    ".txt": "text",
+    ".md": "text",
+    ".rst": "text",
+}
+
+# Colecciones ya aprovisionadas en este proceso (evita round trips repetidos)
+_indexed_collections: Set[str] = set()
+
+
+def _payload_field(name: str) -> str:
+    return f"{METADATA_PAYLOAD_KEY}.{name}"
+
+
+def doc_type_for(file_name: str) -> str:
+    """``"pdf"``, ``"word"`` o ``"text"`` según la extensión (``"text"`` si no se conoce)."""
+    return DOC_TYPES.get(Path(file_name).suffix.lower(), "text")
+
+
+def _doc_type_values(doc_type: str) -> List[str]:
+    """
+    Valores de ``doc_type`` que cuentan como ``doc_type``: se acepta el tipo o
+    una extensión (``"docx"`` = ``"word"``), y se incluyen las extensiones
+    sueltas que guardaba la ingesta del servidor antes de unificar el vocabulario.
+    """
+    value = str(doc_type).lower().strip().lstrip(".")
+    kind = DOC_TYPES.get(f".{value}", value)
+    return list(dict.fromkeys([kind] + sorted(ext.lstrip(".") for ext, k in DOC_TYPES.items() if k == kind)))
+
+
+def ensure_payload_indexes(client: QdrantClient, collection: str) -> List[str]:
+    """Crea los índices de payload que falten en la colección y retorna los creados."""
+    if collection in _indexed_collections:
+        return []
+    if isinstance(getattr(client, "_client", None), QdrantLocal):
+        # Qdrant embebido (:memory: o path) ignora los índices y avisa en cada llamada
+        return []
+    info = client.get_collection(collection)
+    existing = set((info.payload_schema or {}).keys())
+    created = []
+    for name, schema in PAYLOAD_INDEXES.items():
+        field = _payload_field(name)
+        if field in existing:
+            continue
+        client.create_payload_index(
+            collection_name=collection,
+            field_name=field,
+            field_schema=schema,
+            wait=True,
+        )
+        created.append(field)
+    _indexed_collections.add(collection)
+    return created
+
+
+def ensure_collection(client: QdrantClient, collection: str, vector_size: int) -> bool:
+    """Crea la colección (distancia coseno) si no existe y aprovisiona sus índices.
+
+    Retorna True si la colección fue creada en esta llamada.
+    """
+    created = False
+    if not client.collection_exists(collection):
+        client.create_collection(
+            collection_name=collection,
+            vectors_config=rest.VectorParams(size=vector_size, distance=rest.Distance.COSINE),
+        )
+        created = True
+    ensure_payload_indexes(client, collection)
+    return created
+
+
+class EmbeddingModelMismatch(ValueError):
+    """La colección se indexó con otro modelo de embeddings que el pedido."""
+
+
+def indexed_embedding_model(client: QdrantClient, collection: str) -> Optional[str]:
+    """
+    Modelo de embeddings con que se indexó la colección, leído de un punto que
+    lo tenga registrado. None si la colección no existe, está vacía o se
+    indexó antes de que la ingesta lo registrara.
+    """
+    if not client.collection_exists(collection):
+        return None
+    points, _ = client.scroll(
+        collection_name=collection,
+        scroll_filter=rest.Filter(must_not=[
+            rest.IsEmptyCondition(is_empty=rest.PayloadField(key=_payload_field(EMBEDDING_MODEL_FIELD))),
+        ]),
+        limit=1,
+        with_payload=True,
+        with_vectors=False,
+    )
+    if not points:
+        return None
+    return ((points[0].payload or {}).get(METADATA_PAYLOAD_KEY) or {}).get(EMBEDDING_MODEL_FIELD)
+
+
+def check_embedding_model(client: QdrantClient, collection: str, model: str) -> Optional[str]:
+    """Lanza ``EmbeddingModelMismatch`` si la colección se indexó con otro modelo; retorna el registrado."""
+    indexed = indexed_embedding_model(client, collection)
+    if indexed is not None and indexed != model:
+        raise EmbeddingModelMismatch(
+            f"La colección '{collection}' se indexó con '{indexed}' y no se puede usar con '{model}'"
+        )
+    return indexed
+
+
+def build_metadata_filter(
+    file_names: Optional[Sequence[str]] = None,
+    doc_types: Optional[Sequence[str]] = None,
+    page_from: Optional[int] = None,
+    page_to: Optional[int] = None,
+) -> Optional[rest.Filter]:
+    """
+    Construye un filtro de Qdrant a partir de restricciones opcionales.
+
+    - file_names: coincidencia exacta con cualquiera de los valores
+    - doc_types: ``pdf``, ``word`` o ``text``, o una extensión (``docx`` = ``word``)
+    - page_from / page_to: rango inclusivo sobre ``page`` tal como se guardó
+      en la ingesta (base 0 para PDFs, igual que las citas de las respuestas).
+      Solo los PDFs tienen páginas: los chunks de txt/docx quedan fuera
+
+    Retorna None si no hay ninguna restricción.
+    """
+    must: List[rest.Condition] = []
+    if file_names:
+        must.append(rest.FieldCondition(
+            key=_payload_field("file_name"),
+            match=rest.MatchAny(any=[str(f) for f in file_names]),
+        ))
+    if doc_types:
+        must.append(rest.FieldCondition(
+            key=_payload_field("doc_type"),
+            match=rest.MatchAny(any=list(dict.fromkeys(v for t in doc_types for v in _doc_type_values(t)))),
+        ))
+    if page_from is not None or page_to is not None:
+        must.append(rest.FieldCondition(
+            key=_payload_field("page"),
+            range=rest.Range(gte=page_from, lte=page_to),
+        ))
+    if not must:
+        return None
+    return rest.Filter(must=must)
+
+
+def retrieve_with_scores(
+    vectorstore: Qdrant,
+    question: str,
+    search_type: str,
+    search_kwargs: Dict[str, Any],
+) -> List[Tuple[Document, float]]:
+    """Los mismos documentos que el retriever (similarity o mmr), con su score de Qdrant."""
+    kwargs = dict(search_kwargs)
+    k = kwargs.pop("k", 4)
+    if search_type == "mmr":
+        vector = vectorstore.embeddings.embed_query(question)
+        return vectorstore.max_marginal_relevance_search_with_score_by_vector(vector, k=k, **kwargs)
+    kwargs.pop("fetch_k", None)
+    kwargs.pop("lambda_mult", None)
+    return vectorstore.similarity_search_with_score(question, k=k, **kwargs)
@@ -0,0 +1,115 @@
+"""
+Benchmark de los extractores PDF de ``app.extractors`` (páginas/s y fidelidad).
+
+Uso:
+    python -m scripts.benchmark_extraction
+    python -m scripts.benchmark_extraction --workers 4 --report extraction.json
+"""
+
+import argparse
+import json
+import re
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List
+
+from app.extractors import available_extractors, extract_pdf_pages, get_extractor
+
+
+def _normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def _char_ngram_f1(reference: str, candidate: str, n: int = 3) -> float:
+    # Fidelidad de caracteres: F1 sobre trigramas de caracteres (lineal, tolera saltos de línea)
+    ref = Counter(reference[i:i + n] for i in range(max(0, len(reference) - n + 1)))
+    cand = Counter(candidate[i:i + n] for i in range(max(0, len(candidate) - n + 1)))
+    if not ref and not cand:
+        return 1.0
+    overlap = sum((ref & cand).values())
+    if not overlap:
+        return 0.0
+    precision = overlap / sum(cand.values())
+    recall = overlap / sum(ref.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def bench_file(path: Path, extractors: List[str], reference: str, repeat: int, workers: int) -> List[Dict[str, Any]]:
+    texts: Dict[str, str] = {}
+    rows = []
+    for name in extractors:
+        extractor = get_extractor(name)
+        best = float("inf")
+        pages: List[str] = []
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            pages = [text for _, text in extract_pdf_pages(path, extractor, workers=workers, min_pages=1)]
+            best = min(best, time.perf_counter() - t0)
+        texts[name] = _normalize("\n".join(pages))
+        rows.append({
+            "file": path.name,
+            "extractor": name,
+            "version": extractor.version,
+            "pages": len(pages),
+            "seconds": round(best, 4),
+            "pages_per_s": round(len(pages) / best, 1) if best > 0 else 0.0,
+            "chars": len(texts[name]),
+        })
+    ref_text = texts.get(reference, "")
+    for row in rows:
+        cand = texts[row["extractor"]]
+        row["char_ratio"] = round(len(cand) / len(ref_text), 3) if ref_text else None
+        row["fidelity_f1"] = round(_char_ngram_f1(ref_text, cand), 4) if ref_text else None
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark de extractores PDF: páginas/s y fidelidad de caracteres"
+    )
+    parser.add_argument("--data-dir", type=str, default="data")
+    parser.add_argument(
+        "--extractors",
+        type=str,
+        default=",".join(available_extractors()),
+        help="Extractores separados por coma (por defecto todos los instalados)",
+    )
+    parser.add_argument(
+        "--reference",
+        type=str,
+        default="pdfminer",
+        help="Extractor de referencia para medir fidelidad",
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones por medición (se toma la mejor)")
+    parser.add_argument("--workers", type=int, default=1, help="Procesos para extracción paralela por páginas")
+    parser.add_argument("--report", type=str, default=None, help="Ruta opcional para guardar el reporte JSON")
+    args = parser.parse_args()
+
+    extractors = [e.strip() for e in args.extractors.split(",") if e.strip()]
+    files = sorted(Path(args.data_dir).rglob("*.pdf"))
+    if not files:
+        raise SystemExit(f"No hay PDFs en {args.data_dir}")
+
+    rows: List[Dict[str, Any]] = []
+    for path in files:
+        rows.extend(bench_file(path, extractors, args.reference, args.repeat, args.workers))
+
+    header = f"{'archivo':40} {'extractor':10} {'págs':>5} {'seg':>8} {'págs/s':>8} {'chars':>8} {'ratio':>6} {'F1':>6}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['file'][:40]:40} {r['extractor']:10} {r['pages']:>5} {r['seconds']:>8} "
+            f"{r['pages_per_s']:>8} {r['chars']:>8} {str(r['char_ratio']):>6} {str(r['fidelity_f1']):>6}"
+        )
+
+    if args.report:
+        report = {"reference": args.reference, "workers": args.workers, "results": rows}
+        Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""
+Benchmark de ingesta y chunking: tiempos por etapa, chunks/s, memoria y recall.
+
+Uso:
+    python -m scripts.benchmark_ingest
+    python -m scripts.benchmark_ingest --chunkers recursive,semantic --chunk-sizes 800,1000
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from qdrant_client import QdrantClient
+
+from app.chunking import SemanticChunker
+from app.embeddings import HashingEmbeddings
+from app.ingestion import load_pages, split_pages, stream_to_qdrant
+from app.retrieval_eval import evaluate_retrieval, load_jsonl, qdrant_search
+from scripts.ingest_qdrant import _collect_files, _enrich_chunks
+
+# Métricas comparadas contra --baseline: (clave, True si mayor es mejor)
+_TRACKED = [("chunks_per_s", True), ("recall_at_k", True), ("mrr", True), ("peak_mem_mb", False)]
+
+
+def _csv(value: str, cast=str) -> List[Any]:
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def _scaled_corpus(files: List[Path], scale: int, workdir: Path) -> List[Path]:
+    """Copias sintéticas del corpus: ``scale`` réplicas en subdirectorios (mismo nombre de archivo)."""
+    if scale <= 1:
+        return files
+    copies = []
+    for i in range(scale):
+        target = workdir / f"scale{scale}" / f"copia_{i:03d}"
+        target.mkdir(parents=True, exist_ok=True)
+        for f in files:
+            dst = target / f.name
+            if not dst.exists():
+                shutil.copy2(f, dst)
+            copies.append(dst)
+    return copies
+
+
+def _timed_pages(files: List[Path], use_cache: bool, timings: Dict[str, float]) -> Iterator[Document]:
+    # Acumula solo el tiempo de carga/extracción (lo que se gasta dentro de next())
+    for file_path in files:
+        pages = load_pages(file_path, use_cache=use_cache)
+        while True:
+            t0 = time.perf_counter()
+            page = next(pages, None)
+            timings["load_s"] += time.perf_counter() - t0
+            if page is None:
+                break
+            yield page
+
+
+def _measured(chunks: Iterable[Document], sizes: Dict[str, int]) -> Iterator[Document]:
+    for d in chunks:
+        sizes["chars"] += len(d.page_content)
+        sizes["payload_bytes"] += len(
+            json.dumps({"page_content": d.page_content, "metadata": d.metadata}, ensure_ascii=False).encode("utf-8")
+        )
+        yield d
+
+
+def _make_splitter(chunker: str, chunk_size: int, chunk_overlap: int, embeddings, threshold_type: str):
+    if chunker == "semantic":
+        return SemanticChunker(embeddings, breakpoint_threshold_type=threshold_type)
+    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def _ingest(
+    config: Dict[str, Any],
+    files: List[Path],
+    client: QdrantClient,
+    collection: str,
+    embeddings: HashingEmbeddings,
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    splitter = _make_splitter(
+        config["chunker"], config["chunk_size"], config["chunk_overlap"], embeddings, args.semantic_threshold_type
+    )
+    timings = {"load_s": 0.0}
+    sizes = {"chars": 0, "payload_bytes": 0}
+    chunks = _measured(_enrich_chunks(split_pages(_timed_pages(files, args.use_cache, timings), splitter)), sizes)
+    stats = stream_to_qdrant(
+        chunks, client, collection, embeddings, batch_size=args.batch_size, queue_size=args.queue_size
+    )
+    return {**stats, **timings, **sizes}
+
+
+def _peak_traced_mb(*ingest_args: Any) -> float:
+    # Pasada aparte: tracemalloc multiplica los tiempos de parseo y falsearía las mediciones
+    tracemalloc.start()
+    try:
+        _ingest(*ingest_args)
+        return round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+    finally:
+        tracemalloc.stop()
+
+
+def _drop(client: QdrantClient, collection: str) -> None:
+    if client.collection_exists(collection):
+        client.delete_collection(collection)
+
+
+def run_config(
+    config: Dict[str, Any],
+    files: List[Path],
+    client: QdrantClient,
+    collection: str,
+    embeddings: HashingEmbeddings,
+    questions: List[Dict[str, Any]],
+    args: argparse.Namespace,
+) -> Dict[str, Any]:
+    peak_mb = None
+    if not args.no_memory:
+        try:
+            peak_mb = _peak_traced_mb(config, files, client, collection, embeddings, args)
+        finally:
+            _drop(client, collection)
+    try:
+        stats = _ingest(config, files, client, collection, embeddings, args)
+        retrieval = evaluate_retrieval(
+            qdrant_search(client, collection, embeddings), questions, {f.name for f in files}, k=args.k
+        )
+    finally:
+        _drop(client, collection)
+
+    n = stats["chunks"]
+    return {
+        **config,
+        "files": len(files),
+        "chunks": n,
+        "avg_chunk_chars": round(stats["chars"] / n, 1) if n else 0.0,
+        "elapsed_s": stats["elapsed_s"],
+        "chunks_per_s": stats["chunks_per_s"],
+        "first_upsert_s": stats["first_upsert_s"],
+        "load_s": round(stats["load_s"], 3),
+        # El hilo de carga mide carga+split juntos; el split es la diferencia
+        "split_s": round(max(0.0, stats["load_split_s"] - stats["load_s"]), 3),
+        "embed_s": stats["embed_s"],
+        "upsert_s": stats["upsert_s"],
+        "vector_bytes": n * (stats["vector_size"] or 0) * 4,
+        "payload_bytes": stats["payload_bytes"],
+        "peak_mem_mb": peak_mb,
+        "recall_at_k": retrieval["recall_at_k"],
+        "mrr": retrieval["mrr"],
+        "questions": retrieval["questions"],
+    }
+
+
+def _config_key(row: Dict[str, Any]) -> tuple:
+    return (row["chunker"], row["chunk_size"], row["chunk_overlap"], row["scale"])
+
+
+def compare(rows: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Regresiones respecto a un reporte anterior para las mismas configuraciones."""
+    previous = {_config_key(r): r for r in baseline.get("results", [])}
+    regressions = []
+    for row in rows:
+        old = previous.get(_config_key(row))
+        if not old:
+            continue
+        for metric, higher_is_better in _TRACKED:
+            before, after = old.get(metric), row.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            if (change < -tolerance) if higher_is_better else (change > tolerance):
+                regressions.append({
+                    "config": dict(zip(("chunker", "chunk_size", "chunk_overlap", "scale"), _config_key(row))),
+                    "metric": metric,
+                    "before": before,
+                    "after": after,
+                    "change": round(change, 3),
+                })
+    return regressions
+
+
+def peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB, macOS bytes
+    return round(rss / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark de ingesta y chunking: tiempos por etapa, chunks/s, memoria y recall"
+    )
+    parser.add_argument("--data-dir", type=str, default="data")
+    parser.add_argument("--patterns", type=str, default="*.pdf,*.txt,*.docx")
+    parser.add_argument("--chunkers", type=str, default="recursive,semantic")
+    parser.add_argument("--chunk-sizes", type=str, default="500,1000", help="Solo aplica al chunker recursive")
+    parser.add_argument("--chunk-overlaps", type=str, default="50,150", help="Solo aplica al chunker recursive")
+    parser.add_argument("--semantic-threshold-type", type=str, default="percentile")
+    parser.add_argument(
+        "--scales",
+        type=str,
+        default="1",
+        help="Réplicas sintéticas del corpus (e.g. '1,10,50'); al ser idénticas, con escala > 1 "
+        "los chunks duplicados llenan el top-k y el recall baja",
+    )
+    parser.add_argument("--embedding-size", type=int, default=256, help="Dimensión de los embeddings de hashing")
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--queue-size", type=int, default=4)
+    parser.add_argument("--k", type=int, default=4, help="Top-k para recall/MRR")
+    parser.add_argument("--questions", type=str, default="eval/answerable.jsonl")
+    parser.add_argument(
+        "--qdrant-path",
+        type=str,
+        default=":memory:",
+        help="Qdrant local: ':memory:' o un directorio para modo embebido en disco",
+    )
+    parser.add_argument("--use-cache", action="store_true", help="Usar la caché de texto extraído")
+    parser.add_argument(
+        "--no-memory",
+        action="store_true",
+        help="Omitir la pasada con tracemalloc que mide la memoria pico (la duración se reduce a la mitad)",
+    )
+    parser.add_argument("--report", type=str, default=None, help="Ruta opcional para guardar el reporte JSON")
+    parser.add_argument("--baseline", type=str, default=None, help="Reporte anterior para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Variación relativa tolerada vs --baseline")
+    args = parser.parse_args()
+
+    files = _collect_files(Path(args.data_dir), _csv(args.patterns))
+    if not files:
+        raise SystemExit(f"No hay documentos en {args.data_dir}")
+    questions = load_jsonl(Path(args.questions)) if Path(args.questions).exists() else []
+
+    configs: List[Dict[str, Any]] = []
+    for scale, chunker in itertools.product(_csv(args.scales, int), _csv(args.chunkers)):
+        if chunker == "semantic":
+            # El chunker semántico no usa tamaño ni solapamiento
+            configs.append({"chunker": chunker, "chunk_size": None, "chunk_overlap": None, "scale": scale})
+            continue
+        for size, overlap in itertools.product(_csv(args.chunk_sizes, int), _csv(args.chunk_overlaps, int)):
+            if overlap < size:
+                configs.append({"chunker": chunker, "chunk_size": size, "chunk_overlap": overlap, "scale": scale})
+
+    embeddings = HashingEmbeddings(args.embedding_size)
+    client = QdrantClient(":memory:") if args.qdrant_path == ":memory:" else QdrantClient(path=args.qdrant_path)
+    workdir = Path(tempfile.mkdtemp(prefix="rag_bench_"))
+    rows: List[Dict[str, Any]] = []
+    try:
+        for i, config in enumerate(configs):
+            corpus = _scaled_corpus(files, config["scale"], workdir)
+            rows.append(run_config(config, corpus, client, f"bench_{i}", embeddings, questions, args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    header = (
+        f"{'chunker':9} {'size':>5} {'ovl':>4} {'x':>3} {'chunks':>7} {'chunks/s':>9} {'load':>6} "
+        f"{'split':>6} {'embed':>6} {'upsert':>6} {'vec MB':>7} {'mem MB':>7} {'R@k':>5} {'MRR':>5}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(
+            f"{r['chunker']:9} {str(r['chunk_size'] or '-'):>5} {str(r['chunk_overlap'] or '-'):>4} "
+            f"{r['scale']:>3} {r['chunks']:>7} {r['chunks_per_s']:>9} {r['load_s']:>6} {r['split_s']:>6} "
+            f"{r['embed_s']:>6} {r['upsert_s']:>6} {r['vector_bytes'] / 1024 / 1024:>7.2f} "
+            f"{str(r['peak_mem_mb']):>7} {str(r['recall_at_k']):>5} {str(r['mrr']):>5}"
+        )
+
+    report: Dict[str, Any] = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "embedding": f"hashing-{args.embedding_size}",
+        "k": args.k,
+        "peak_rss_mb": peak_rss_mb(),
+        "results": rows,
+    }
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report["regressions"] = compare(rows, json.load(f), args.tolerance)
+        for reg in report["regressions"]:
+            print(f"[Regresión] {reg['config']} {reg['metric']}: {reg['before']} → {reg['after']} ({reg['change']:+.1%})")
+        if not report["regressions"]:
+            print(f"Sin regresiones respecto a {args.baseline} (tolerancia {args.tolerance:.0%})")
+
+    if args.report:
+        Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Benchmark offline de /rag/query, /ingest/upload y /stats (sin OpenAI ni Qdrant Cloud).
+
+Uso:
+    python -m scripts.benchmark_server
+    python -m scripts.benchmark_server --concurrency 8 --requests 200
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List
+
+import httpx
+
+from app.eval_store import latency_summary
+from scripts.benchmark_ingest import peak_rss_mb
+from scripts.evaluate_rag import load_jsonl
+
+
+def configure_offline(args: argparse.Namespace) -> None:
+    # Debe correr antes de importar app.server: la cadena RAG se arma al importar
+    os.environ["RAG_BACKEND"] = "offline"
+    os.environ["QDRANT_PATH"] = args.qdrant_path
+    os.environ["QDRANT_COLLECTION"] = args.collection
+    os.environ["RAG_FAKE_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["RAG_FAKE_LLM_TOKENS_PER_S"] = str(args.tokens_per_s)
+    os.environ["RAG_FAKE_LLM_TOKENS"] = str(args.tokens)
+    os.environ["RAG_FAKE_EMBED_SIZE"] = str(args.embedding_size)
+    if not args.use_cache:
+        os.environ["RAG_EXTRACTION_CACHE"] = "0"
+    # Todo el tráfico sale de una misma "IP": sin rate limit salvo que ya esté configurado
+    os.environ.setdefault("RAG_RATE_LIMIT", "0")
+
+
+async def _measure(
+    request: Callable[[int], Awaitable[httpx.Response]],
+    total: int,
+    concurrency: int,
+) -> Dict[str, Any]:
+    sem = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def one(i: int) -> None:
+        async with sem:
+            t0 = time.perf_counter()
+            try:
+                r = await request(i)
+                status = str(r.status_code)
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            latency = time.perf_counter() - t0
+        if status == "200":
+            latencies.append(latency)
+        else:
+            errors[status] = errors.get(status, 0) + 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    wall = time.perf_counter() - t0
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall > 0 else 0.0,
+        "latency_s": latency_summary(latencies),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _with_scaling(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    # Eficiencia = throughput(c) / (c * throughput(c=1)); 1.0 es escalado lineal
+    base = next((r for r in rows if r["concurrency"] == 1), None)
+    for r in rows:
+        if base and base["throughput_rps"]:
+            r["scaling_efficiency"] = round(r["throughput_rps"] / (base["throughput_rps"] * r["concurrency"]), 3)
+    return rows
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout)
+    else:
+        configure_offline(args)
+        from app.server import app
+
+        # En proceso (ASGI): mide solo el framework, sin red ni servidor HTTP
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://benchmark", timeout=args.timeout
+        )
+
+    files = sorted(p for p in Path(args.data_dir).iterdir() if p.is_file() and not p.name.startswith("."))
+    uploads = [(p.name, p.read_bytes()) for p in files] * max(1, args.upload_repeat)
+    questions = [r["question"] for path in args.questions for r in load_jsonl(Path(path))]
+    if not questions:
+        raise SystemExit("No hay preguntas para /rag/query")
+    levels = sorted({int(c) for c in args.concurrency.split(",") if c.strip()})
+
+    def upload(i: int) -> Awaitable[httpx.Response]:
+        name, content = uploads[i]
+        return client.post(
+            "/ingest/upload",
+            files={"file": (name, content)},
+            data={"chunker_type": "recursive", "chunk_size": str(args.chunk_size), "chunk_overlap": "150"},
+        )
+
+    def query(i: int) -> Awaitable[httpx.Response]:
+        return client.post("/rag/query", json={"question": questions[i % len(questions)]})
+
+    def stats(i: int) -> Awaitable[httpx.Response]:
+        return client.get("/stats")
+
+    if args.trace_memory:
+        tracemalloc.start()
+    report: Dict[str, Any] = {}
+    try:
+        report["ingest_upload"] = await _measure(upload, len(uploads), args.upload_concurrency)
+        # Calentamiento: primeras llamadas (imports perezosos, cachés, conexiones) fuera de la medición
+        await _measure(query, args.warmup, 1)
+        report["rag_query"] = _with_scaling([await _measure(query, args.requests, c) for c in levels])
+        report["stats"] = _with_scaling([await _measure(stats, args.stats_requests, c) for c in levels])
+    finally:
+        await client.aclose()
+        if tracemalloc.is_tracing():
+            report["traced_peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+            tracemalloc.stop()
+
+    # Piso impuesto por el LLM falso; lo que exceda es overhead propio (retrieval, cadena, HTTP)
+    llm_floor = args.llm_latency_ms / 1000 + (args.tokens / args.tokens_per_s if args.tokens_per_s > 0 else 0.0)
+    for row in report["rag_query"]:
+        p50 = row["latency_s"]["p50"]
+        row["overhead_p50_s"] = round(p50 - llm_floor, 4) if p50 is not None else None
+    report["llm_floor_s"] = round(llm_floor, 4)
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmark offline de /rag/query, /ingest/upload y /stats (sin OpenAI ni Qdrant Cloud)"
+    )
+    parser.add_argument(
+        "--url",
+        type=str,
+        default=None,
+        help="Servidor ya levantado (con RAG_BACKEND=offline); por defecto la app se carga en proceso",
+    )
+    parser.add_argument("--data-dir", type=str, default="data")
+    parser.add_argument("--questions", type=str, nargs="+", default=["eval/answerable.jsonl", "eval/unanswerable.jsonl"])
+    parser.add_argument("--concurrency", type=str, default="1,4,16", help="Niveles de concurrencia a medir")
+    parser.add_argument("--requests", type=int, default=64, help="Requests a /rag/query por nivel")
+    parser.add_argument("--stats-requests", type=int, default=16, help="Requests a /stats por nivel")
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--upload-repeat", type=int, default=1, help="Veces que se sube cada archivo de --data-dir")
+    parser.add_argument("--upload-concurrency", type=int, default=1)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="Latencia al primer token del LLM falso")
+    parser.add_argument("--tokens-per-s", type=float, default=0.0, help="Velocidad del LLM falso (0 = instantáneo)")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens por respuesta del LLM falso")
+    parser.add_argument("--embedding-size", type=int, default=256)
+    parser.add_argument("--qdrant-path", type=str, default=":memory:", help="':memory:' o directorio de Qdrant local")
+    parser.add_argument("--collection", type=str, default="rag_benchmark")
+    parser.add_argument("--use-cache", action="store_true", help="Usar la caché de texto extraído")
+    parser.add_argument("--trace-memory", action="store_true", help="Medir memoria pico con tracemalloc (más lento)")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--report", type=str, default=None, help="Ruta opcional para guardar el reporte JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    print(f"Piso del LLM falso: {results['llm_floor_s']}s por respuesta")
+    up = results["ingest_upload"]
+    print(
+        f"/ingest/upload: {up['requests']} archivos, p50 {up['latency_s']['p50']}s, "
+        f"{up['throughput_rps']} req/s, errores {up['errors'] or 0}"
+    )
+    header = f"{'endpoint':12} {'conc':>5} {'req/s':>8} {'p50':>7} {'p90':>7} {'p99':>7} {'efic.':>6} {'overhead':>9} {'RSS MB':>7}"
+    print(header)
+    print("-" * len(header))
+    for name, rows in (("/rag/query", results["rag_query"]), ("/stats", results["stats"])):
+        for r in rows:
+            lat = r["latency_s"]
+            print(
+                f"{name:12} {r['concurrency']:>5} {r['throughput_rps']:>8} {str(lat['p50']):>7} "
+                f"{str(lat['p90']):>7} {str(lat['p99']):>7} {str(r.get('scaling_efficiency', '-')):>6} "
+                f"{str(r.get('overhead_p50_s', '-')):>9} {str(r['peak_rss_mb']):>7}"
+            )
+            if r["errors"]:
+                print(f"{'':12} errores: {r['errors']}")
+
+    if args.report:
+        report = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mode": "http" if args.url else "asgi",
+            "settings": {k: v for k, v in vars(args).items() if k != "report"},
+            **results,
+        }
+        Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
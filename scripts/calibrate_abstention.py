@@ -0,0 +1,163 @@
+"""
+Calibra ``RAG_ABSTAIN_THRESHOLD`` (abstención por score, ver ``app.abstention``).
+
+Embebe las preguntas de los sets answerable/unanswerable, toma el mejor score
+de Qdrant de cada una (el mismo que mira el atajo del servidor) y barre los
+umbrales posibles (puntos medios entre scores consecutivos). Elige el que más
+preguntas sin respuesta corta sin pasar ``--max-false-abstention`` de
+abstenciones indebidas sobre el set answerable.
+
+Informa cuántas llamadas al LLM se evitan sobre el set de evaluación y los
+segundos ahorrados, con ``--llm-latency`` o la latencia media de la última
+corrida ``answers`` del historial (``app.eval_store``).
+
+Uso:
+    python -m scripts.calibrate_abstention
+    python -m scripts.calibrate_abstention --max-false-abstention 0.05
+"""
+
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.backends import get_qdrant_client, qdrant_collection, qdrant_configured
+from app.embeddings import get_embeddings
+from app.eval_store import get_eval_store, percentile
+from app.retrieval_eval import load_jsonl, search_points
+
+
+def best_scores(questions: List[str], embed_model: Optional[str] = None) -> List[float]:
+    """Mejor score de Qdrant por pregunta (-1 si la colección no devuelve nada)."""
+    client = get_qdrant_client()
+    collection = qdrant_collection()
+    vectors = get_embeddings(embed_model).embed_documents(questions)
+    scores = []
+    for vector in vectors:
+        hits = search_points(client, collection, vector, 1, with_payload=False)
+        scores.append(float(hits[0].score) if hits else -1.0)
+    return scores
+
+
+def distribution(scores: List[float]) -> Dict[str, float]:
+    return {
+        "min": round(min(scores), 4),
+        "p10": round(percentile(scores, 10), 4),
+        "p50": round(percentile(scores, 50), 4),
+        "p90": round(percentile(scores, 90), 4),
+        "max": round(max(scores), 4),
+    }
+
+
+def sweep(answerable: List[float], unanswerable: List[float]) -> List[Dict[str, Any]]:
+    """Abstenciones correctas e indebidas para cada umbral candidato."""
+    values = sorted(set(answerable) | set(unanswerable))
+    # Por debajo de todo (atajo apagado en la práctica) y entre cada par de scores
+    candidates = [values[0] - 1e-3] + [(a + b) / 2 for a, b in zip(values, values[1:])] + [values[-1] + 1e-3]
+    rows = []
+    for threshold in candidates:
+        caught = sum(1 for s in unanswerable if s < threshold)
+        false = sum(1 for s in answerable if s < threshold)
+        rows.append({
+            "threshold": round(threshold, 4),
+            "unanswerable_abstained": caught,
+            "answerable_abstained": false,
+            "unanswerable_abstention_rate": round(caught / max(1, len(unanswerable)), 3),
+            "false_abstention_rate": round(false / max(1, len(answerable)), 3),
+        })
+    return rows
+
+
+def choose(rows: List[Dict[str, Any]], max_false_abstention: float) -> Dict[str, Any]:
+    """Más abstenciones correctas dentro del límite; a igualdad, menos indebidas y umbral más bajo."""
+    allowed = [r for r in rows if r["false_abstention_rate"] <= max_false_abstention]
+    return max(allowed, key=lambda r: (r["unanswerable_abstained"], -r["answerable_abstained"], -r["threshold"]))
+
+
+def _llm_latency(value: Optional[float], db: Optional[str]) -> Optional[float]:
+    if value is not None:
+        return value
+    run = get_eval_store(db).latest_run("answers")
+    if run:
+        return (run["summary"].get("latency_s") or {}).get("mean")
+    return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Calibración del umbral de abstención por score de recuperación")
+    parser.add_argument("--answerable", type=str, default="eval/answerable.jsonl")
+    parser.add_argument("--unanswerable", type=str, default="eval/unanswerable.jsonl")
+    parser.add_argument("--max-false-abstention", type=float, default=0.0,
+                        help="Fracción tolerada de preguntas answerable que se abstendrían")
+    parser.add_argument("--llm-latency", type=float, default=None,
+                        help="Segundos por llamada al LLM; por defecto la media de la última corrida 'answers'")
+    parser.add_argument("--embedding-model", type=str, default=None,
+                        help="Debe ser el mismo modelo con que se indexó la colección")
+    parser.add_argument("--db", type=str, default=None, help="Historial SQLite (por defecto RAG_EVAL_DB o eval/runs.sqlite3)")
+    parser.add_argument("--report", type=str, default="eval/report_abstention.json")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if not qdrant_configured():
+        raise SystemExit("Faltan QDRANT_URL/QDRANT_API_KEY/QDRANT_COLLECTION (o QDRANT_PATH) en el entorno")
+
+    answerable = [r["question"] for r in load_jsonl(Path(args.answerable))]
+    unanswerable = [r["question"] for r in load_jsonl(Path(args.unanswerable))]
+    if not answerable or not unanswerable:
+        raise SystemExit("Se necesitan preguntas en ambos sets para calibrar")
+
+    t0 = time.perf_counter()
+    scores = best_scores(answerable + unanswerable, args.embedding_model)
+    lookup_s = (time.perf_counter() - t0) / len(scores)
+    ans_scores, uans_scores = scores[: len(answerable)], scores[len(answerable):]
+
+    rows = sweep(ans_scores, uans_scores)
+    chosen = choose(rows, args.max_false_abstention)
+    saved_calls = chosen["unanswerable_abstained"] + chosen["answerable_abstained"]
+    llm_latency = _llm_latency(args.llm_latency, args.db)
+    total = len(scores)
+
+    report = {
+        "collection": qdrant_collection(),
+        "max_false_abstention": args.max_false_abstention,
+        "threshold": chosen["threshold"],
+        "chosen": chosen,
+        "answerable_scores": distribution(ans_scores),
+        "unanswerable_scores": distribution(uans_scores),
+        "score_lookup_s": round(lookup_s, 4),
+        "llm_latency_s": llm_latency,
+        "llm_calls_saved": saved_calls,
+        "llm_calls_saved_rate": round(saved_calls / total, 3),
+        "seconds_saved": round(saved_calls * llm_latency, 3) if llm_latency is not None else None,
+        "sweep": rows,
+        "per_question": [
+            {"set": s, "question": q, "best_score": round(score, 4)}
+            for s, q, score in zip(
+                ["answerable"] * len(answerable) + ["unanswerable"] * len(unanswerable),
+                answerable + unanswerable,
+                scores,
+            )
+        ],
+    }
+
+    path = Path(args.report)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for name in ("answerable", "unanswerable"):
+        d = report[f"{name}_scores"]
+        print(f"Mejor score {name:<12} min {d['min']}  p50 {d['p50']}  max {d['max']}")
+    print(f"Umbral: {chosen['threshold']} -> abstiene {chosen['unanswerable_abstained']}/{len(unanswerable)} "
+          f"unanswerable y {chosen['answerable_abstained']}/{len(answerable)} answerable")
+    saved = f", ~{report['seconds_saved']}s de LLM" if report["seconds_saved"] is not None else ""
+    print(f"Llamadas al LLM evitadas en el set: {saved_calls}/{total}{saved}")
+    print(f"Reporte en {path}")
+    print(f"RAG_ABSTAIN_THRESHOLD={chosen['threshold']}")
+
+
+if __name__ == "__main__":
+    main()
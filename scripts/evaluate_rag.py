@@ -1,12 +1,34 @@
+"""
+Evaluación del RAG: respuestas completas vía HTTP o solo recuperación.
+
+Uso:
+    python -m scripts.evaluate_rag
+    python -m scripts.evaluate_rag --mode retrieval
+"""
+
 import argparse
+import asyncio
 import json
 import os
 import time
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, Dict, List, Optional, Tuple
 
+import httpx
 from dotenv import load_dotenv
 
+from app.embeddings import get_embeddings
+from app.eval_scoring import score_results
+from app.eval_store import (
+    EvalStore,
+    answer_passed,
+    answers_summary,
+    find_regressions,
+    get_eval_store,
+    latency_summary,
+)
+from app.rag_prompt import abstention_phrase
+
 
 def load_jsonl(path: Path) -> List[Dict[str, Any]]:
     rows = []
@@ -19,74 +41,397 @@ def load_jsonl(path: Path) -> List[Dict[str, Any]]:
     return rows
 
 
-def eval_local(answerable_path: Path, unanswerable_path: Path) -> Dict[str, Any]:
-    # Evaluación local directamente contra la cadena remota de langserve vía HTTP s
-    # (más simple que importar server internamente; evita conflictos de entornos) OK
-    import httpx
-
-    base = os.getenv("RAG_BASE_URL", "http://localhost:8000")
-    invoke_url = base.rstrip("/") + "/rag/invoke"
-
-    ans = load_jsonl(answerable_path)
-    uans = load_jsonl(unanswerable_path)
-
-    def ask(q: str) -> str:
-        t0 = time.time()
-        with httpx.Client(timeout=60) as client:
-            r = client.post(invoke_url, json={"input": {"question": q}})
-            r.raise_for_status()
-            data = r.json()
-        latency = time.time() - t0
-        return data.get("output", ""), latency
-
-    total_lat = 0.0
-    # Métricas answerable: conteo de respuestas no vacías
-    ans_ok = 0
-    for row in ans:
-        out, lat = ask(row["question"])
-        total_lat += lat
-        if out and out.strip():
-            ans_ok += 1
-
-    # Métricas unanswerable: abstención correcta
-    abst_phrase = os.getenv("RAG_ABSTENTION_TEXT", "No tengo información suficiente").lower()
-    uans_ok = 0
-    for row in uans:
-        out, lat = ask(row["question"])
-        total_lat += lat
-        if abst_phrase in (out or "").lower():
-            uans_ok += 1
-
-    n = len(ans) + len(uans)
-    avg_lat = total_lat / max(1, n)
+class RAGClient:
+    """
+    Cliente HTTP reutilizable (pool de conexiones keep-alive) para el endpoint RAG.
+
+    Acepta ``/rag/query`` (``{"question"}`` → ``{"response"}``) y rutas estilo
+    LangServe terminadas en ``/invoke`` (``{"input": {...}}`` → ``{"output"}``).
+    """
+
+    def __init__(self, base_url: str, endpoint: str, concurrency: int, timeout: float):
+        self.endpoint = endpoint
+        self._langserve = endpoint.rstrip("/").endswith("/invoke")
+        self.client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        )
+
+    async def ask(self, question: str) -> Tuple[str, float]:
+        payload = {"input": {"question": question}} if self._langserve else {"question": question}
+        t0 = time.perf_counter()
+        r = await self.client.post(self.endpoint, json=payload)
+        latency = time.perf_counter() - t0
+        r.raise_for_status()
+        data = r.json()
+        out = data.get("output", "") if self._langserve else data.get("response", "")
+        return out if isinstance(out, str) else json.dumps(out, ensure_ascii=False), latency
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+async def _run(
+    client: RAGClient,
+    items: List[Dict[str, Any]],
+    concurrency: int,
+    abst_phrase: str,
+) -> List[Dict[str, Any]]:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(item: Dict[str, Any]) -> Dict[str, Any]:
+        result = {"set": item["set"], "question": item["question"], "expected": item.get("expected", "")}
+        async with sem:
+            try:
+                out, latency = await client.ask(item["question"])
+            except httpx.HTTPStatusError as e:
+                return {**result, "ok": False, "status": e.response.status_code, "error": e.response.text[:200]}
+            except httpx.HTTPError as e:
+                return {**result, "ok": False, "status": None, "error": f"{type(e).__name__}: {e}"}
+        return {
+            **result,
+            "ok": True,
+            "status": 200,
+            "latency_s": round(latency, 3),
+            "response": out,
+            "response_chars": len(out or ""),
+            "passed": answer_passed(item["set"], out, abst_phrase),
+        }
+
+    return await asyncio.gather(*(one(item) for item in items))
+
+
+async def eval_remote(
+    answerable: List[Dict[str, Any]],
+    unanswerable: List[Dict[str, Any]],
+    base_url: str,
+    endpoint: str,
+    concurrency: int = 4,
+    warmup: int = 2,
+    timeout: float = 60.0,
+) -> Dict[str, Any]:
+    """Evalúa todas las preguntas en paralelo (``concurrency`` en vuelo) sobre un único cliente."""
+    abst_phrase = abstention_phrase()
+    items = [{"set": "answerable", **r} for r in answerable] + [{"set": "unanswerable", **r} for r in unanswerable]
+    client = RAGClient(base_url, endpoint, concurrency, timeout)
+    try:
+        # Calentamiento: abre conexiones y llena cachés; no entra en las métricas
+        if warmup and items:
+            await _run(client, items[:warmup], min(concurrency, warmup), abst_phrase)
+        t0 = time.perf_counter()
+        results = await _run(client, items, concurrency, abst_phrase)
+        wall = time.perf_counter() - t0
+    finally:
+        await client.aclose()
+
     return {
-        "answerable_count": len(ans),
-        "answerable_nonempty": ans_ok,
-        "answerable_rate": round(ans_ok / max(1, len(ans)), 3),
-        "unanswerable_count": len(uans),
-        "unanswerable_abstentions": uans_ok,
-        "unanswerable_abstention_rate": round(uans_ok / max(1, len(uans)), 3),
-        "avg_latency_s": round(avg_lat, 3),
+        **answers_summary(results, wall),
+        "concurrency": concurrency,
+        "warmup": warmup,
+        "endpoint": endpoint,
+        "per_question": results,
     }
 
 
+def _scoring_embeddings(model: Optional[str]) -> Optional[Any]:
+    try:
+        return get_embeddings(model)
+    except Exception as e:
+        print(f"[Aviso] Sin embeddings para similitud semántica ({type(e).__name__}: {e}); solo métricas léxicas")
+        return None
+
+
+def _csv(value: str, cast=str) -> List[Any]:
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def retrieval_settings(search_types: str, top_ks: str, fetch_ks: str) -> List[Dict[str, Any]]:
+    """Combinaciones a evaluar; ``fetch_k`` solo aplica a mmr."""
+    settings = []
+    for search_type in _csv(search_types):
+        for k in _csv(top_ks, int):
+            for fetch_k in (_csv(fetch_ks, int) if search_type == "mmr" else [None]):
+                settings.append({"search_type": search_type, "top_k": k, "fetch_k": fetch_k})
+    return settings
+
+
+def eval_retrieval(
+    answerable: List[Dict[str, Any]],
+    settings: List[Dict[str, Any]],
+    mmr_lambda: float = 0.5,
+    embed_model: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Evalúa solo el retriever (sin LLM) contra la colección configurada.
+
+    Cada pregunta se embebe una vez (latencia de embedding) y se busca con
+    cada combinación search_type/top_k/fetch_k (latencia de búsqueda).
+    """
+    from app.backends import get_qdrant_client, qdrant_collection, qdrant_configured
+    from app.retrieval_eval import collection_file_names, evaluate_retrieval, expected_source, search_file_names
+
+    if not qdrant_configured():
+        raise SystemExit("Faltan QDRANT_URL/QDRANT_API_KEY/QDRANT_COLLECTION (o QDRANT_PATH) en el entorno")
+    client = get_qdrant_client()
+    collection = qdrant_collection()
+    embeddings = get_embeddings(embed_model)
+    corpus_names = collection_file_names(client, collection)
+    rows = [r for r in answerable if expected_source(r)]
+
+    vectors: Dict[str, List[float]] = {}
+    embed_latencies: List[float] = []
+    for row in rows:
+        t0 = time.perf_counter()
+        vectors[row["question"]] = embeddings.embed_query(row["question"])
+        embed_latencies.append(time.perf_counter() - t0)
+
+    results = []
+    for setting in settings:
+        search_latencies: List[float] = []
+
+        def search(question: str, k: int) -> List[str]:
+            t0 = time.perf_counter()
+            names = search_file_names(
+                client,
+                collection,
+                vectors[question],
+                k,
+                search_type=setting["search_type"],
+                fetch_k=setting["fetch_k"] or k,
+                lambda_mult=mmr_lambda,
+            )
+            search_latencies.append(time.perf_counter() - t0)
+            return names
+
+        metrics = evaluate_retrieval(search, rows, corpus_names, k=setting["top_k"])
+        for q, latency in zip(metrics["per_question"], search_latencies):
+            q["search_s"] = round(latency, 4)
+        results.append({
+            **setting,
+            "recall_at_k": metrics["recall_at_k"],
+            "mrr": metrics["mrr"],
+            "questions": metrics["questions"],
+            "search_latency_s": latency_summary(search_latencies),
+            "per_question": metrics["per_question"],
+        })
+
+    return {
+        "mode": "retrieval",
+        "collection": collection,
+        "corpus_files": sorted(corpus_names),
+        "embedding_model": embed_model or os.getenv("RAG_EMBED_MODEL") or "text-embedding-3-small",
+        "mmr_lambda": mmr_lambda,
+        "embed_latency_s": latency_summary(embed_latencies),
+        "settings": results,
+    }
+
+
+def _print_retrieval(report: Dict[str, Any]) -> None:
+    print(f"Colección '{report['collection']}': {len(report['corpus_files'])} archivos; "
+          f"embedding p50 {report['embed_latency_s']['p50']}s")
+    header = f"{'search_type':12} {'k':>3} {'fetch_k':>7} {'recall@k':>9} {'MRR':>6} {'p50 s':>7} {'p99 s':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in report["settings"]:
+        lat = r["search_latency_s"]
+        print(
+            f"{r['search_type']:12} {r['top_k']:>3} {str(r['fetch_k'] or '-'):>7} {str(r['recall_at_k']):>9} "
+            f"{str(r['mrr']):>6} {str(lat['p50']):>7} {str(lat['p99']):>7}"
+        )
+
+
+def _retrieval_results(report: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Resultados por pregunta de cada configuración, aplanados para el store."""
+    rows = []
+    for setting in report["settings"]:
+        label = f"{setting['search_type']}@{setting['top_k']}"
+        if setting["search_type"] == "mmr":
+            label += f"/{setting['fetch_k']}"
+        for q in setting["per_question"]:
+            rows.append({
+                "set": label,
+                "question": q["question"],
+                "ok": True,
+                "passed": q["rank"] is not None,
+                "latency_s": q.get("search_s"),
+                "rank": q["rank"],
+                "expected": q["expected"],
+            })
+    return rows
+
+
+def record_run(
+    store: EvalStore,
+    kind: str,
+    report: Dict[str, Any],
+    config: Dict[str, Any],
+    label: Optional[str] = None,
+    **thresholds: float,
+) -> Dict[str, Any]:
+    """Guarda la corrida en el store y devuelve el registro (con regresiones vs. la anterior)."""
+    if kind == "retrieval":
+        per_question = _retrieval_results(report)
+        summary = {
+            **{k: v for k, v in report.items() if k != "settings"},
+            "settings": [{k: v for k, v in s.items() if k != "per_question"} for s in report["settings"]],
+        }
+    else:
+        per_question = report["per_question"]
+        summary = {k: v for k, v in report.items() if k not in ("per_question", "regressions", "compared_to")}
+    return store.record_run(kind, config, summary, per_question, label=label, **thresholds)
+
+
+def _print_regressions(regressions: List[Dict[str, Any]], against: str) -> None:
+    if not regressions:
+        print(f"Sin regresiones frente a {against}")
+        return
+    print(f"{len(regressions)} regresiones frente a {against}:")
+    for r in regressions:
+        where = r.get("setting") or r.get("question") or ""
+        change = f"{r['before']} -> {r['after']}" if "before" in r else "pasaba -> falla"
+        print(f"  [{r['kind']}] {r['metric']} {where[:60]}: {change}")
+
+
+def _load_optional(path: str, label: str) -> List[Dict[str, Any]]:
+    if not path:
+        return []
+    p = Path(path)
+    if not p.exists():
+        print(f"[Aviso] No existe el set {label}: {p}")
+        return []
+    return load_jsonl(p)
+
+
 def main() -> None:
-    parser = argparse.ArgumentParser(description="Evaluación simple de RAG vía /rag/invoke")
+    # Antes del parser: varios defaults salen del entorno (.env incluido)
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Evaluación de RAG: respuestas vía HTTP o solo recuperación")
+    parser.add_argument(
+        "--mode",
+        choices=["answers", "retrieval"],
+        default="answers",
+        help="answers: respuestas completas vía HTTP; retrieval: solo el retriever (recall@k, MRR, latencias)",
+    )
     parser.add_argument("--answerable", type=str, default="eval/answerable.jsonl")
     parser.add_argument("--unanswerable", type=str, default="eval/unanswerable.jsonl")
-    parser.add_argument("--report", type=str, default="eval/report.json")
+    parser.add_argument(
+        "--report",
+        type=str,
+        default=None,
+        help="Por defecto eval/report.json (answers) o eval/report_retrieval.json (retrieval)",
+    )
+    parser.add_argument(
+        "--endpoint",
+        type=str,
+        default=os.getenv("RAG_EVAL_ENDPOINT", "/rag/query"),
+        help="Ruta a evaluar: /rag/query o una ruta LangServe terminada en /invoke",
+    )
+    parser.add_argument("--concurrency", type=int, default=4, help="Preguntas en vuelo a la vez")
+    parser.add_argument("--warmup", type=int, default=2, help="Requests de calentamiento (no se miden)")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument(
+        "--compare",
+        type=str,
+        default=None,
+        help="Reporte anterior (e.g. eval/report_answerable.json); por defecto se compara con la corrida anterior del store",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento relativo tolerado")
+    parser.add_argument("--min-delta", type=float, default=0.05, help="Empeoramiento absoluto mínimo (s)")
+    parser.add_argument("--quality-drop", type=float, default=0.05, help="Caída absoluta tolerada en tasas/recall/MRR")
+    parser.add_argument("--db", type=str, default=None, help="Historial SQLite (por defecto RAG_EVAL_DB o eval/runs.sqlite3)")
+    parser.add_argument("--no-store", action="store_true", help="No registrar la corrida en el historial")
+    parser.add_argument("--label", type=str, default=None, help="Etiqueta libre de la corrida (e.g. commit, rama)")
+    retrieval = parser.add_argument_group("modo retrieval")
+    retrieval.add_argument("--search-types", type=str, default=os.getenv("RAG_SEARCH_TYPE", "similarity"),
+                           help="Separados por coma: similarity,mmr")
+    retrieval.add_argument("--top-k", type=str, default=os.getenv("RAG_TOP_K", "4"), help="Separados por coma, e.g. 2,4,8")
+    retrieval.add_argument("--fetch-k", type=str, default=os.getenv("RAG_FETCH_K", "20"), help="Solo mmr; separados por coma")
+    retrieval.add_argument("--mmr-lambda", type=float, default=float(os.getenv("RAG_MMR_LAMBDA", "0.5") or 0.5))
+    parser.add_argument("--embedding-model", type=str, default=None,
+                        help="Embeddings para recuperación y similitud semántica; por defecto RAG_EMBED_MODEL")
+    parser.add_argument("--no-semantic", action="store_true", help="Sin similitud por embeddings (solo token-F1 y citas)")
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Termina con código 1 si hay regresiones (útil en CI)",
+    )
     args = parser.parse_args()
 
-    load_dotenv()
+    if args.mode == "retrieval":
+        report = eval_retrieval(
+            _load_optional(args.answerable, "answerable"),
+            retrieval_settings(args.search_types, args.top_k, args.fetch_k),
+            mmr_lambda=args.mmr_lambda,
+            embed_model=args.embedding_model,
+        )
+        config = {
+            "answerable": args.answerable,
+            "search_types": args.search_types,
+            "top_k": args.top_k,
+            "fetch_k": args.fetch_k,
+            "mmr_lambda": args.mmr_lambda,
+            "embedding_model": report["embedding_model"],
+            "collection": report["collection"],
+        }
+    else:
+        base = os.getenv("RAG_BASE_URL", "http://localhost:8000")
+        report = asyncio.run(
+            eval_remote(
+                _load_optional(args.answerable, "answerable"),
+                _load_optional(args.unanswerable, "unanswerable"),
+                base,
+                args.endpoint,
+                concurrency=max(1, args.concurrency),
+                warmup=max(0, args.warmup),
+                timeout=args.timeout,
+            )
+        )
+        report.update(score_results(
+            report["per_question"],
+            None if args.no_semantic else _scoring_embeddings(args.embedding_model),
+        ))
+        config = {
+            "answerable": args.answerable,
+            "unanswerable": args.unanswerable,
+            "base_url": base,
+            "endpoint": args.endpoint,
+            "concurrency": report["concurrency"],
+            "warmup": report["warmup"],
+            "timeout": args.timeout,
+        }
+    thresholds = {"tolerance": args.tolerance, "min_delta_s": args.min_delta, "quality_drop": args.quality_drop}
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            report["regressions"] = find_regressions(report, json.load(f), **thresholds)
+        report["compared_to"] = args.compare
+    if not args.no_store:
+        store = get_eval_store(args.db)
+        run = record_run(store, args.mode, report, config, label=args.label, **thresholds)
+        report["run_id"] = run["id"]
+        previous = run["summary"].get("compared_to")
+        if previous and not args.compare:
+            report["regressions"] = run["summary"]["regressions"]
+            report["compared_to"] = f"run:{previous}"
+        print(f"Corrida registrada en {store.path}: {run['id']}")
 
-    report = eval_local(Path(args.answerable), Path(args.unanswerable))
-    Path(args.report).parent.mkdir(parents=True, exist_ok=True)
-    with open(args.report, "w", encoding="utf-8") as f:
+    default_report = "eval/report_retrieval.json" if args.mode == "retrieval" else "eval/report.json"
+    path = Path(args.report or default_report)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
         json.dump(report, f, ensure_ascii=False, indent=2)
-    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.mode == "retrieval":
+        _print_retrieval(report)
+    else:
+        print(json.dumps({k: v for k, v in report.items() if k not in ("per_question", "regressions")},
+                         ensure_ascii=False, indent=2))
+    if "compared_to" in report:
+        _print_regressions(report["regressions"], report["compared_to"])
+
+    if args.fail_on_regression and report.get("regressions"):
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
     main()
-
-
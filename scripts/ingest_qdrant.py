@@ -1,29 +1,34 @@
+"""
+Ingesta los documentos de ``--data-dir`` a la colección ``QDRANT_COLLECTION``.
+
+Uso:
+    python -m scripts.ingest_qdrant --data-dir data
+    python -m scripts.ingest_qdrant --data-dir data --chunker semantic --workers 4
+"""
+
 import argparse
-import hashlib
 import uuid
 import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from pathlib import Path
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
 
 from dotenv import load_dotenv
 
 from langchain_text_splitters import (
     RecursiveCharacterTextSplitter,
 )
-# Carga perezosa/segura de SemanticChunker para evitar fallos de import en entornos sin el módulo
-try:
-    from langchain_experimental.text_splitters import SemanticChunker as _SemanticChunker
-except Exception:  # pragma: no cover
-    _SemanticChunker = None  # type: ignore
-from langchain_community.document_loaders import (
-    PyPDFLoader,
-    TextLoader,
-)
-from langchain_community.document_loaders import Docx2txtLoader
-from langchain_community.vectorstores import Qdrant
-from langchain_openai import OpenAIEmbeddings
 from qdrant_client import QdrantClient
 
+from app.chunking import BREAKPOINT_DEFAULTS, SemanticChunker
+from app.embeddings import get_embeddings
+
+from app.ingestion import load_pages, split_pages, stream_to_qdrant
+from app.vectorstore import doc_type_for
+
 
 def _stable_id(source: str, page: int, chunk_index: int, content: str) -> str:
     # Qdrant solo acepta IDs unsigned integer o UUID.
@@ -32,26 +37,116 @@ def _stable_id(source: str, page: int, chunk_index: int, content: str) -> str:
     return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
 
 
-def _load_documents(data_dir: Path, include_patterns: List[str]) -> List:
-    docs = []
+def _collect_files(data_dir: Path, include_patterns: List[str]) -> List[Path]:
+    # Orden determinístico: patrones en el orden dado y archivos ordenados por ruta
+    files: List[Path] = []
+    seen = set()
     for pattern in include_patterns:
         for file_path in sorted(data_dir.rglob(pattern)):
-            if file_path.suffix.lower() == ".pdf":
-                loader = PyPDFLoader(str(file_path))
-                docs.extend(loader.load())
-            elif file_path.suffix.lower() == ".docx":
-                loader = Docx2txtLoader(str(file_path))
-                docs.extend(loader.load())
-            elif file_path.suffix.lower() == ".doc":
-                print(
-                    f"[Aviso] Se encontró archivo .doc legacy: {file_path}. "
-                    "Convierte a .docx para ingestar (o habilita un loader alternativo)."
-                )
-            else:
-                # Fallback plain text loader (handles .txt/.md/.rst)
-                loader = TextLoader(str(file_path), encoding="utf-8")
-                docs.extend(loader.load())
-    return docs
+            if file_path.is_file() and file_path not in seen:
+                seen.add(file_path)
+                files.append(file_path)
+    return files
+
+
+def _is_legacy_doc(file_path: Path) -> bool:
+    if file_path.suffix.lower() != ".doc":
+        return False
+    print(
+        f"[Aviso] Se encontró archivo .doc legacy: {file_path}. "
+        "Convierte a .docx para ingestar (o habilita un loader alternativo)."
+    )
+    return True
+
+
+def _load_file(file_path: Path) -> Tuple[List, float, Optional[str]]:
+    """Carga un archivo y retorna (páginas, segundos, error).
+
+    Es una función de módulo para poder ejecutarse en un ProcessPoolExecutor;
+    los errores se capturan para que un archivo corrupto no aborte la ingesta.
+    """
+    t0 = time.perf_counter()
+    try:
+        docs = [] if _is_legacy_doc(file_path) else list(load_pages(file_path))
+        return docs, time.perf_counter() - t0, None
+    except Exception as e:
+        return [], time.perf_counter() - t0, f"{type(e).__name__}: {e}"
+
+
+def _report_file(file_path: Path, pages: int, secs: float) -> None:
+    rate = pages / secs if secs > 0 else 0.0
+    print(f"  {file_path}: {pages} páginas en {secs:.2f}s ({rate:.1f} páginas/s)")
+
+
+def _loaded_files(files: List[Path], workers: int) -> Iterator[Tuple[Path, List, float, Optional[str]]]:
+    # Resultados de _load_file en el orden de ``files``; con workers > 1 se
+    # mantienen a lo sumo 2*workers archivos en vuelo para acotar la memoria
+    if workers <= 1 or len(files) <= 1:
+        for file_path in files:
+            yield (file_path, *_load_file(file_path))
+        return
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        remaining = iter(files)
+        for file_path in islice(remaining, 2 * workers):
+            pending.append((file_path, pool.submit(_load_file, file_path)))
+        while pending:
+            file_path, future = pending.popleft()
+            nxt = next(remaining, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(_load_file, nxt)))
+            yield (file_path, *future.result())
+
+
+def _iter_pages(files: List[Path], workers: int = 1) -> Iterator:
+    """Genera las páginas de todos los archivos en orden, aislando fallos por archivo.
+
+    Cada archivo se carga entero antes de emitir sus páginas (en proceso o en un
+    ProcessPoolExecutor si workers > 1), así un archivo que falla a mitad no deja
+    páginas ingestadas: o entra completo o cuenta como fallido, en ambos modos.
+    El tiempo por archivo es solo el de carga, sin el trabajo posterior.
+    """
+    t0 = time.perf_counter()
+    total_pages = 0
+    failures = 0
+    for file_path, docs, secs, error in _loaded_files(files, workers):
+        if error:
+            failures += 1
+            print(f"[Error] No se pudo cargar {file_path}: {error}")
+            continue
+        _report_file(file_path, len(docs), secs)
+        total_pages += len(docs)
+        yield from docs
+
+    elapsed = time.perf_counter() - t0
+    rate = total_pages / elapsed if elapsed > 0 else 0.0
+    print(
+        f"Carga: {len(files) - failures}/{len(files)} archivos, {total_pages} páginas "
+        f"en {elapsed:.2f}s ({rate:.1f} páginas/s, workers={max(1, workers)})"
+    )
+
+
+def _enrich_chunks(splits: Iterable) -> Iterator:
+    """Agrega metadatos e ID estable (en metadata["id"]) a cada chunk."""
+    for idx, d in enumerate(splits):
+        source = d.metadata.get("source", "unknown")
+        file_name = os.path.basename(source)
+        file_ext = os.path.splitext(file_name)[1].lower()
+        page = int(d.metadata.get("page", 0))
+        if "page" in d.metadata:
+            # Solo los PDFs tienen páginas; sin "page" los filtros por rango no los mezclan
+            d.metadata["page"] = page
+        d.metadata.update(
+            {
+                "source": source,
+                "file_name": file_name,
+                "file_ext": file_ext,
+                "doc_type": doc_type_for(file_name),
+                "chunk_index": idx,
+                "id": _stable_id(source, page, idx, d.page_content),
+            }
+        )
+        yield d
 
 
 def main() -> None:
@@ -70,20 +165,43 @@ def main() -> None:
         default="*.pdf,*.txt,*.docx",
         help="Patrones separados por coma a incluir (e.g. '*.pdf,*.txt,*.docx,*.md')",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Procesos para cargar archivos en paralelo (1 = secuencial, 0 = todos los núcleos)",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=64,
+        help="Chunks por lote de embeddings/upsert",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=4,
+        help="Lotes en vuelo entre etapas del pipeline (acota la memoria)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="No usar la caché de texto extraído (RAG_EXTRACTION_CACHE_DIR)",
+    )
     parser.add_argument("--chunker", type=str, choices=["recursive", "semantic"], default="recursive")
     parser.add_argument("--chunk-size", type=int, default=1000)
     parser.add_argument("--chunk-overlap", type=int, default=150)
     parser.add_argument(
         "--semantic-threshold-type",
         type=str,
-        choices=["percentile", "standard_deviation"],
+        choices=list(BREAKPOINT_DEFAULTS),
         default="percentile",
     )
     parser.add_argument(
         "--semantic-threshold",
         type=float,
-        default=95,
-        help="Umbral para SemanticChunker (percentil o desviación estándar)",
+        default=None,
+        help="Umbral para SemanticChunker (por defecto según el tipo: percentil 95, 3 desviaciones...)",
     )
     parser.add_argument(
         "--embedding-model",
@@ -123,8 +241,12 @@ def main() -> None:
         raise SystemExit(f"El directorio de datos no existe: {data_dir}")
 
     include_patterns = [p.strip() for p in args.patterns.split(",") if p.strip()]
-    raw_docs = _load_documents(data_dir, include_patterns)
-    if not raw_docs:
+    if args.no_cache:
+        # Variable de entorno para que también la vean los procesos del pool
+        os.environ["RAG_EXTRACTION_CACHE"] = "0"
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+    files = _collect_files(data_dir, include_patterns)
+    if not files:
         raise SystemExit(
             f"No se encontraron documentos en {data_dir} con patrones {include_patterns}"
         )
@@ -138,67 +260,49 @@ def main() -> None:
         f"Chunker: {args.chunker}"
     )
 
-    embeddings = OpenAIEmbeddings(model=args.embedding_model)
+    # Embeddings con caché (RAG_EMBED_CACHE_DIR): re-ingestas no vuelven a embeber
+    embeddings = get_embeddings(args.embedding_model)
 
     if args.chunker == "semantic":
-        if _SemanticChunker is None:
-            print(
-                "[Aviso] SemanticChunker no disponible en este entorno. "
-                "Se usará chunking 'recursive'. Puedes instalar/actualizar langchain-experimental."
-            )
-            splitter = RecursiveCharacterTextSplitter(
-                chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
-            )
-        else:
-            splitter = _SemanticChunker(
-                embeddings,
-                breakpoint_threshold_type=args.semantic_threshold_type,
-                breakpoint_threshold_amount=args.semantic_threshold,
-            )
+        splitter = SemanticChunker(
+            embeddings,
+            breakpoint_threshold_type=args.semantic_threshold_type,
+            breakpoint_threshold_amount=args.semantic_threshold,
+        )
     else:
         splitter = RecursiveCharacterTextSplitter(
             chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
         )
 
-    splits = splitter.split_documents(raw_docs)
-
-    # IDs estables por chunk
-    ids = []
-    for idx, d in enumerate(splits):
-        # Enriquecer metadatos
-        source = d.metadata.get("source", "unknown")
-        file_name = os.path.basename(source)
-        file_ext = os.path.splitext(file_name)[1].lower()
-        doc_type = (
-            "pdf"
-            if file_ext == ".pdf"
-            else "word" if file_ext in {".doc", ".docx"} else "text"
-        )
-        page = int(d.metadata.get("page", 0))
-        d.metadata.update(
-            {
-                "source": source,
-                "file_name": file_name,
-                "file_ext": file_ext,
-                "doc_type": doc_type,
-                "page": page,
-                "chunk_index": idx,
-            }
-        )
-        ids.append(_stable_id(source, page, idx, d.page_content))
-
     print(
-        f"Subiendo {len(splits)} chunks a Qdrant colección '{qdrant_collection}' en {qdrant_url}..."
+        f"Subiendo chunks en streaming a Qdrant colección '{qdrant_collection}' en {qdrant_url}..."
     )
 
-    # Crea la colección si no existe y hace upsert
-    _ = Qdrant.from_documents(
-        splits,
+    # carga → split → embed → upsert por lotes; crea la colección e índices
+    # de payload (filtros por archivo/tipo/página) si no existen
+    chunks = _enrich_chunks(split_pages(_iter_pages(files, workers=workers), splitter))
+    stats = stream_to_qdrant(
+        chunks,
+        QdrantClient(url=qdrant_url, api_key=qdrant_api_key),
+        qdrant_collection,
         embeddings,
-        url=qdrant_url,
-        api_key=qdrant_api_key,
-        collection_name=qdrant_collection,
-        ids=ids,
+        batch_size=args.batch_size,
+        queue_size=args.queue_size,
+        embedding_model=args.embedding_model,
+    )
+    if not stats["chunks"]:
+        raise SystemExit("No se generaron chunks para ingestar")
+    if isinstance(splitter, SemanticChunker):
+        sem = splitter.throughput()
+        print(
+            f"Chunking semántico: {sem['sentences']} oraciones → {sem['chunks']} chunks "
+            f"en {sem['seconds']}s ({sem['sentences_per_s']} oraciones/s)"
+        )
+    print(
+        f"{stats['chunks']} chunks en {stats['elapsed_s']}s ({stats['chunks_per_s']} chunks/s). "
+        f"Primer lote buscable a los {stats['first_upsert_s']}s. "
+        f"Tiempos: carga+split {stats['load_split_s']}s, embed {stats['embed_s']}s, "
+        f"upsert {stats['upsert_s']}s"
     )
 
     print("Ingesta completada.")
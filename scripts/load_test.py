@@ -0,0 +1,377 @@
+"""
+Generador de carga: reproduce preguntas de JSONL contra /rag/query.
+
+Uso:
+    python -m scripts.load_test --url http://localhost:8080 --rate 5 --duration 60
+    python -m scripts.load_test --url http://localhost:8080 --ramp 1,2,4,8
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from app.eval_store import latency_summary, percentile
+from scripts.benchmark_server import configure_offline
+
+_TEXT_FIELDS = ("question", "body", "title", "text")
+
+
+def load_questions(paths: List[str], field: Optional[str]) -> List[str]:
+    """Preguntas de uno o más JSONL, en orden (``field`` o el primer campo de texto conocido)."""
+    questions = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = json.loads(line)
+                keys = (field,) if field else _TEXT_FIELDS
+                text = next((row[k] for k in keys if isinstance(row.get(k), str) and row[k].strip()), None)
+                if text:
+                    questions.append(text)
+    return questions
+
+
+def _classify(status: Any) -> str:
+    if status == 200:
+        return "ok"
+    if status == 429:
+        return "rate_limited"
+    return "error"
+
+
+class Target:
+    """Cliente del endpoint bajo prueba; también lee ``/metrics`` del servidor."""
+
+    def __init__(self, client: httpx.AsyncClient, endpoint: str, questions: List[str]):
+        self.client = client
+        self.endpoint = endpoint
+        self.questions = questions
+        self._next = 0
+
+    async def send(self) -> Any:
+        question = self.questions[self._next % len(self.questions)]
+        self._next += 1
+        try:
+            r = await self.client.post(self.endpoint, json={"question": question})
+            return r.status_code
+        except httpx.TimeoutException:
+            return "timeout"
+        except httpx.HTTPError as e:
+            return type(e).__name__
+
+    async def server_metrics(self) -> Optional[Dict[str, Any]]:
+        try:
+            r = await self.client.get("/metrics")
+            return r.json() if r.status_code == 200 else None
+        except (httpx.HTTPError, ValueError):
+            return None
+
+
+def _bucket_quantile(buckets: List[int], bounds: List[Any], q: float) -> Optional[float]:
+    # Cuantil aproximado desde el histograma (límite superior del bucket que lo contiene)
+    total = sum(buckets)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for count, bound in zip(buckets, bounds):
+        seen += count
+        if seen >= rank:
+            return bound if bound != "+Inf" else None
+    return None
+
+
+def server_delta(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]], route: str) -> Optional[Dict[str, Any]]:
+    """Diferencia de contadores de ``/metrics`` para la ruta bajo prueba durante un paso."""
+    if not before or not after:
+        return None
+    old = before["routes"].get(route) or {"count": 0, "status": {}, "latency_sum_s": 0.0, "buckets": []}
+    new = after["routes"].get(route)
+    if not new:
+        return None
+    count = new["count"] - old["count"]
+    buckets = [n - (old["buckets"][i] if i < len(old["buckets"]) else 0) for i, n in enumerate(new["buckets"])]
+    return {
+        "requests": count,
+        "status": {k: v - old["status"].get(k, 0) for k, v in new["status"].items() if v - old["status"].get(k, 0)},
+        "mean_latency_s": round((new["latency_sum_s"] - old["latency_sum_s"]) / count, 4) if count else None,
+        "p50_le_s": _bucket_quantile(buckets, after["buckets_le_s"], 0.5),
+        "p99_le_s": _bucket_quantile(buckets, after["buckets_le_s"], 0.99),
+        "in_flight_end": after.get("in_flight"),
+    }
+
+
+def _summarize(results: List[tuple], wall: float, extra: Dict[str, Any]) -> Dict[str, Any]:
+    counts = {"ok": 0, "rate_limited": 0, "error": 0}
+    statuses: Dict[str, int] = {}
+    ok_latencies = []
+    for status, latency in results:
+        kind = _classify(status)
+        counts[kind] += 1
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if kind == "ok":
+            ok_latencies.append(latency)
+    n = len(results)
+    return {
+        **extra,
+        "requests": n,
+        "ok": counts["ok"],
+        "status": statuses,
+        "error_rate": round(counts["error"] / n, 4) if n else 0.0,
+        "rate_limited_rate": round(counts["rate_limited"] / n, 4) if n else 0.0,
+        "throughput_rps": round(counts["ok"] / wall, 2) if wall > 0 else 0.0,
+        "wall_s": round(wall, 3),
+        "latency_s": latency_summary(ok_latencies),
+    }
+
+
+async def open_loop_step(
+    target: Target,
+    rate: float,
+    duration: float,
+    arrival: str,
+    max_inflight: int,
+    rng: random.Random,
+) -> Dict[str, Any]:
+    """
+    Llegadas a tasa fija (constantes o Poisson) sin esperar respuestas, como
+    tráfico real. La latencia se mide desde el instante programado de envío,
+    así que la espera en el cliente también cuenta (sin omisión coordinada).
+    """
+    results: List[tuple] = []
+    tasks = set()
+    dropped = 0
+    lag: List[float] = []
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def fire(scheduled: float) -> None:
+        status = await target.send()
+        results.append((status, loop.time() - scheduled))
+
+    offset = 0.0
+    sent = 0
+    while True:
+        offset += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+        if offset >= duration:
+            break
+        scheduled = start + offset
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        lag.append(max(0.0, loop.time() - scheduled))
+        sent += 1
+        if len(tasks) >= max_inflight:
+            # El generador no da abasto: se descarta en vez de frenar la tasa
+            dropped += 1
+            continue
+        task = asyncio.create_task(fire(scheduled))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+    wall = loop.time() - start
+    return _summarize(results, wall, {
+        "mode": "open",
+        "offered_rps": rate,
+        # Con llegadas Poisson la tasa real del paso varía respecto de la nominal
+        "arrival_rps": round(sent / duration, 2),
+        "dropped": dropped,
+        "scheduler_lag_p99_s": round(percentile(lag, 99) or 0.0, 4),
+    })
+
+
+async def closed_loop_step(target: Target, concurrency: int, duration: float) -> Dict[str, Any]:
+    """``concurrency`` usuarios enviando una pregunta tras otra durante ``duration``."""
+    results: List[tuple] = []
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+
+    async def user() -> None:
+        while loop.time() - start < duration:
+            t0 = loop.time()
+            status = await target.send()
+            results.append((status, loop.time() - t0))
+
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    return _summarize(results, loop.time() - start, {"mode": "closed", "concurrency": concurrency})
+
+
+def _passes(step: Dict[str, Any], args: argparse.Namespace) -> bool:
+    p99 = step["latency_s"]["p99"]
+    keeps_up = step["throughput_rps"] >= 0.9 * step["arrival_rps"]
+    return (
+        step["error_rate"] + step["rate_limited_rate"] <= args.max_error_rate
+        and p99 is not None
+        and p99 <= args.slo_p99
+        and keeps_up
+        and not step["dropped"]
+    )
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    questions = load_questions(args.questions, args.field)
+    if not questions:
+        raise SystemExit("No se encontraron preguntas en los JSONL indicados")
+    if args.shuffle:
+        random.Random(args.seed).shuffle(questions)
+
+    limits = httpx.Limits(max_connections=args.max_inflight, max_keepalive_connections=min(args.max_inflight, 100))
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout, limits=limits)
+    else:
+        configure_offline(args)
+        from app.server import app
+
+        client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://loadtest", timeout=args.timeout, limits=limits
+        )
+    target = Target(client, args.endpoint, questions)
+    route = f"POST {args.endpoint}"
+    rng = random.Random(args.seed)
+    steps: List[Dict[str, Any]] = []
+    summary: Dict[str, Any] = {}
+
+    async def measured(coro_factory) -> Dict[str, Any]:
+        before = await target.server_metrics()
+        step = await coro_factory()
+        step["server"] = server_delta(before, await target.server_metrics(), route)
+        _print_step(step)
+        steps.append(step)
+        return step
+
+    try:
+        if not args.url and not args.skip_ingest:
+            # App en proceso con Qdrant vacío: se indexa data/ antes de medir
+            for p in sorted(Path(args.data_dir).iterdir()):
+                if p.is_file() and not p.name.startswith("."):
+                    await client.post("/ingest/upload", files={"file": (p.name, p.read_bytes())})
+        for _ in range(args.warmup):
+            await target.send()
+
+        if args.saturate:
+            rate = args.start_rate
+            last_ok = None
+            while rate <= args.max_rate:
+                step = await measured(lambda: open_loop_step(
+                    target, rate, args.step_duration, args.arrival, args.max_inflight, rng
+                ))
+                if not _passes(step, args):
+                    break
+                last_ok = step
+                rate = round(rate * args.growth, 2)
+            summary["saturation_rps"] = last_ok["offered_rps"] if last_ok else None
+            summary["saturation_p99_s"] = last_ok["latency_s"]["p99"] if last_ok else None
+            summary["criteria"] = {
+                "slo_p99_s": args.slo_p99,
+                "max_error_rate": args.max_error_rate,
+                "min_throughput_ratio": 0.9,
+            }
+        elif args.ramp:
+            for c in [int(c) for c in args.ramp.split(",") if c.strip()]:
+                await measured(lambda: closed_loop_step(target, c, args.step_duration))
+            # Codo: primer nivel cuyo throughput crece menos de 10% respecto al anterior
+            knee = next(
+                (b["concurrency"] for a, b in zip(steps, steps[1:]) if b["throughput_rps"] < a["throughput_rps"] * 1.1),
+                None,
+            )
+            summary["peak_throughput_rps"] = max(s["throughput_rps"] for s in steps)
+            summary["knee_concurrency"] = knee
+        else:
+            await measured(lambda: open_loop_step(
+                target, args.rate, args.duration, args.arrival, args.max_inflight, rng
+            ))
+    finally:
+        await client.aclose()
+    return {"steps": steps, **summary}
+
+
+def _print_step(step: Dict[str, Any]) -> None:
+    lat = step["latency_s"]
+    load = f"{step['offered_rps']} req/s ofrecidas" if step["mode"] == "open" else f"concurrencia {step['concurrency']}"
+    line = (
+        f"{load}: {step['throughput_rps']} req/s logradas, p50 {lat['p50']}s p90 {lat['p90']}s p99 {lat['p99']}s, "
+        f"errores {step['error_rate']:.1%}, 429 {step['rate_limited_rate']:.1%}"
+    )
+    if step.get("dropped"):
+        line += f", descartadas {step['dropped']}"
+    server = step.get("server")
+    if server:
+        line += f" | servidor: media {server['mean_latency_s']}s, p99 ≤ {server['p99_le_s']}s"
+    print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Generador de carga: reproduce preguntas de JSONL contra /rag/query a tasa o concurrencia dada"
+    )
+    parser.add_argument("--url", type=str, default=None, help="Servidor a probar; por defecto la app en proceso (offline)")
+    parser.add_argument("--endpoint", type=str, default="/rag/query")
+    parser.add_argument("--questions", type=str, nargs="+", default=["eval/answerable.jsonl", "eval/unanswerable.jsonl"])
+    parser.add_argument("--field", type=str, default=None, help="Campo de texto del JSONL (por defecto question/body/title/text)")
+    parser.add_argument("--shuffle", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+
+    mode = parser.add_argument_group("modo")
+    mode.add_argument("--rate", type=float, default=2.0, help="Tasa de llegada (req/s) en lazo abierto")
+    mode.add_argument("--duration", type=float, default=30.0, help="Duración (s) en modo --rate")
+    mode.add_argument("--arrival", choices=["poisson", "constant"], default="poisson")
+    mode.add_argument("--ramp", type=str, default=None, help="Rampa de concurrencia en lazo cerrado, e.g. '1,2,4,8,16'")
+    mode.add_argument("--saturate", action="store_true", help="Subir la tasa hasta violar el SLO")
+    mode.add_argument("--start-rate", type=float, default=1.0)
+    mode.add_argument("--growth", type=float, default=1.5, help="Factor de aumento de tasa por paso")
+    mode.add_argument("--max-rate", type=float, default=500.0)
+    mode.add_argument("--step-duration", type=float, default=20.0, help="Duración (s) de cada paso de rampa/saturación")
+    mode.add_argument("--slo-p99", type=float, default=2.0, help="p99 máximo (s) aceptable en saturación")
+    mode.add_argument("--max-error-rate", type=float, default=0.01, help="Errores + 429 máximos en saturación")
+
+    parser.add_argument("--max-inflight", type=int, default=512, help="Requests abiertos máximos del generador")
+    parser.add_argument("--warmup", type=int, default=4)
+    parser.add_argument("--timeout", type=float, default=60.0)
+
+    offline = parser.add_argument_group("app en proceso (RAG_BACKEND=offline)")
+    offline.add_argument("--data-dir", type=str, default="data")
+    offline.add_argument("--skip-ingest", action="store_true")
+    offline.add_argument("--llm-latency-ms", type=float, default=300.0)
+    offline.add_argument("--tokens-per-s", type=float, default=0.0)
+    offline.add_argument("--tokens", type=int, default=64)
+    offline.add_argument("--embedding-size", type=int, default=256)
+    offline.add_argument("--qdrant-path", type=str, default=":memory:")
+    offline.add_argument("--collection", type=str, default="rag_loadtest")
+    offline.add_argument("--use-cache", action="store_true")
+
+    parser.add_argument("--report", type=str, default=None, help="Ruta opcional para guardar el reporte JSON")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if "saturation_rps" in results:
+        print(f"Punto de saturación: {results['saturation_rps']} req/s (p99 {results['saturation_p99_s']}s)")
+    if "knee_concurrency" in results:
+        print(f"Throughput pico: {results['peak_throughput_rps']} req/s; codo en concurrencia {results['knee_concurrency']}")
+
+    if args.report:
+        report = {
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "target": args.url or "asgi",
+            "settings": {k: v for k, v in vars(args).items() if k != "report"},
+            **results,
+        }
+        Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
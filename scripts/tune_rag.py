@@ -0,0 +1,351 @@
+"""
+Barrido de parámetros de chunking y búsqueda, con frontera de Pareto latencia/calidad.
+
+Uso:
+    python -m scripts.tune_rag
+    python -m scripts.tune_rag --chunk-sizes 800,1000 --search-types similarity,mmr
+"""
+
+import argparse
+import itertools
+import json
+import random
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from qdrant_client import QdrantClient
+
+from app.backends import get_chat_model, get_qdrant_client
+from app.embeddings import get_embeddings
+from app.eval_scoring import reference_answer, token_f1
+from app.eval_store import percentile
+from app.ingestion import CONTENT_PAYLOAD_KEY, load_pages, stream_to_qdrant
+from app.rag_prompt import RAG_PROMPT, format_docs
+from app.usage import token_counter
+from app.retrieval_eval import expected_source, load_jsonl, resolve_sources, search_points
+from app.vectorstore import METADATA_PAYLOAD_KEY
+from scripts.ingest_qdrant import _collect_files, _enrich_chunks
+
+# Perillas de la búsqueda; chunk_size/chunk_overlap obligan a re-ingestar
+CHUNK_KNOBS = ("chunk_size", "chunk_overlap")
+SEARCH_KNOBS = ("search_type", "top_k", "fetch_k", "mmr_lambda")
+_ENV_NAMES = {
+    "chunk_size": "--chunk-size (ingesta)",
+    "chunk_overlap": "--chunk-overlap (ingesta)",
+    "search_type": "RAG_SEARCH_TYPE",
+    "top_k": "RAG_TOP_K",
+    "fetch_k": "RAG_FETCH_K",
+    "mmr_lambda": "RAG_MMR_LAMBDA",
+}
+
+
+def _csv(value: str, cast=str) -> List[Any]:
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def build_space(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    """Grilla completa de configuraciones válidas (fetch_k y lambda solo aplican a mmr)."""
+    space = []
+    seen = set()
+    for size, overlap, search_type, k, fetch_k, lam in itertools.product(
+        _csv(args.chunk_sizes, int),
+        _csv(args.chunk_overlaps, int),
+        _csv(args.search_types),
+        _csv(args.top_k, int),
+        _csv(args.fetch_k, int),
+        _csv(args.mmr_lambdas, float),
+    ):
+        if overlap >= size:
+            continue
+        if search_type != "mmr":
+            fetch_k, lam = None, None
+        elif fetch_k < k:
+            continue
+        config = {
+            "chunk_size": size,
+            "chunk_overlap": overlap,
+            "search_type": search_type,
+            "top_k": k,
+            "fetch_k": fetch_k,
+            "mmr_lambda": lam,
+        }
+        key = tuple(config.values())
+        if key not in seen:
+            seen.add(key)
+            space.append(config)
+    if args.strategy == "random" and args.samples < len(space):
+        space = random.Random(args.seed).sample(space, args.samples)
+    # Agrupar por chunking para ingestar cada colección temporal una sola vez
+    return sorted(space, key=lambda c: tuple(str(c[k]) for k in CHUNK_KNOBS + SEARCH_KNOBS))
+
+
+class ScratchIndex:
+    """Colecciones temporales, una por combinación de chunk_size/chunk_overlap."""
+
+    def __init__(self, client: QdrantClient, embeddings: Any, pages: List[Document], prefix: str, batch_size: int):
+        self.client = client
+        self.embeddings = embeddings
+        self.pages = pages
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.collections: Dict[Tuple[int, int], Dict[str, Any]] = {}
+
+    def get(self, chunk_size: int, chunk_overlap: int) -> Dict[str, Any]:
+        key = (chunk_size, chunk_overlap)
+        if key not in self.collections:
+            name = f"{self.prefix}_{chunk_size}_{chunk_overlap}"
+            if self.client.collection_exists(name):
+                self.client.delete_collection(name)
+            splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+            stats = stream_to_qdrant(
+                _enrich_chunks(splitter.split_documents(self.pages)),
+                self.client,
+                name,
+                self.embeddings,
+                batch_size=self.batch_size,
+            )
+            self.collections[key] = {"name": name, "chunks": stats["chunks"], "ingest_s": stats["elapsed_s"]}
+            print(f"  colección {name}: {stats['chunks']} chunks en {stats['elapsed_s']}s")
+        return self.collections[key]
+
+    def drop(self) -> None:
+        for info in self.collections.values():
+            if self.client.collection_exists(info["name"]):
+                self.client.delete_collection(info["name"])
+
+
+def _hit_document(hit: Any) -> Document:
+    payload = hit.payload or {}
+    return Document(page_content=payload.get(CONTENT_PAYLOAD_KEY, ""), metadata=payload.get(METADATA_PAYLOAD_KEY) or {})
+
+
+def evaluate_config(
+    config: Dict[str, Any],
+    index: ScratchIndex,
+    answerable: List[Dict[str, Any]],
+    unanswerable: List[Dict[str, Any]],
+    vectors: Dict[str, List[float]],
+    count_tokens: Callable[[str], int],
+    llm: Optional[Any],
+) -> Dict[str, Any]:
+    info = index.get(config["chunk_size"], config["chunk_overlap"])
+    corpus_names = {p.metadata.get("file_name") or Path(p.metadata.get("source", "")).name for p in index.pages}
+    search_lat, answer_lat, prompt_tokens, f1s = [], [], [], []
+    ranks: List[Optional[int]] = []
+    abstentions = 0
+    abst_phrase = "no tengo información suficiente"
+
+    def retrieve(question: str) -> List[Document]:
+        t0 = time.perf_counter()
+        hits = search_points(
+            index.client,
+            info["name"],
+            vectors[question],
+            config["top_k"],
+            search_type=config["search_type"],
+            fetch_k=config["fetch_k"] or config["top_k"],
+            lambda_mult=config["mmr_lambda"] if config["mmr_lambda"] is not None else 0.5,
+        )
+        search_lat.append(time.perf_counter() - t0)
+        return [_hit_document(h) for h in hits]
+
+    def answer(question: str, docs: List[Document]) -> Optional[str]:
+        messages = RAG_PROMPT.format_messages(question=question, context=format_docs(docs))
+        prompt_tokens.append(sum(count_tokens(str(m.content)) for m in messages))
+        if llm is None:
+            return None
+        t0 = time.perf_counter()
+        text = str(llm.invoke(messages).content)
+        answer_lat.append(search_lat[-1] + time.perf_counter() - t0)
+        return text
+
+    for row in answerable:
+        docs = retrieve(row["question"])
+        relevant = resolve_sources(expected_source(row), corpus_names)
+        names = [d.metadata.get("file_name", "") for d in docs]
+        ranks.append(next((i + 1 for i, n in enumerate(names) if n in relevant), None))
+        text = answer(row["question"], docs)
+        if text is not None:
+            # La cita final "Fuente: ..." del esperado no forma parte de la respuesta
+            f1s.append(token_f1(reference_answer(row["expected"]), text))
+    for row in unanswerable if llm is not None else []:
+        text = answer(row["question"], retrieve(row["question"]))
+        abstentions += abst_phrase in (text or "").lower()
+
+    n = len(ranks)
+    recall = sum(1 for r in ranks if r) / n if n else 0.0
+    mrr = sum(1 / r for r in ranks if r) / n if n else 0.0
+    result = {
+        **config,
+        "chunks": info["chunks"],
+        "recall_at_k": round(recall, 4),
+        "mrr": round(mrr, 4),
+        "search_p50_s": round(percentile(search_lat, 50) or 0.0, 4),
+        "prompt_tokens_mean": round(sum(prompt_tokens) / len(prompt_tokens), 1) if prompt_tokens else 0.0,
+    }
+    if llm is None:
+        result["quality"] = round((recall + mrr) / 2, 4)
+        result["latency_s"] = result["search_p50_s"]
+        return result
+    f1 = sum(f1s) / len(f1s) if f1s else 0.0
+    abst_rate = abstentions / len(unanswerable) if unanswerable else None
+    result.update({
+        "answer_f1": round(f1, 4),
+        "abstention_rate": round(abst_rate, 4) if abst_rate is not None else None,
+        "answer_p50_s": round(percentile(answer_lat, 50) or 0.0, 4),
+        "quality": round((f1 + abst_rate) / 2 if abst_rate is not None else f1, 4),
+    })
+    result["latency_s"] = result["answer_p50_s"]
+    return result
+
+
+def pareto_front(results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Configuraciones no dominadas: más calidad, menos latencia y menos tokens de prompt."""
+    def dominates(a: Dict[str, Any], b: Dict[str, Any]) -> bool:
+        no_worse = (
+            a["quality"] >= b["quality"]
+            and a["latency_s"] <= b["latency_s"]
+            and a["prompt_tokens_mean"] <= b["prompt_tokens_mean"]
+        )
+        better = (
+            a["quality"] > b["quality"]
+            or a["latency_s"] < b["latency_s"]
+            or a["prompt_tokens_mean"] < b["prompt_tokens_mean"]
+        )
+        return no_worse and better
+
+    return [r for r in results if not any(dominates(o, r) for o in results if o is not r)]
+
+
+def recommend(front: List[Dict[str, Any]], tolerance: float) -> Optional[Dict[str, Any]]:
+    """Dentro de ``tolerance`` de la mejor calidad, la más barata en tokens y luego en latencia."""
+    if not front:
+        return None
+    best = max(r["quality"] for r in front)
+    candidates = [r for r in front if r["quality"] >= best - tolerance]
+    return min(candidates, key=lambda r: (r["prompt_tokens_mean"], r["latency_s"], -r["quality"]))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Barrido de parámetros de RAG (chunking y búsqueda) con frontera de Pareto latencia/calidad"
+    )
+    parser.add_argument("--data-dir", type=str, default="data")
+    parser.add_argument("--patterns", type=str, default="*.pdf,*.txt,*.docx")
+    parser.add_argument("--answerable", type=str, default="eval/answerable.jsonl")
+    parser.add_argument("--unanswerable", type=str, default="eval/unanswerable.jsonl")
+
+    space = parser.add_argument_group("espacio de búsqueda (listas separadas por coma)")
+    space.add_argument("--chunk-sizes", type=str, default="500,1000,1500")
+    space.add_argument("--chunk-overlaps", type=str, default="50,150")
+    space.add_argument("--search-types", type=str, default="similarity,mmr")
+    space.add_argument("--top-k", type=str, default="2,4,8")
+    space.add_argument("--fetch-k", type=str, default="10,20")
+    space.add_argument("--mmr-lambdas", type=str, default="0.3,0.5,0.7")
+    space.add_argument("--strategy", choices=["grid", "random"], default="grid")
+    space.add_argument("--samples", type=int, default=20, help="Configuraciones a muestrear con --strategy random")
+    space.add_argument("--seed", type=int, default=0)
+
+    parser.add_argument(
+        "--answers",
+        action="store_true",
+        help="Generar respuestas con el LLM (calidad = F1 de tokens y abstención); sin esto solo se mide recuperación",
+    )
+    parser.add_argument("--llm-model", type=str, default="gpt-4o")
+    parser.add_argument("--embedding-model", type=str, default=None, help="Por defecto RAG_EMBED_MODEL")
+    parser.add_argument(
+        "--qdrant-path",
+        type=str,
+        default=":memory:",
+        help="Qdrant local para las colecciones temporales; '' usa el Qdrant configurado (QDRANT_URL)",
+    )
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--keep-collections", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.02, help="Calidad que se cede a cambio de menor costo")
+    parser.add_argument("--report", type=str, default="eval/report_tuning.json")
+    args = parser.parse_args()
+
+    load_dotenv()
+
+    files = _collect_files(Path(args.data_dir), _csv(args.patterns))
+    if not files:
+        raise SystemExit(f"No hay documentos en {args.data_dir}")
+    answerable = [r for r in load_jsonl(Path(args.answerable)) if expected_source(r)]
+    unanswerable = load_jsonl(Path(args.unanswerable)) if args.answers and Path(args.unanswerable).exists() else []
+    configs = build_space(args)
+    print(f"{len(configs)} configuraciones ({args.strategy}), {len(answerable)} preguntas answerable")
+
+    embeddings = get_embeddings(args.embedding_model)
+    if args.qdrant_path == ":memory:":
+        client = QdrantClient(":memory:")
+    elif args.qdrant_path:
+        client = QdrantClient(path=args.qdrant_path)
+    else:
+        client = get_qdrant_client()
+    llm = get_chat_model(args.llm_model, temperature=0.2) if args.answers else None
+    count_tokens, tokenizer = token_counter(args.llm_model)
+
+    # Extracción una sola vez; cada chunking re-divide las mismas páginas
+    pages = [p for f in files for p in load_pages(f)]
+    questions = [r["question"] for r in answerable + unanswerable]
+    vectors = dict(zip(questions, embeddings.embed_documents(questions)))
+
+    index = ScratchIndex(client, embeddings, pages, f"tune_{int(time.time())}", args.batch_size)
+    results = []
+    t0 = time.perf_counter()
+    try:
+        for i, config in enumerate(configs, 1):
+            results.append(evaluate_config(config, index, answerable, unanswerable, vectors, count_tokens, llm))
+            if i % 10 == 0 or i == len(configs):
+                print(f"  {i}/{len(configs)} configuraciones evaluadas")
+    finally:
+        if not args.keep_collections:
+            index.drop()
+
+    front = pareto_front(results)
+    best = recommend(front, args.tolerance)
+    front_ids = {id(r) for r in front}
+
+    header = (
+        f"  {'size':>5} {'ovl':>4} {'tipo':10} {'k':>3} {'fetch':>5} {'λ':>4} {'chunks':>6} {'R@k':>6} "
+        f"{'MRR':>6} {'tokens':>7} {'lat s':>7} {'calidad':>7}"
+    )
+    print(header)
+    print("-" * len(header))
+    for r in sorted(results, key=lambda r: (-r["quality"], r["latency_s"])):
+        mark = "*" if id(r) in front_ids else " "
+        print(
+            f"{mark} {r['chunk_size']:>5} {r['chunk_overlap']:>4} {r['search_type']:10} {r['top_k']:>3} "
+            f"{str(r['fetch_k'] or '-'):>5} {str(r['mmr_lambda'] if r['mmr_lambda'] is not None else '-'):>4} "
+            f"{r['chunks']:>6} {r['recall_at_k']:>6} {r['mrr']:>6} {r['prompt_tokens_mean']:>7} "
+            f"{r['latency_s']:>7} {r['quality']:>7}"
+        )
+    print("* = frontera de Pareto (calidad vs latencia vs tokens de prompt)")
+    if best:
+        print("\nConfiguración recomendada:")
+        for knob in CHUNK_KNOBS + SEARCH_KNOBS:
+            if best[knob] is not None:
+                print(f"  {_ENV_NAMES[knob]}={best[knob]}")
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "strategy": args.strategy,
+        "answers": args.answers,
+        "tokenizer": tokenizer,
+        "elapsed_s": round(time.perf_counter() - t0, 3),
+        "quality_metric": "(answer_f1 + abstention_rate) / 2" if args.answers else "(recall@k + MRR) / 2",
+        "results": results,
+        "pareto_front": front,
+        "recommended": best,
+    }
+    Path(args.report).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
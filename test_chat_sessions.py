@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Pruebas de las sesiones de conversación (app.chat_sessions), sin OpenAI:
+el LLM es un ``FakeListChatModel`` y los embeddings ``HashingEmbeddings``.
+"""
+
+import threading
+import time
+import types
+
+import pytest
+from langchain_core.documents import Document
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+from app import chat_sessions
+from app.chat_sessions import (
+    ConversationMemory,
+    MemorySessionStore,
+    SQLiteSessionStore,
+    UnknownSession,
+)
+from app.embeddings import HashingEmbeddings
+from app.usage import count_tokens
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemorySessionStore(ttl_s=60)
+    return SQLiteSessionStore(tmp_path / "sessions.sqlite3", ttl_s=60)
+
+
+def _memory(store, **kwargs):
+    kwargs.setdefault("window_tokens", 10000)
+    return ConversationMemory(
+        store,
+        FakeListChatModel(responses=["resumen acumulado"]),
+        embeddings=HashingEmbeddings(),
+        **kwargs,
+    )
+
+
+def test_ttl_expiry(store, monkeypatch):
+    now = [time.time()]
+    monkeypatch.setattr(chat_sessions, "time", types.SimpleNamespace(time=lambda: now[0], monotonic=time.monotonic))
+    memory = _memory(store)
+    session = memory.add_turn(memory.open(), "hola", "qué tal")
+    assert memory.open(session["id"])["turns"][0]["content"] == "hola"
+
+    now[0] += 61
+    with pytest.raises(UnknownSession):
+        memory.open(session["id"])
+    store.purge()
+    assert store.count() == 0
+
+
+def test_rejects_ids_not_issued_by_server(store):
+    memory = _memory(store)
+    for session_id in ("elegido-por-el-cliente", "x" * 500):
+        with pytest.raises(UnknownSession):
+            memory.open(session_id)
+        with pytest.raises(UnknownSession):
+            with memory.turn(session_id):
+                pass
+    # Sin id se crea una sesión nueva, con id del servidor, que recién existe al guardarse
+    session = memory.open()
+    assert session["id"] and store.get(session["id"]) is None
+    memory.add_turn(session, "hola", "qué tal")
+    assert memory.open(session["id"])["id"] == session["id"]
+
+
+def test_add_turn_trims_window_and_folds_summary(store):
+    answer = "respuesta larga " * 20
+    pair_tokens = count_tokens("pregunta 0") + count_tokens(answer)
+    memory = _memory(store, window_tokens=pair_tokens * 2)
+    session = memory.open()
+    for i in range(4):
+        session = memory.add_turn(session, f"pregunta {i}", answer)
+
+    saved = memory.open(session["id"])
+    assert [t["content"] for t in saved["turns"] if t["role"] == "user"] == ["pregunta 2", "pregunta 3"]
+    assert sum(t["tokens"] for t in saved["turns"]) <= memory.window_tokens
+    assert saved["summary"] == "resumen acumulado"
+    assert saved["summarized_turns"] == 4
+    # El resumen va como system antes de los turnos de la ventana
+    messages = memory.messages(saved, system="Sos un asistente")
+    assert "resumen acumulado" in messages[0].content
+    assert len(messages) == 5
+
+
+def test_add_turn_keeps_last_pair_even_if_over_window(store):
+    memory = _memory(store, window_tokens=1)
+    session = memory.add_turn(memory.open(), "pregunta", "respuesta " * 50)
+    session = memory.add_turn(session, "otra", "respuesta " * 50)
+    assert [t["content"] for t in session["turns"]][0] == "otra"
+    assert len(session["turns"]) == 2
+
+
+def test_reusable_context(store):
+    memory = _memory(store, reuse_similarity=0.9)
+    session = memory.open()
+    docs = [(Document(page_content="El plan premium cuesta 10 USD", metadata={"file_name": "precios.pdf"}), 0.8)]
+    memory.remember_context(session, "precio del plan premium anual", docs, filter_key="f1")
+
+    reused = memory.reusable_context(session, "Precio del plan premium anual", filter_key="f1")
+    assert reused is not None
+    assert reused[0][0].page_content == docs[0][0].page_content and reused[0][1] == 0.8
+    # Casi la misma consulta (coseno 0.91 con HashingEmbeddings) también reusa
+    assert memory.reusable_context(session, "el precio del plan premium anual", filter_key="f1") is not None
+
+    assert memory.reusable_context(session, "cuál es el horario de soporte", filter_key="f1") is None
+    assert memory.reusable_context(session, "precio del plan premium anual", filter_key="otro") is None
+    assert memory.stats()["context_reused"] == 2
+
+
+def test_turns_of_a_session_are_serialized(store):
+    memory = _memory(store)
+    session_id = memory.add_turn(memory.open(), "inicio", "ok")["id"]
+    errors = []
+
+    def worker(i):
+        try:
+            with memory.turn(session_id) as session:
+                # Sin el candado, todos leerían la misma sesión y se pisarían al guardar
+                time.sleep(0.01)
+                memory.add_turn(session, f"pregunta {i}", "respuesta")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors
+    assert len(memory.open(session_id)["turns"]) == 2 * 9
+
+
+def test_memory_and_sqlite_stores_match(tmp_path):
+    views = []
+    for store in (MemorySessionStore(), SQLiteSessionStore(tmp_path / "sessions.sqlite3")):
+        memory = _memory(store, window_tokens=40)
+        session = memory.open()
+        session["id"] = "fijo"
+        memory.remember_context(session, "consulta", [(Document(page_content="texto", metadata={"file_name": "a.pdf"}), 0.5)])
+        for i in range(3):
+            session = memory.add_turn(session, f"pregunta {i}", "respuesta " * 10)
+        view = memory.view(memory.open("fijo"))
+        view.pop("created_at"), view.pop("updated_at")
+        views.append(view)
+        # Lo que devuelve el store es una copia: modificarla no cambia la sesión guardada
+        copy = store.get("fijo")
+        copy["turns"].clear()
+        assert store.get("fijo")["turns"]
+        assert store.delete("fijo") and store.get("fijo") is None
+    assert views[0] == views[1]
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Paridad del chunker semántico (app.chunking) con el SemanticChunker de
+``langchain_experimental``, con ``HashingEmbeddings`` para no llamar a OpenAI.
+"""
+
+import pytest
+from langchain_experimental.text_splitter import SemanticChunker as LangChainSemanticChunker
+
+from app.chunking import BREAKPOINT_DEFAULTS, SemanticChunker
+from app.embeddings import HashingEmbeddings
+
+TOPICS = [
+    [
+        "El plan premium cuesta diez dólares por mes.",
+        "El plan anual tiene un descuento del veinte por ciento.",
+        "Los precios no incluyen impuestos locales.",
+        "La factura se envía por correo el primer día del mes.",
+    ],
+    [
+        "El soporte atiende de lunes a viernes.",
+        "Los tickets urgentes se responden en menos de dos horas.",
+        "El chat de soporte está disponible en la web!",
+        "Fuera de horario hay una guardia para incidentes críticos.",
+    ],
+    [
+        "Qdrant guarda los vectores en colecciones.",
+        "Cada punto tiene un payload con metadatos?",
+        "Los filtros por payload se aplican antes de la búsqueda.",
+        "Los índices de payload aceleran esos filtros.",
+        "Las colecciones se pueden replicar entre nodos.",
+    ],
+]
+
+TEXTS = [
+    " ".join(s for topic in TOPICS for s in topic),
+    " ".join(TOPICS[0][:2]),
+    TOPICS[1][0],
+    " ".join(TOPICS[2] + TOPICS[0]),
+]
+
+
+@pytest.mark.parametrize("threshold_type", list(BREAKPOINT_DEFAULTS))
+@pytest.mark.parametrize("text", TEXTS, ids=["tres-temas", "dos-oraciones", "una-oracion", "dos-temas"])
+def test_split_text_matches_langchain(threshold_type, text):
+    embeddings = HashingEmbeddings()
+    ours = SemanticChunker(embeddings, breakpoint_threshold_type=threshold_type)
+    theirs = LangChainSemanticChunker(embeddings, breakpoint_threshold_type=threshold_type)
+    assert ours.split_text(text) == theirs.split_text(text)
+
+
+@pytest.mark.parametrize("threshold_type", list(BREAKPOINT_DEFAULTS))
+def test_split_texts_batch_matches_one_by_one(threshold_type):
+    """Embeber varios textos en un solo lote no mezcla las distancias entre textos."""
+    embeddings = HashingEmbeddings()
+    ours = SemanticChunker(embeddings, breakpoint_threshold_type=threshold_type, batch_size=7)
+    theirs = LangChainSemanticChunker(embeddings, breakpoint_threshold_type=threshold_type)
+    assert ours.split_texts(TEXTS) == [theirs.split_text(t) for t in TEXTS]
+    assert ours.last_stats["chunks"] == sum(len(c) for c in ours.split_texts(TEXTS))
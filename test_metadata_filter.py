@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Pruebas de ``build_metadata_filter`` contra un Qdrant en memoria, con los
+metadatos que escriben la ingesta del servidor y ``scripts/ingest_qdrant.py``.
+"""
+
+import pytest
+from qdrant_client import QdrantClient
+from qdrant_client.http import models as rest
+
+from app.vectorstore import METADATA_PAYLOAD_KEY, build_metadata_filter, doc_type_for
+
+# (file_name, doc_type, page): "docx"/"txt" como los guardaba el servidor antes de unificar
+POINTS = [
+    ("informe.pdf", "pdf", 0),
+    ("informe.pdf", "pdf", 3),
+    ("informe.pdf", "pdf", 7),
+    ("manual.docx", "word", None),
+    ("viejo.docx", "docx", None),
+    ("notas.txt", "text", None),
+    ("antiguas.txt", "txt", None),
+]
+
+
+@pytest.fixture(scope="module")
+def client():
+    client = QdrantClient(":memory:")
+    client.create_collection("c", vectors_config=rest.VectorParams(size=2, distance=rest.Distance.COSINE))
+    points = []
+    for i, (file_name, doc_type, page) in enumerate(POINTS):
+        metadata = {"file_name": file_name, "doc_type": doc_type}
+        if page is not None:
+            metadata["page"] = page
+        points.append(rest.PointStruct(id=i, vector=[1.0, 0.0], payload={METADATA_PAYLOAD_KEY: metadata}))
+    client.upsert("c", points)
+    return client
+
+
+def _matches(client, **kwargs):
+    points, _ = client.scroll("c", scroll_filter=build_metadata_filter(**kwargs), limit=100)
+    return sorted((p.payload[METADATA_PAYLOAD_KEY]["file_name"], p.payload[METADATA_PAYLOAD_KEY].get("page")) for p in points)
+
+
+def test_no_constraints():
+    assert build_metadata_filter() is None
+    assert build_metadata_filter(file_names=[], doc_types=[]) is None
+
+
+def test_doc_type_for():
+    assert doc_type_for("a.PDF") == "pdf"
+    assert doc_type_for("dir/b.docx") == doc_type_for("c.doc") == "word"
+    assert doc_type_for("d.md") == doc_type_for("e.txt") == "text"
+
+
+@pytest.mark.parametrize("doc_types", [["word"], ["docx"], [".DOCX"], ["doc"]])
+def test_word_aliases_match_both_vocabularies(client, doc_types):
+    assert _matches(client, doc_types=doc_types) == [("manual.docx", None), ("viejo.docx", None)]
+
+
+def test_text_aliases(client):
+    expected = [("antiguas.txt", None), ("notas.txt", None)]
+    assert _matches(client, doc_types=["text"]) == expected
+    assert _matches(client, doc_types=["txt"]) == expected
+
+
+def test_file_names_and_doc_types_combine(client):
+    assert _matches(client, file_names=["informe.pdf", "notas.txt"], doc_types=["pdf"]) == [
+        ("informe.pdf", 0), ("informe.pdf", 3), ("informe.pdf", 7),
+    ]
+
+
+def test_page_range_is_inclusive_and_only_pdfs(client):
+    assert _matches(client, page_from=3, page_to=7) == [("informe.pdf", 3), ("informe.pdf", 7)]
+    assert _matches(client, page_to=0) == [("informe.pdf", 0)]
+    # Los documentos sin páginas no entran en ningún rango
+    assert _matches(client, page_from=0, doc_types=["word"]) == []
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Pruebas del rate limit por token bucket (app.rate_limit), sin servidor.
+
+El reloj del módulo se reemplaza por uno manual para que el rellenado sea exacto.
+"""
+
+import types
+
+import pytest
+
+from app import rate_limit
+from app.rate_limit import (
+    MemoryBucketStore,
+    RateLimiter,
+    SQLiteBucketStore,
+    parse_rule,
+)
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limit, "time", types.SimpleNamespace(monotonic=clock, time=clock))
+    return clock
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, clock):
+    if request.param == "memory":
+        return MemoryBucketStore()
+    return SQLiteBucketStore(tmp_path / "buckets.sqlite3")
+
+
+def test_parse_rule():
+    assert parse_rule("30/60") == (30, 60.0)
+    assert parse_rule("5") == (5, 60.0)
+    assert parse_rule("") is None
+    assert parse_rule("0") is None
+    with pytest.raises(ValueError):
+        parse_rule("-1/60")
+
+
+def test_refill(store, clock):
+    """Capacidad 3 en 30 s: una ficha cada 10 s; las mismas cuentas en memoria y en SQLite."""
+    rate = 3 / 30
+    results = [store.take("k", 3, rate, 30) for _ in range(4)]
+    assert [r[0] for r in results] == [True, True, True, False]
+    allowed, remaining, retry_after, reset = results[-1]
+    assert remaining == pytest.approx(0)
+    assert retry_after == pytest.approx(10)
+    assert reset == pytest.approx(30)
+
+    clock.now += 5
+    assert store.take("k", 3, rate, 30)[0] is False
+    clock.now += 5
+    allowed, remaining, _, _ = store.take("k", 3, rate, 30)
+    assert allowed and remaining == pytest.approx(0)
+
+    # Un bucket nunca pasa de la capacidad
+    clock.now += 1000
+    assert store.take("k", 3, rate, 30)[1] == pytest.approx(2)
+    # Los buckets son por clave
+    assert store.take("otro", 3, rate, 30)[1] == pytest.approx(2)
+
+
+def test_memory_store_evicts_idle_and_caps_clients(clock):
+    store = MemoryBucketStore(max_clients=2)
+    for key in ("a", "b", "c"):
+        store.take(key, 5, 1.0, 5)
+    assert store.count() == 2
+    assert store.evicted == 1
+
+    # Pasado idle_s los buckets se llenaron solos: se descartan al tomar otro
+    clock.now += 6
+    store.take("d", 5, 1.0, 5)
+    assert store.count() == 1
+    assert store.evicted == 3
+
+
+def test_sqlite_store_purges_idle(tmp_path, clock):
+    store = SQLiteBucketStore(tmp_path / "buckets.sqlite3", purge_every=2)
+    store.take("a", 5, 1.0, 5)
+    clock.now += 6
+    store.take("b", 5, 1.0, 5)
+    assert store.count() == 1
+    assert store.evicted == 1
+
+
+def _limiter(store=None, **kwargs):
+    return RateLimiter(store or MemoryBucketStore(), {"rag": (2, 60.0), "ingest": (1, 60.0)}, **kwargs)
+
+
+def test_check_headers(clock):
+    limiter = _limiter()
+    allowed, headers = limiter.check("rag", "ip:1.2.3.4")
+    assert allowed
+    assert headers["RateLimit-Limit"] == "2"
+    assert headers["RateLimit-Remaining"] == "1"
+    assert headers["RateLimit-Reset"] == "30"
+    assert headers["RateLimit-Policy"] == "2;w=60"
+    assert "Retry-After" not in headers
+
+    limiter.check("rag", "ip:1.2.3.4")
+    allowed, headers = limiter.check("rag", "ip:1.2.3.4")
+    assert not allowed
+    assert headers["Retry-After"] == "30"
+    assert limiter.stats()["rules"]["rag"]["limited"] == 1
+
+
+def test_endpoint_class_templates_post_only():
+    limiter = _limiter()
+    assert limiter.endpoint_class("POST", "/rag/query") == "rag"
+    assert limiter.endpoint_class("POST", "/rag/query/") == "rag"
+    assert limiter.endpoint_class("GET", "/rag/query") is None
+    assert limiter.endpoint_class("POST", "/ingest/upload/sessions/abc-123/complete") == "ingest"
+    assert limiter.endpoint_class("POST", "/ingest/upload/sessions/a/b/complete") is None
+    assert limiter.endpoint_class("PUT", "/ingest/upload/sessions/abc-123") is None
+    # Sin regla para "chat" no se limita aunque la ruta esté mapeada
+    assert limiter.endpoint_class("POST", "/chatgpt/chat") is None
+
+
+def test_client_id_proxy_headers():
+    headers = {"x-forwarded-for": "6.6.6.6, 10.0.0.1, 203.0.113.9"}
+    assert _limiter().client_id(headers, "10.1.1.1") == "ip:10.1.1.1"
+    trusted = _limiter(trust_proxy=True)
+    # El último X-Forwarded-For lo agrega el proxy; los anteriores los inventa el cliente
+    assert trusted.client_id(headers, "10.1.1.1") == "ip:203.0.113.9"
+    assert trusted.client_id({**headers, "fly-client-ip": "198.51.100.7"}, "10.1.1.1") == "ip:198.51.100.7"
+    assert trusted.client_id({}, "10.1.1.1") == "ip:10.1.1.1"
+
+
+def test_client_id_api_keys():
+    limiter = _limiter(api_keys=["secreta"])
+    key_id = limiter.client_id({"x-api-key": "secreta"}, "1.1.1.1")
+    assert key_id.startswith("key:") and "secreta" not in key_id
+    assert limiter.client_id({"authorization": "Bearer secreta"}, "1.1.1.1") == key_id
+    # Una key desconocida cuenta como la IP
+    assert limiter.client_id({"x-api-key": "inventada"}, "1.1.1.1") == "ip:1.1.1.1"
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Pruebas de los límites de tamaño de /ingest/* y del candado de las sesiones
+de upload reanudables. No llegan a Qdrant ni a OpenAI: se cortan antes.
+"""
+
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import server
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("INGEST_UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setenv("INGEST_MAX_REQUEST_MB", "1")
+    return TestClient(server.app)
+
+
+def _chunked_body(total: int, block: int = 64 * 1024):
+    boundary = b"--limite"
+    yield boundary + b'\r\nContent-Disposition: form-data; name="file"; filename="a.txt"\r\n\r\n'
+    for _ in range(total // block):
+        yield b"x" * block
+    yield b"\r\n" + boundary + b"--\r\n"
+
+
+def test_chunked_upload_without_content_length_is_rejected(client, tmp_path):
+    response = client.post(
+        "/ingest/upload",
+        content=_chunked_body(4 * 1024 * 1024),
+        headers={"Content-Type": "multipart/form-data; boundary=limite"},
+    )
+    assert response.status_code == 411
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_upload_over_content_length_limit_is_rejected(client, tmp_path):
+    response = client.post("/ingest/upload", files={"file": ("a.txt", b"x" * (2 * 1024 * 1024), "text/plain")})
+    assert response.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+def _create_session(client, size=10):
+    response = client.post("/ingest/upload/sessions", json={"filename": "a.txt", "size": size})
+    assert response.status_code == 200
+    return response.json()["upload_id"]
+
+
+def test_chunked_put_is_capped_by_declared_size(client, tmp_path):
+    upload_id = _create_session(client)
+    response = client.put(
+        f"/ingest/upload/sessions/{upload_id}",
+        content=iter([b"x" * 8, b"x" * 8]),
+        headers={"Upload-Offset": "0"},
+    )
+    assert response.status_code == 413
+    assert os.path.getsize(tmp_path / f"{upload_id}.part") == 0
+
+
+def test_delete_waits_for_the_session_lock(client, tmp_path):
+    upload_id = _create_session(client)
+    meta_path, part_path = tmp_path / f"{upload_id}.json", tmp_path / f"{upload_id}.part"
+
+    with server._upload_session_lock(upload_id, meta_path):
+        response = client.delete(f"/ingest/upload/sessions/{upload_id}")
+        assert response.status_code == 409
+        assert meta_path.exists() and part_path.exists()
+
+    response = client.delete(f"/ingest/upload/sessions/{upload_id}")
+    assert response.status_code == 200 and response.json()["deleted"] is True
+    assert not meta_path.exists() and not part_path.exists()
+    assert client.delete(f"/ingest/upload/sessions/{upload_id}").json()["deleted"] is False
+
+
+def test_purge_skips_sessions_in_use(client, tmp_path, monkeypatch):
+    busy, idle = _create_session(client), _create_session(client)
+    monkeypatch.setenv("INGEST_UPLOAD_TTL_HOURS", "0")
+
+    with server._upload_session_lock(busy, tmp_path / f"{busy}.json"):
+        server._purge_stale_sessions()
+    assert (tmp_path / f"{busy}.json").exists() and (tmp_path / f"{busy}.part").exists()
+    assert not (tmp_path / f"{idle}.json").exists() and not (tmp_path / f"{idle}.part").exists()